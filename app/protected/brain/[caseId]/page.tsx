@@ -4,7 +4,7 @@ import { useEffect, useMemo, useState } from "react";
 import { useParams } from "next/navigation";
 import Link from "next/link";
 import { ArrowLeft, ChevronDown, ChevronUp } from "lucide-react";
-import { CaseData, Timepoint } from "@/lib/brain/types";
+import { CaseData, ImageResult, ImageVariant, Timepoint } from "@/lib/brain/types";
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
 import { Checkbox } from "@/components/ui/checkbox";
@@ -13,6 +13,9 @@ import { requestVeoVideo } from "@/lib/brain/video";
 
 const ALL_TPS: Timepoint[] = ["now", "3m", "6m", "12m"];
 
+// Prefer the locally mirrored WebP variant; fall back to the original URL.
+const imageSrc = (img: ImageResult, variant: ImageVariant = "preview") => img.mirrors?.[variant] ?? img.url;
+
 export default function BrainCaseOutputPage() {
   const params = useParams<{ caseId: string }>();
   const caseId = params.caseId;
@@ -78,12 +81,18 @@ export default function BrainCaseOutputPage() {
     })();
   }, [caseId]);
 
+  // Show each streamed image in the grid before the whole batch is saved.
+  const onImage = (image: ImageResult) =>
+    setData((prev) =>
+      prev ? { ...prev, images: { ...prev.images, [image.timepoint]: image } } : prev
+    );
+
   const onGenerate = () => {
     (async () => {
       setLoading(true);
       setError(null);
       try {
-        const updated = await generateImagesSupabase({ caseId });
+        const updated = await generateImagesSupabase({ caseId, onImage });
         setData(updated);
       } catch {
         setError("Failed to generate images");
@@ -104,6 +113,7 @@ export default function BrainCaseOutputPage() {
           caseId,
           additionalPrompt: editText.trim(),
           timepoints: tps,
+          onImage,
         });
         setData(updated);
         setEditText("");
@@ -163,7 +173,7 @@ export default function BrainCaseOutputPage() {
                   <div className="relative w-full overflow-hidden bg-black border border-white/20 aspect-video">
                     {data.images[scrubTp]?.url ? (
                       <img
-                        src={data.images[scrubTp]!.url}
+                        src={imageSrc(data.images[scrubTp]!)}
                         alt={`${scrubTp} brain image`}
                         className="w-full h-full object-cover"
                       />
@@ -236,7 +246,7 @@ export default function BrainCaseOutputPage() {
                   <div className="relative w-full overflow-hidden rounded bg-black border border-white/20 aspect-video select-none">
                     {data.images[compareRight]?.url ? (
                       <img
-                        src={data.images[compareRight]!.url}
+                        src={imageSrc(data.images[compareRight]!)}
                         alt={`${compareRight} brain image`}
                         className="absolute inset-0 w-full h-full object-cover"
                       />
@@ -247,7 +257,7 @@ export default function BrainCaseOutputPage() {
                         style={{ width: `${comparePos}%` }}
                       >
                         <img
-                          src={data.images[compareLeft]!.url}
+                          src={imageSrc(data.images[compareLeft]!)}
                           alt={`${compareLeft} brain image`}
                           className="w-full h-full object-cover"
                         />
@@ -309,11 +319,11 @@ export default function BrainCaseOutputPage() {
                     {img ? (
                       /* Using <img> to avoid external image config */
                       <img
-                        src={img.url}
+                        src={imageSrc(img)}
                         alt={`${tp} brain image`}
                         className="w-full h-full object-cover cursor-zoom-in"
                         onClick={() => {
-                          if (!annotateMode[tp]) setViewerUrl(img.url);
+                          if (!annotateMode[tp]) setViewerUrl(imageSrc(img, "full"));
                         }}
                       />
                     ) : (
@@ -9,9 +9,9 @@ import { Label } from "@/components/ui/label";
 import { Button } from "@/components/ui/button";
 import { PatientInfo } from "@/lib/brain/types";
 import { createCaseSupabase, updateCaseImagesSupabase } from "@/lib/brain/db";
-import { requestModelPrompt } from "@/lib/brain/model";
+import { ModelPrompt, requestModelPrompt } from "@/lib/brain/model";
 import { requestGeneratedImages } from "@/lib/brain/generator";
-import type { Timepoint } from "@/lib/brain/types";
+import type { ImageResult, Timepoint } from "@/lib/brain/types";
 
 const inputPalette = "text-white placeholder:text-white/60 file:text-white";
 
@@ -37,14 +37,17 @@ export default function BrainInputPage() {
     e.preventDefault();
     setError(null);
     setSubmitting(true);
+    // One key per submission, so a resent request does not start new upstream jobs
+    const submissionId = crypto.randomUUID();
     try {
-      let generatedPrompt: string | null = null;
+      let generated: ModelPrompt | null = null;
       try {
-        generatedPrompt = await requestModelPrompt({
+        generated = await requestModelPrompt({
           patient,
           basePrompt,
           ehrFiles,
           ctScans: ctFiles,
+          idempotencyKey: `${submissionId}:prompt`,
         });
       } catch {
         // ignore backend failures, proceed with user-provided basePrompt
@@ -53,26 +56,32 @@ export default function BrainInputPage() {
       const created = await createCaseSupabase({
         patient,
         basePrompt,
-        generatedPrompt: generatedPrompt ?? null,
+        generatedPrompt: generated?.generatedPrompt ?? null,
         ehrFiles,
         ctScans: ctFiles,
       });
 
-      const finalPrompt = generatedPrompt ?? basePrompt;
+      const finalPrompt = generated?.generatedPrompt ?? basePrompt;
+      const tps: Timepoint[] = ["now", "3m", "6m", "12m"];
+      // Per-timepoint prompts from the same Gemini call, when it gave all of them
+      const perTimepoint = generated && tps.every((tp) => generated?.prompts[tp]) ? generated.prompts : null;
       try {
-        const urls = await requestGeneratedImages({ prompt: finalPrompt });
-        const tps: Timepoint[] = ["now", "3m", "6m", "12m"];
+        const { images: urls, mirrors } = await requestGeneratedImages({
+          prompt: perTimepoint ?? finalPrompt,
+          idempotencyKey: `${submissionId}:images`,
+        });
         const images = tps.reduce((acc, tp) => {
           const url = urls[tp];
           if (url) {
             acc[tp] = {
               url,
               timepoint: tp,
-              promptUsed: finalPrompt,
+              promptUsed: perTimepoint?.[tp] ?? finalPrompt,
+              mirrors: mirrors[tp],
             };
           }
           return acc;
-        }, {} as Record<Timepoint, { url: string; timepoint: Timepoint; promptUsed: string }>);
+        }, {} as Record<Timepoint, ImageResult>);
         if (Object.keys(images).length > 0) {
           await updateCaseImagesSupabase(created.id, images);
         }
@@ -7,17 +7,58 @@ Implement the logic for:
 - generating images for 4 timepoints (now, 3m, 6m, 12m)
 - handling reprompt/edit requests
 - optional video generation based on images
+
+It also serves the model endpoints of flask_app.py (/model/prompt,
+/model/generate_images, /model/generate_video) with the same JSON
+contracts, but async end to end: upstream calls use httpx / the genai
+aio client and jobs are polled with `asyncio.sleep`, so a generation
+that waits minutes on a provider holds no thread and one process can
+carry hundreds of them.
 """
 
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi import Body, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, Request
+from fastapi import Body, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
 from typing import List, Optional, Literal, Dict, Any
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
+import asyncio
 import json
+import os
+import time
 import datetime
+import tempfile
+import uuid
+from pathlib import Path
+
+import bfl_images
+import caching
+import case_store
+import gemini_prompt
+import governor
+import idempotency
+import image_mirror
+import ingest
+import media_store
+import metrics
+import poller
+import providers
+import ref_cache
+import resilience
+import veo_video
+import video_jobs
+import video_render
 
-app = FastAPI(title="Brain Imaging API", version="0.1.0")
+@asynccontextmanager
+async def _lifespan(_app):
+  yield
+  for client in providers.built_clients():
+    if isinstance(client, providers.AsyncProviderClient):
+      await client.aclose()
+
+app = FastAPI(title="Brain Imaging API", version="0.1.0", lifespan=_lifespan)
 
 # Configure CORS as needed for your frontend origin(s)
 app.add_middleware(
@@ -28,7 +69,46 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def _request_metrics(request: Request, call_next):
+  started = time.perf_counter()
+  token = metrics.begin_request()
+  try:
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    route = request.scope.get("route")
+    metrics.HTTP_SECONDS.observe(
+      elapsed, app="fastapi", method=request.method,
+      route=route.path if route else "unmatched", status=response.status_code,
+    )
+    if metrics.SERVER_TIMING:
+      response.headers["Server-Timing"] = metrics.server_timing(elapsed)
+    return response
+  finally:
+    metrics.end_request(token)
+
+@app.exception_handler(ingest.UploadTooLarge)
+async def _upload_too_large(request: Request, exc: ingest.UploadTooLarge):
+  return JSONResponse({"error": str(exc)}, status_code=413)
+
+@app.exception_handler(providers.MissingCredentials)
+async def _missing_credentials(request: Request, exc: providers.MissingCredentials):
+  return JSONResponse({"error": str(exc)}, status_code=503)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+  """Prometheus text format; see metrics.py."""
+  return Response(metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+# Rendered progression videos (shared with the Flask app's Veo output)
+_MEDIA = media_store.MediaStore()
+# Generated images, mirrored as thumb/preview/full WebP (shared with the Flask app)
+_IMAGE_MIRROR = image_mirror.ImageMirror()
+# Responses to generation POSTs sent with an Idempotency-Key (see idempotency.py)
+_IDEMPOTENCY = idempotency.IdempotencyStore()
+
 Timepoint = Literal["now", "3m", "6m", "12m"]
+TIMEPOINTS = ("now", "3m", "6m", "12m")
 
 class Patient(BaseModel):
   firstName: Optional[str] = None
@@ -41,6 +121,8 @@ class ImageResult(BaseModel):
   url: str
   timepoint: Timepoint
   promptUsed: str
+  # { "thumb", "preview", "full": url } served from the local image mirror
+  mirrors: Optional[Dict[str, str]] = None
 
 class Case(BaseModel):
   id: str
@@ -61,7 +143,18 @@ class VideoRequest(BaseModel):
   durationSeconds: Optional[int] = None
   includeTimepoints: Optional[List[Timepoint]] = None
 
-_CASES: Dict[str, Case] = {}
+class CaseList(BaseModel):
+  cases: List[Case]
+  nextCursor: Optional[str] = None
+
+# Persistent, indexed case store (SQLite by default; see case_store.py)
+_CASES: case_store.CaseRepository = case_store.from_env()
+
+async def _load_case(case_id: str) -> Case:
+  data = await run_in_threadpool(_CASES.get, case_id)
+  if not data:
+    raise HTTPException(status_code=404, detail="Case not found")
+  return Case(**data)
 
 def _new_id(prefix: str = "case") -> str:
   import secrets
@@ -100,56 +193,550 @@ async def create_case(
     ctScans=[_file_meta(f) for f in ctScans],
     images={},
   )
-  _CASES[case_id] = created
+  await run_in_threadpool(_CASES.create, created.model_dump())
   return created
 
+@app.get("/cases", response_model=CaseList)
+async def list_cases(
+  limit: int = Query(20, ge=1, le=100),
+  cursor: Optional[str] = None,
+  mrn: Optional[str] = None,
+):
+  """
+  Newest cases first. Pass the returned nextCursor back as `cursor` for the
+  next page; `mrn` filters by patient MRN.
+  """
+  try:
+    cases, next_cursor = await run_in_threadpool(_CASES.list, limit, cursor, mrn)
+  except ValueError:
+    raise HTTPException(status_code=400, detail="Invalid cursor")
+  return CaseList(cases=[Case(**c) for c in cases], nextCursor=next_cursor)
+
 @app.get("/cases/{caseId}", response_model=Case)
 async def get_case(caseId: str):
-  case = _CASES.get(caseId)
-  if not case:
-    raise HTTPException(status_code=404, detail="Case not found")
-  return case
+  return await _load_case(caseId)
+
+# -- BFL images ---------------------------------------------------------------
+
+# Process-wide, as in flask_app.py: one poller for every outstanding upstream
+# job, identical prompts share one BFL job (and recent results), and a
+# governor caps the BFL jobs outstanding at once.
+_POLLER = poller.Poller(transient=(resilience.ProviderUnavailable,))
+_BFL_FLIGHT = caching.SingleFlight(
+  caching.LRUCache(bfl_images.BFL_CACHE_MAX_ENTRIES, ttl=bfl_images.BFL_CACHE_TTL)
+)
+_BFL_GOVERNOR = governor.PriorityGovernor(
+  bfl_images.BFL_GLOBAL_CONCURRENCY, reserve=bfl_images.BFL_INTERACTIVE_RESERVE
+)
+
+metrics.gauge_callback(
+  "poller_jobs_in_flight", "Upstream jobs being polled",
+  lambda: {p: v["in_flight"] for p, v in _POLLER.snapshot().items()}, ["provider"],
+)
+metrics.gauge_callback(
+  "bfl_governor_active", "BFL jobs holding a governor slot",
+  lambda: _BFL_GOVERNOR.stats()["active_by_priority"], ["priority"],
+)
+metrics.gauge_callback(
+  "bfl_governor_queued", "BFL jobs waiting for a governor slot",
+  lambda: _BFL_GOVERNOR.stats()["queued_by_priority"], ["priority"],
+)
+
+async def _bfl_job(prompt: str, api_key: str, on_progress=None) -> str:
+  resp = await providers.bfl_async.post(
+    bfl_images.BFL_URL, headers=bfl_images.submit_headers(api_key), json={"prompt": prompt},
+  )
+  polling_url = bfl_images.parse_submit(resp.json())
+
+  async def check():
+    result = await providers.bfl_async.get(polling_url, headers=bfl_images.poll_headers(api_key))
+    return bfl_images.parse_poll(result.json())
+
+  return await _POLLER.poll("bfl", check, on_progress=on_progress)
+
+async def _bfl_image(prompt: str, api_key: str, on_progress=None) -> str:
+  """
+  Image URL for prompt. Deduplication, caching and the governor work on
+  concurrent futures, so the job coroutine is started on this loop via
+  run_coroutine_threadsafe once it gets a slot. on_progress (called on
+  this loop, see poller.Poller.poll) only hears from a job this call
+  started, not from one it was coalesced into.
+
+  The future is shared with every coalesced caller: a caller that is
+  cancelled (e.g. its SSE client went away) must not cancel it for the
+  others, hence the shield.
+  """
+  loop = asyncio.get_running_loop()
+  future = _BFL_FLIGHT.submit(
+    bfl_images.result_key(prompt),
+    lambda: _BFL_GOVERNOR.submit(
+      lambda: asyncio.run_coroutine_threadsafe(_bfl_job(prompt, api_key, on_progress), loop)
+    ),
+  )
+  return await asyncio.shield(asyncio.wrap_future(future))
+
+def _effective_prompt(case: Case, tp: str, additional_prompt: Optional[str]) -> str:
+  """The prompt a timepoint's image is generated from; stored as its promptUsed."""
+  base = (case.basePrompt + " " + (additional_prompt or "")).strip()
+  return bfl_images.compose_timepoint_prompts(base, [tp])[tp]
+
+async def _generate_one(
+  case: Case, tp: str, additional_prompt: Optional[str], base_url: str, on_progress=None
+) -> ImageResult:
+  prompt_used = _effective_prompt(case, tp, additional_prompt)
+  api_key = os.environ.get("BFL_API_KEY")
+  if not api_key:
+    # No BFL credentials (local development): placeholder image.
+    url = f"https://picsum.photos/seed/{case.id}-{tp}/960/720"
+  else:
+    url = await _bfl_image(prompt_used, api_key, on_progress)
+  mirrors = await run_in_threadpool(_IMAGE_MIRROR.mirrors, {tp: url}, base_url)
+  return ImageResult(
+    url=url,
+    timepoint=tp,  # type: ignore
+    promptUsed=prompt_used,
+    mirrors=mirrors.get(tp),
+  )
 
 @app.post("/cases/{caseId}/generate", response_model=Case)
-async def generate_images(caseId: str, req: GenerateRequest = Body(...)):
+async def generate_images(caseId: str, request: Request, req: GenerateRequest = Body(...)):
   """
-  Generate images for given timepoints (default: all).
-  Integrate your model inference + image generator here.
+  Generate images for given timepoints (default: all) with BFL, one
+  concurrent job per timepoint. A timepoint that fails keeps its previous
+  image; if all fail the request fails with 502. Honors Idempotency-Key.
   """
-  case = _CASES.get(caseId)
-  if not case:
-    raise HTTPException(status_code=404, detail="Case not found")
-  tps = req.timepoints or ["now", "3m", "6m", "12m"]
-  for tp in tps:
-    prompt_used = (case.basePrompt + " " + (req.additionalPrompt or "")).strip()
-    # Replace with real generated image URL
-    case.images[tp] = ImageResult(
-      url=f"https://picsum.photos/seed/{case.id}-{tp}/960/720",
-      timepoint=tp,  # type: ignore
-      promptUsed=prompt_used,
-    )
-  _CASES[caseId] = case
+  async def run():
+    case = await _load_case(caseId)
+    tps = req.timepoints or ["now", "3m", "6m", "12m"]
+    return await _generate_timepoints(case, tps, req.additionalPrompt, str(request.base_url))
+
+  return await idempotency.run_fastapi(_IDEMPOTENCY, request, run)
+
+async def _generate_timepoints(
+  case: Case, tps: List[str], additional_prompt: Optional[str], base_url: str
+) -> Case:
+  results = await asyncio.gather(
+    *(_generate_one(case, tp, additional_prompt, base_url) for tp in tps), return_exceptions=True
+  )
+  done = {}
+  for tp, img in zip(tps, results):
+    if isinstance(img, Exception):
+      print(f"Image generation failed for timepoint {tp}: {img}")
+      continue
+    case.images[tp] = done[tp] = img
+  if not done:
+    raise HTTPException(status_code=502, detail="Image generation failed")
+  # Only the regenerated timepoints are written back.
+  await run_in_threadpool(
+    _CASES.update_images, case.id, {tp: img.model_dump() for tp, img in done.items()}
+  )
   return case
 
+# Comment line sent on idle event streams so proxies keep them open
+SSE_KEEPALIVE_SECONDS = float(os.environ.get("SSE_KEEPALIVE_SECONDS", "15"))
+
+def _sse(event: str, data: Any) -> str:
+  return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/cases/{caseId}/generate/stream")
+async def generate_images_stream(caseId: str, request: Request, req: GenerateRequest = Body(...)):
+  """
+  Streaming variant of /generate (text/event-stream). Each timepoint is
+  saved and sent as soon as it is ready:
+    event: progress  { timepoint, polls, elapsed, status }  while BFL works
+    event: image     ImageResult
+    event: error     { timepoint, error }
+    event: done      Case (after all timepoints)
+  Idle periods are filled with ": keepalive" comment lines.
+  """
+  case = await _load_case(caseId)
+  tps = req.timepoints or ["now", "3m", "6m", "12m"]
+  base_url = str(request.base_url)
+  events = asyncio.Queue()
+
+  async def run(tp):
+    def on_progress(polls, elapsed, status):
+      events.put_nowait(("progress", {"timepoint": tp, "polls": polls, "elapsed": round(elapsed, 1), "status": status}))
+
+    try:
+      img = await _generate_one(case, tp, req.additionalPrompt, base_url, on_progress)
+    except Exception as e:
+      events.put_nowait(("error", (tp, e)))
+    else:
+      events.put_nowait(("image", (tp, img)))
+
+  async def stream():
+    tasks = [asyncio.create_task(run(tp)) for tp in tps]
+    active = len(tasks)
+    try:
+      while active:
+        try:
+          kind, data = await asyncio.wait_for(events.get(), SSE_KEEPALIVE_SECONDS)
+        except asyncio.TimeoutError:
+          yield ": keepalive\n\n"
+          continue
+        if kind == "progress":
+          yield _sse("progress", data)
+          continue
+        active -= 1
+        tp, result = data
+        if kind == "error":
+          yield _sse("error", {"timepoint": tp, "error": str(result)})
+          continue
+        case.images[tp] = result
+        await run_in_threadpool(_CASES.update_images, caseId, {tp: result.model_dump()})
+        yield _sse("image", result.model_dump())
+      yield _sse("done", case.model_dump())
+    finally:
+      # Client gone: stop waiting (shared BFL jobs carry on, see _bfl_image).
+      for task in tasks:
+        task.cancel()
+
+  return StreamingResponse(
+    stream(),
+    media_type="text/event-stream",
+    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+  )
+
 @app.post("/cases/{caseId}/reprompt", response_model=Case)
-async def reprompt_images(caseId: str, req: GenerateRequest = Body(...)):
+async def reprompt_images(caseId: str, request: Request, req: GenerateRequest = Body(...)):
   """
-  Same as /generate but semantic: used when editing additionalPrompt/timepoints.
+  Like /generate, used when editing additionalPrompt/timepoints, but
+  incremental: a timepoint whose effective prompt equals the promptUsed
+  stored with its image keeps that image; only the others are regenerated.
   """
-  return await generate_images(caseId, req)
+  case = await _load_case(caseId)
+  tps = req.timepoints or ["now", "3m", "6m", "12m"]
+  prompts = {tp: _effective_prompt(case, tp, req.additionalPrompt) for tp in tps}
+  unchanged = bfl_images.unchanged_images(
+    prompts, {tp: img.model_dump() for tp, img in case.images.items()}
+  )
+  changed = [tp for tp in tps if tp not in unchanged]
+  if not changed:
+    return case
+  return await _generate_timepoints(case, changed, req.additionalPrompt, str(request.base_url))
+
+def _fetch_keyframe(tp: str, url: str):
+  """
+  A timepoint image for video_render.load_keyframes: the mirrored full-size
+  copy when there is one, otherwise the upstream bytes. An upstream that no
+  longer serves it (e.g. an expired BFL sample URL) is a 502.
+  """
+  import requests
+
+  found = _IMAGE_MIRROR.resolve(image_mirror.url_hash(url), "full")
+  if found is not None and found[0] == "ready":
+    return found[1]["path"]
+  try:
+    resp = providers.fetch.get(url)
+    resp.raise_for_status()
+  except requests.RequestException as e:
+    raise HTTPException(status_code=502, detail=f"Could not fetch the {tp} image: {e}")
+  return resp.content
+
+def _render_case_video(images: Dict[str, str], fps: Optional[int], seconds: Optional[int]) -> str:
+  """Render (or reuse) the progression MP4 for these {tp: url} images; returns its file name."""
+  urls = list(images.values())
+  name = "case_" + caching.hash_key(urls, fps, seconds, video_render.CONFIG)[:24] + ".mp4"
+  if _MEDIA.get(name) is None:
+    with metrics.stage("fetch_keyframes"):
+      keyframes = video_render.load_keyframes([_fetch_keyframe(tp, u) for tp, u in images.items()])
+    with tempfile.TemporaryDirectory() as tmp:
+      out_path = Path(tmp) / name
+      with metrics.stage("render_video"):
+        report = video_render.render(keyframes, out_path, fps=fps, seconds=seconds)
+      metrics.PAYLOAD_BYTES.observe(report.bytes_out, kind="rendered_video")
+      _MEDIA.put(out_path, name, "video/mp4")
+    print(
+      f"Rendered {name}: {report.frames} frames {report.width}x{report.height}@{report.fps}, "
+      f"{report.bytes_out} bytes in {report.seconds:.2f}s"
+    )
+  return name
+
+@app.get("/static/videos/{name}")
+async def serve_video(name: str, request: Request):
+  """Range-capable, conditionally cached video download."""
+  meta = await run_in_threadpool(_MEDIA.get, name)
+  if meta is None:
+    raise HTTPException(status_code=404, detail="Unknown video")
+  headers = media_store.cache_headers(meta)
+  if media_store.not_modified(
+    meta, request.headers.get("if-none-match"), request.headers.get("if-modified-since")
+  ):
+    return Response(status_code=304, headers=headers)
+  return FileResponse(meta["path"], media_type=meta["content_type"], headers=headers)
+
+@app.get("/media/images/{key}/{variant}.webp")
+async def serve_mirrored_image(key: str, variant: str, request: Request):
+  """A mirrored image variant; redirects upstream until the mirror is ready."""
+  found = await run_in_threadpool(_IMAGE_MIRROR.resolve, key, variant)
+  if found is None:
+    raise HTTPException(status_code=404, detail="Unknown image")
+  state, value = found
+  if state == "pending":
+    return RedirectResponse(value, status_code=302, headers={"Cache-Control": "no-store"})
+  headers = media_store.cache_headers(value)
+  if media_store.not_modified(
+    value, request.headers.get("if-none-match"), request.headers.get("if-modified-since")
+  ):
+    return Response(status_code=304, headers=headers)
+  return FileResponse(value["path"], media_type=value["content_type"], headers=headers)
+
+@app.get("/model/media")
+async def media_stats():
+  """Files and bytes held by the media store, the image mirror and the reference-image cache."""
+  media, images, references = await asyncio.gather(
+    run_in_threadpool(_MEDIA.stats),
+    run_in_threadpool(_IMAGE_MIRROR.stats),
+    run_in_threadpool(_REF_CACHE.stats),
+  )
+  return {**media, "images": images, "references": references}
 
 @app.post("/cases/{caseId}/video", response_model=Case)
-async def generate_video(caseId: str, req: VideoRequest = Body({})):
+async def generate_video(caseId: str, request: Request, req: VideoRequest = Body({})):
   """
   Create a progression video from images.
-  Set case.videoUrl to a rendered asset location.
+  Renders locally: the selected timepoint images (default: all that exist,
+  in timeline order) cross-faded at req.fps for req.durationSeconds.
   """
-  case = _CASES.get(caseId)
-  if not case:
-    raise HTTPException(status_code=404, detail="Case not found")
-  # Replace with real video rendering result
-  case.videoUrl = f"https://picsum.photos/seed/{case.id}-video/1280/720"
-  _CASES[caseId] = case
+  case = await _load_case(caseId)
+  wanted = req.includeTimepoints or list(TIMEPOINTS)
+  images = {tp: case.images[tp].url for tp in TIMEPOINTS if tp in wanted and tp in case.images}
+  if not images:
+    raise HTTPException(status_code=400, detail="Case has no images for the requested timepoints")
+  try:
+    name = await run_in_threadpool(_render_case_video, images, req.fps, req.durationSeconds)
+  except video_render.EncoderUnavailable as e:
+    raise HTTPException(status_code=503, detail=str(e))
+  case.videoUrl = str(request.base_url).rstrip("/") + f"/static/videos/{name}"
+  await run_in_threadpool(_CASES.set_video_url, caseId, case.videoUrl)
   return case
 
+# -- Model endpoints (same contracts as flask_app.py) ----------------------------
+
+async def _json_body(request: Request) -> dict:
+  try:
+    payload = await request.json()
+  except ValueError:
+    return {}
+  return payload if isinstance(payload, dict) else {}
+
+async def _call_gemini(base_prompt: str, patient: dict, ehr_files, ct_files):
+  api_key = providers.api_key("gemini")
+  body = await run_in_threadpool(gemini_prompt.build_request, base_prompt, patient, ehr_files, ct_files)
+  payload = gemini_prompt.encode_request(body)
+  with metrics.stage("gemini"):
+    resp = await providers.gemini_async.post(
+      gemini_prompt.url(api_key), headers=gemini_prompt.HEADERS, content=payload
+    )
+  resp.raise_for_status()
+  return gemini_prompt.parse_response(resp.json())
+
+@app.post("/model/prompt")
+async def model_prompt(
+  request: Request,
+  base_prompt: str = Form(""),
+  patient: str = Form("{}"),
+  ehr_files: List[UploadFile] = File(default=[]),
+  ct_scans: List[UploadFile] = File(default=[]),
+):
+  """
+  multipart/form-data as in flask_app.py; returns
+  { "generated_prompt": str, "prompts": { "now", "3m", "6m", "12m" } }.
+  """
+  ehr, ct = await run_in_threadpool(_budget_uploads, ehr_files, ct_scans)
+  try:
+    fingerprint = idempotency.fingerprint_form(
+      [("base_prompt", base_prompt), ("patient", patient)],
+      [("ehr_files", f) for f in ehr] + [("ct_scans", f) for f in ct],
+    )
+    return await idempotency.run_fastapi(
+      _IDEMPOTENCY, request, lambda: _model_prompt(base_prompt, patient, ehr, ct), fingerprint
+    )
+  finally:
+    for f in ehr + ct:
+      f.stream.close()
+
+def _budget_uploads(ehr_files: List[UploadFile], ct_scans: List[UploadFile]):
+  """
+  Starlette has already received the files, so the Flask app's per-file and
+  per-request upload limits are applied by copying them through an
+  UploadBudget (which also hashes them for the cache key). 413 when over.
+  """
+  budget = ingest.UploadBudget()
+  spooled = []
+  try:
+    for f in ehr_files + ct_scans:
+      spooled.append(ingest.spool(ingest.FileUpload(f.file, f.filename, f.content_type), budget))
+  except BaseException:
+    for f in spooled:
+      f.stream.close()
+    raise
+  return spooled[:len(ehr_files)], spooled[len(ehr_files):]
+
+async def _model_prompt(base_prompt: str, patient: str, ehr: list, ct: list):
+  # No Gemini key: 503 here, rather than a fallback prompt on every call
+  providers.api_key("gemini")
+  try:
+    patient_obj = json.loads(patient or "{}")
+  except Exception:
+    patient_obj = {}
+
+  cache_key = await run_in_threadpool(gemini_prompt.cache_key, base_prompt, patient_obj, ehr, ct)
+  cached = await run_in_threadpool(gemini_prompt.cache.get, cache_key)
+  if cached:
+    return cached
+
+  try:
+    result = await _call_gemini(base_prompt, patient_obj, ehr, ct)
+    if result:
+      await run_in_threadpool(gemini_prompt.cache.set, cache_key, result)
+    else:
+      result = gemini_prompt.fallback_result(base_prompt, patient_obj)
+  except Exception as e:
+    result = gemini_prompt.fallback_result(base_prompt, patient_obj, e, len(ehr), len(ct))
+  return result
+
+@app.post("/model/generate_images")
+async def model_generate_images(request: Request):
+  """
+  JSON body: { "prompt": str | {tp: str}, "timepoints": ["now","3m","6m","12m"]?,
+               "previous": { tp: { "url", "promptUsed" } }? }
+  Returns: { "images": { tp: url | null }, "prompts_used": { tp: str }, "reused": [tp],
+             "mirrors": { tp: { "thumb", "preview", "full": url } } }
+  """
+  return await idempotency.run_fastapi(_IDEMPOTENCY, request, lambda: _model_generate_images(request))
+
+async def _model_generate_images(request: Request):
+  payload = await _json_body(request)
+  prompt = payload.get("prompt") or ""
+  timepoints = payload.get("timepoints") or list(bfl_images.TIMEPOINTS)
+  api_key = providers.api_key("bfl")
+
+  prompt_per_tp = bfl_images.compose_timepoint_prompts(prompt, timepoints)
+  unchanged = bfl_images.unchanged_images(prompt_per_tp, payload.get("previous"))
+  # At most BFL_MAX_CONCURRENCY of this request's jobs are outstanding at once.
+  slots = asyncio.Semaphore(max(1, bfl_images.BFL_MAX_CONCURRENCY))
+
+  async def one(tp):
+    if tp in unchanged:
+      return unchanged[tp]
+    async with slots:
+      try:
+        return await _bfl_image(prompt_per_tp[tp], api_key)
+      except Exception as e:
+        print(f"Image generation failed for timepoint {tp}: {e}")
+        return None
+
+  with metrics.stage("bfl_images"):
+    urls = await asyncio.gather(*(one(tp) for tp in timepoints))
+  images = dict(zip(timepoints, urls))
+  base_url = str(request.base_url)
+  generated = {tp: url for tp, url in images.items() if tp not in unchanged}
+  # Reused URLs come from the client: only look up an existing mirror.
+  known = await run_in_threadpool(_IMAGE_MIRROR.mirrors, unchanged, base_url, False)
+  return {
+    "images": images,
+    "prompts_used": prompt_per_tp,
+    "reused": sorted(unchanged),
+    "mirrors": {**known, **await run_in_threadpool(_IMAGE_MIRROR.mirrors, generated, base_url)},
+  }
+
+# Reference images for Veo (shared on-disk cache with the Flask app).
+_REF_CACHE = ref_cache.RefCache()
+
+async def _run_video_job(job: dict, report) -> dict:
+  """Async twin of flask_app._run_video_job: Veo through the genai aio client."""
+  params = job["params"]
+  client = providers.veo_client().aio
+  veo = resilience.limiter("veo")
+
+  if job.get("operation_name"):
+    operation = veo_video.pending_operation(job["operation_name"])
+  else:
+    await report("fetching_reference")
+    ref = None
+    if params.get("image_url"):
+      try:
+        ref = await asyncio.to_thread(_REF_CACHE.get, params["image_url"])
+      except Exception as e:
+        print(f"Failed to use reference image {params['image_url']}: {e}")
+    operation = await veo.acall(lambda: client.models.generate_videos(
+      model=veo_video.VEO_MODEL_NAME,
+      prompt=params["prompt"],
+      config=veo_video.generate_config(ref),
+    ))
+    await report("generating", operation_name=operation.name)
+
+  started = time.time()
+  polls = 0
+
+  async def check():
+    nonlocal operation, polls
+    operation = await veo.acall(lambda: client.operations.get(operation))
+    polls += 1
+    if not operation.done:
+      # Also refreshes the job's lease.
+      await report(f"generating (poll {polls}, {int(time.time() - started)}s)")
+    return operation.done, operation
+
+  if not operation.done:
+    await _POLLER.poll("veo", check)
+  if operation.error:
+    raise RuntimeError(f"Video generation failed: {operation.error}")
+
+  await report("downloading")
+  video = operation.response.generated_videos[0]
+  data = await veo.acall(lambda: client.files.download(file=video.video))
+  filename = f"brain_{uuid.uuid4().hex}.mp4"
+
+  def store():
+    fd, tmp_path = tempfile.mkstemp(suffix=".mp4")
+    with os.fdopen(fd, "wb") as f:
+      f.write(data)
+    return _MEDIA.put(tmp_path, filename, "video/mp4")
+
+  meta = await asyncio.to_thread(store)
+  print(f"Generated video saved as {filename} ({meta['size']} bytes)")
+  return {"video_url": f"{params['base_url']}/static/videos/{filename}"}
+
+_VIDEO_JOBS = video_jobs.lazy_async_queue(lambda: video_jobs.AsyncJobQueue(
+  video_jobs.JobStore(veo_video.VIDEO_JOBS_DB),
+  _run_video_job,
+  max_running=veo_video.VIDEO_MAX_TASKS,
+))
+
+@app.post("/model/generate_video", status_code=202)
+async def model_generate_video(request: Request):
+  """
+  JSON body: { "image_url": str?, "prompt": str | dict | list, "time_point": str?, "seconds": int? }
+  Returns 202: { "job_id", "status", "stage", "status_url" }
+  """
+  async def run():
+    providers.api_key("veo")
+    params = veo_video.job_params(await _json_body(request), str(request.base_url))
+    queue = await _VIDEO_JOBS()
+    job_id = await queue.submit(params)
+    job = await run_in_threadpool(queue.store.get, job_id)
+    return JSONResponse(veo_video.job_response(job), status_code=202)
+
+  return await idempotency.run_fastapi(_IDEMPOTENCY, request, run)
+
+@app.get("/model/generate_video/{job_id}")
+async def model_generate_video_status(job_id: str):
+  """Returns the job's status/stage, plus video_url once it has succeeded."""
+  queue = await _VIDEO_JOBS()
+  job = await run_in_threadpool(queue.store.get, job_id)
+  if job is None:
+    return JSONResponse({"error": "Unknown job"}, status_code=404)
+  return veo_video.job_response(job)
+
+@app.get("/model/poller")
+async def poller_stats():
+  """Per-provider in-flight jobs, checks issued and observed completion quantiles."""
+  return _POLLER.snapshot()
 
+@app.get("/model/providers")
+async def provider_stats():
+  """Per-provider rate/concurrency limits, usage and circuit-breaker state."""
+  return resilience.snapshot()
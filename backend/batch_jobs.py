@@ -0,0 +1,195 @@
+"""
+Disk-backed batches of image-generation jobs.
+
+A batch lives in its own directory under the batch root:
+
+  jobs.jsonl     one submitted job per line, written as the request streams in
+  results.jsonl  one result per line, appended as each job finishes
+  status.json    counters and state, rewritten after every result
+
+A job counts as `failed` when it raised or produced no image at all, and
+as `partial` when only some of its timepoints failed (its result line
+then carries `errors`).
+
+A feeder thread reads jobs.jsonl lazily and keeps at most
+`max_in_flight` jobs outstanding, so neither the input nor the results
+of a large batch are ever held in memory. The actual work is delegated to
+`run_job(job) -> Future`; results are written in completion order and
+carry the job's line `index` (and the caller's `id`, if it sent one).
+
+Batches left running by a previous process are resumed by `recover()`,
+skipping indexes that already have a result line.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+RUNNING = "running"
+COMPLETED = "completed"
+
+
+class BatchError(Exception):
+    pass
+
+
+class BatchRunner:
+    def __init__(self, root, run_job, max_in_flight: int = 4):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.run_job = run_job
+        self.max_in_flight = max(1, max_in_flight)
+        self._lock = threading.Lock()
+
+    def create(self, jobs) -> str:
+        """
+        Spool `jobs` (an iterable of dicts) to disk and start the batch.
+        Raises BatchError on a malformed job; nothing is started then.
+        """
+        batch_id = uuid.uuid4().hex
+        path = self.root / batch_id
+        path.mkdir()
+        total = 0
+        try:
+            with open(path / "jobs.jsonl", "w", encoding="utf-8") as f:
+                for job in jobs:
+                    if not isinstance(job, dict) or not job.get("prompt"):
+                        raise BatchError(f"Job {total} needs a prompt")
+                    f.write(json.dumps(job, separators=(",", ":")) + "\n")
+                    total += 1
+        except BaseException:
+            for child in path.iterdir():
+                child.unlink()
+            path.rmdir()
+            raise
+        if not total:
+            (path / "jobs.jsonl").unlink()
+            path.rmdir()
+            raise BatchError("Batch has no jobs")
+        (path / "results.jsonl").touch()
+        now = time.time()
+        self._write_status(batch_id, {
+            "batch_id": batch_id,
+            "state": RUNNING,
+            "total": total,
+            "done": 0,
+            "failed": 0,
+            "partial": 0,
+            "created_at": now,
+            "updated_at": now,
+        })
+        self._start(batch_id, skip=set())
+        return batch_id
+
+    def status(self, batch_id: str):
+        try:
+            return json.loads((self._dir(batch_id) / "status.json").read_text())
+        except (FileNotFoundError, BatchError):
+            return None
+
+    def results_path(self, batch_id: str) -> Path:
+        return self._dir(batch_id) / "results.jsonl"
+
+    def recover(self) -> int:
+        resumed = 0
+        for path in self.root.iterdir():
+            status = self.status(path.name)
+            if not status or status["state"] != RUNNING:
+                continue
+            skip = set()
+            with open(path / "results.jsonl", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        skip.add(json.loads(line)["index"])
+                    except (ValueError, KeyError):
+                        pass  # torn last line from a crash
+            self._start(path.name, skip)
+            resumed += 1
+        return resumed
+
+    def _dir(self, batch_id: str) -> Path:
+        # batch ids are uuid hex; anything else must not reach the filesystem
+        if not batch_id.isalnum():
+            raise BatchError("Bad batch id")
+        return self.root / batch_id
+
+    def _write_status(self, batch_id: str, status: dict):
+        path = self._dir(batch_id) / "status.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(status))
+        os.replace(tmp, path)
+
+    def _start(self, batch_id: str, skip: set):
+        threading.Thread(
+            target=self._feed, args=(batch_id, skip), name=f"batch-{batch_id[:8]}", daemon=True
+        ).start()
+
+    def _feed(self, batch_id: str, skip: set):
+        path = self._dir(batch_id)
+        slots = threading.BoundedSemaphore(self.max_in_flight)
+        with open(path / "jobs.jsonl", encoding="utf-8") as jobs:
+            for index, line in enumerate(jobs):
+                if index in skip:
+                    continue
+                job = json.loads(line)
+                slots.acquire()
+                try:
+                    future = self.run_job(job)
+                except Exception as e:
+                    self._record(batch_id, index, job, None, e)
+                    slots.release()
+                    continue
+                future.add_done_callback(
+                    lambda f, i=index, j=job: (self._record(batch_id, i, j, f, None), slots.release())
+                )
+        # Wait for the stragglers by taking every slot back.
+        for _ in range(self.max_in_flight):
+            slots.acquire()
+        with self._lock:
+            status = self.status(batch_id)
+            status.update(state=COMPLETED, updated_at=time.time())
+            self._write_status(batch_id, status)
+
+    def _record(self, batch_id: str, index: int, job: dict, future, error):
+        if error is None:
+            error = future.exception()
+        row = {"index": index}
+        if "id" in job:
+            row["id"] = job["id"]
+        if error is None:
+            row.update(future.result())
+        else:
+            row["error"] = str(error)
+        with self._lock:
+            with open(self._dir(batch_id) / "results.jsonl", "a", encoding="utf-8") as f:
+                f.write(json.dumps(row) + "\n")
+            status = self.status(batch_id)
+            status["done"] += 1
+            if error is not None or not any((row.get("images") or {}).values()):
+                status["failed"] += 1
+            elif row.get("errors"):
+                # Status files from before this counter existed lack it.
+                status["partial"] = status.get("partial", 0) + 1
+            status["updated_at"] = time.time()
+            self._write_status(batch_id, status)
+
+
+def lazy_runner(factory):
+    """Build the runner on first use and resume unfinished batches then."""
+    lock = threading.Lock()
+    holder = {}
+
+    def get():
+        with lock:
+            if "runner" not in holder:
+                runner = factory()
+                resumed = runner.recover()
+                if resumed:
+                    print(f"Resumed {resumed} unfinished image batch(es)")
+                holder["runner"] = runner
+            return holder["runner"]
+
+    return get
@@ -0,0 +1,114 @@
+"""
+Benchmark the CT preprocessing stage (ct_preprocess.py).
+
+Reports, per scan, input vs output bytes, bytes saved and preprocessing
+time, plus the base64 payload that would be sent to Gemini before and
+after.
+
+Usage (from backend/):
+  python benchmarks/bench_ct_preprocess.py                 # synthetic series
+  python benchmarks/bench_ct_preprocess.py scan1.png scan2.jpg
+  python benchmarks/bench_ct_preprocess.py --synthetic 120 --max-slices 16
+"""
+
+import argparse
+import io
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+BACKEND = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND))
+
+import ct_preprocess  # noqa: E402
+
+
+class _Upload:
+    def __init__(self, name, data, mimetype):
+        self.filename = name
+        self.mimetype = mimetype
+        self.stream = io.BytesIO(data)
+
+
+def _load(path: Path) -> _Upload:
+    data = path.read_bytes()
+    mime = Image.MIME.get(Image.open(io.BytesIO(data)).format, "application/octet-stream")
+    return _Upload(path.name, data, mime)
+
+
+def _synthetic_series(n: int, size: int = 1024, seed: int = 0):
+    """
+    A phantom head series: an ellipse "skull" with a drifting interior
+    blob, saved as RGB PNGs (what browsers usually upload), with a few
+    exact repeats to exercise deduplication.
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32) / size - 0.5
+    uploads = []
+    for i in range(n):
+        t = i / max(1, n - 1)
+        scale = 0.30 + 0.12 * np.sin(np.pi * t)
+        skull = ((xx / scale) ** 2 + (yy / (scale * 1.2)) ** 2) < 1
+        inner = ((xx / (scale * 0.9)) ** 2 + (yy / (scale * 1.1)) ** 2) < 1
+        blob = ((xx - 0.1 * np.cos(6 * t)) ** 2 + (yy - 0.05) ** 2) < (0.04 + 0.03 * t) ** 2
+        img = np.where(skull & ~inner, 240, np.where(inner, 90, 10)).astype(np.float32)
+        img[blob] = 150
+        img += rng.normal(0, 4, img.shape)
+        arr = np.clip(img, 0, 255).astype(np.uint8)
+        buf = io.BytesIO()
+        Image.fromarray(np.stack([arr] * 3, axis=-1)).save(buf, format="PNG")
+        uploads.append(_Upload(f"synthetic_{i:03d}.png", buf.getvalue(), "image/png"))
+        if i % 10 == 5:
+            uploads.append(_Upload(f"synthetic_{i:03d}_dup.png", buf.getvalue(), "image/png"))
+    return uploads
+
+
+def _b64_len(n: int) -> int:
+    return 4 * ((n + 2) // 3)
+
+
+def run(label: str, uploads, config: dict):
+    started = time.perf_counter()
+    prepared, report = ct_preprocess.prepare_series(uploads, config)
+    wall = time.perf_counter() - started
+
+    print(f"\n== {label}: {len(uploads)} file(s) ==")
+    print(f"{'file':<32}{'bytes in':>12}{'bytes out':>12}{'saved':>9}")
+    for row in report.per_file:
+        saved = 1 - row["bytes_out"] / row["bytes_in"] if row["bytes_in"] else 0
+        print(f"{row['file'][:31]:<32}{row['bytes_in']:>12}{row['bytes_out']:>12}{saved:>8.1%}")
+    saved = 1 - report.bytes_out / report.bytes_in if report.bytes_in else 0
+    per_scan_ms = 1000 * wall / max(1, len(uploads))
+    print(
+        f"slices in: {report.input_slices}  duplicates dropped: {report.duplicates_dropped}  "
+        f"subset dropped: {report.subset_dropped}  images out: {len(prepared)}"
+    )
+    print(
+        f"bytes: {report.bytes_in} -> {report.bytes_out} ({saved:.1%} saved); "
+        f"base64 payload: {_b64_len(report.bytes_in)} -> "
+        f"{sum(_b64_len(len(p.stream.getvalue())) for p in prepared)}"
+    )
+    print(f"time: {wall * 1000:.1f} ms total, {per_scan_ms:.1f} ms per scan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", type=Path)
+    parser.add_argument("--synthetic", type=int, default=40, help="slices in the synthetic series (0 to skip)")
+    parser.add_argument("--max-edge", type=int, default=ct_preprocess.CONFIG["max_edge"])
+    parser.add_argument("--max-slices", type=int, default=ct_preprocess.CONFIG["max_slices"])
+    parser.add_argument("--quality", type=int, default=ct_preprocess.CONFIG["jpeg_quality"])
+    args = parser.parse_args()
+    config = {"max_edge": args.max_edge, "max_slices": args.max_slices, "jpeg_quality": args.quality}
+
+    for path in args.paths:
+        run(path.name, [_load(path)], config)
+    if args.synthetic:
+        run("synthetic series", _synthetic_series(args.synthetic), config)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark cold-start import time of the backend apps.
+
+Each run imports the app module in a fresh interpreter (what an
+autoscaled worker pays before it can serve its first request) and
+reports wall time plus which provider SDKs / HTTP stacks got loaded.
+Provider API keys are removed from the environment, so this also checks
+that the apps start without credentials.
+
+--eager imports the provider SDKs up front first, the way flask_app.py
+did before the provider registry, to show the difference on this machine.
+
+Usage (from backend/):
+  python benchmarks/bench_import_time.py
+  python benchmarks/bench_import_time.py flask_app -n 20 --eager
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent
+
+# Loaded lazily by providers.py; reported when an import pulls them in anyway.
+WATCHED = ("google.genai", "google.genai.types", "requests", "httpx")
+EAGER = "from google import genai; from google.genai import types; import requests"
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+{pre}
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {watched!r} if m in sys.modules]}}))
+"""
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    for name in ("GEMINI_API_KEY", "GOOGLE_API_KEY", "BFL_API_KEY"):
+        env.pop(name, None)
+    env.setdefault("CASE_STORE", "memory")
+    return env
+
+
+def measure(module: str, eager: bool) -> dict:
+    code = _PROBE.format(pre=EAGER if eager else "", module=module, watched=WATCHED)
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=BACKEND, env=_env(), capture_output=True, text=True, timeout=120,
+    )
+    if out.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{out.stderr.strip()}")
+    # The app may print while importing; the probe's line is the last one.
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def run(module: str, runs: int, eager: bool):
+    samples = [measure(module, eager) for _ in range(runs)]
+    times = sorted(s["seconds"] * 1000 for s in samples)
+    label = f"{module}{' (eager SDKs)' if eager else ''}"
+    print(
+        f"{label:<28}median {statistics.median(times):7.1f} ms  "
+        f"min {times[0]:7.1f} ms  max {times[-1]:7.1f} ms  "
+        f"loaded: {', '.join(samples[-1]['loaded']) or 'none'}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=["flask_app", "app"])
+    parser.add_argument("-n", "--runs", type=int, default=10, help="fresh interpreters per module")
+    parser.add_argument("--eager", action="store_true", help="also time with the SDKs imported up front")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        run(module, args.runs, eager=False)
+        if args.eager:
+            run(module, args.runs, eager=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Local stand-ins for the upstream providers, for load tests and offline
+development. One HTTP server answers all three APIs:
+
+  Gemini  POST /v1beta/models/<model>:generateContent  (JSON text if given a responseSchema)
+  BFL     POST /bfl/submit            -> {"id", "polling_url"}
+          GET  /bfl/poll/<id>         -> Pending ... Ready {"result": {"sample"}}
+          GET  /bfl/sample/<id>.jpg   (the "generated" image)
+  Veo     POST /v1beta/models/<model>:predictLongRunning   (google-genai SDK)
+          GET  /v1beta/models/<model>/operations/<id>
+          GET  /v1beta/files/...      (the MP4 download)
+
+Each provider has a latency distribution (log-normal, given as median and
+sigma) and an error rate. For Gemini, latency is the response delay and
+errors are HTTP 500s. For BFL and Veo, latency is the job's completion
+time and errors are jobs that end as failed; submits also fail with 503
+at `submit_error_rate`.
+
+Point the app at it with:
+  GEMINI_API_BASE=http://127.0.0.1:<port>
+  BFL_URL=http://127.0.0.1:<port>/bfl/submit
+  GOOGLE_API_BASE=http://127.0.0.1:<port>
+
+Usage (from backend/):
+  python benchmarks/fake_providers.py --port 8089 --bfl-latency 4:0.4 --bfl-error-rate 0.05
+"""
+
+import argparse
+import io
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+
+@dataclass
+class LatencyProfile:
+    median: float
+    sigma: float = 0.3
+    error_rate: float = 0.0
+    submit_error_rate: float = 0.0
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return random.lognormvariate(0, self.sigma) * self.median
+
+    @classmethod
+    def parse(cls, spec: str, error_rate: float = 0.0, submit_error_rate: float = 0.0):
+        """"median[:sigma]" in seconds."""
+        median, _, sigma = spec.partition(":")
+        return cls(float(median), float(sigma or 0.3), error_rate, submit_error_rate)
+
+
+class _Server(ThreadingHTTPServer):
+    # The default listen backlog (5) resets connections under load-test fan-out.
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def _sample_image() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 64), (90, 90, 90)).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+class FakeProviders:
+    def __init__(self, gemini: LatencyProfile, bfl: LatencyProfile, veo: LatencyProfile, host="127.0.0.1", port=0):
+        self.profiles = {"gemini": gemini, "bfl": bfl, "veo": veo}
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.counts = {}
+        self._image = _sample_image()
+        self._video = b"\x00\x00\x00\x18ftypmp42" + b"\x00" * 4096
+        self.server = _Server((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self) -> dict:
+        return {
+            "GEMINI_API_BASE": self.url,
+            "BFL_URL": f"{self.url}/bfl/submit",
+            "GOOGLE_API_BASE": self.url,
+        }
+
+    def start(self) -> "FakeProviders":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-providers", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self, key: str):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def _new_job(self, provider: str) -> str:
+        profile = self.profiles[provider]
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = (time.time() + profile.sample(), random.random() < profile.error_rate)
+        return job_id
+
+    def _job_state(self, job_id: str):
+        """None if unknown, else (done, failed)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        ready_at, failed = job
+        return time.time() >= ready_at, failed
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body, content_type="application/json"):
+                data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_body(self):
+                """(size, the body's last 4 KiB): large bodies are not kept."""
+                remaining = int(self.headers.get("Content-Length") or 0)
+                total, tail = remaining, b""
+                while remaining > 0:
+                    chunk = self.rfile.read(min(remaining, 1 << 16))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    tail = (tail + chunk)[-4096:]
+                return total, tail.decode("utf-8", "replace")
+
+            def do_POST(self):
+                size, peek = self._read_body()
+                path = self.path.split("?")[0]
+                if path.endswith(":generateContent"):
+                    fake._count("gemini.generate")
+                    profile = fake.profiles["gemini"]
+                    time.sleep(profile.sample())
+                    if random.random() < profile.error_rate:
+                        return self._send(500, {"error": {"code": 500, "message": "fake Gemini failure"}})
+                    text = f"Synthetic clinical prompt ({size} request bytes)."
+                    if "responseSchema" in peek:
+                        text = json.dumps({
+                            "generated_prompt": text,
+                            "prompts": {tp: f"{text} Timepoint {tp}." for tp in ("now", "3m", "6m", "12m")},
+                        })
+                    return self._send(200, {"candidates": [{"content": {"parts": [{"text": text}]}}]})
+                if path == "/bfl/submit":
+                    fake._count("bfl.submit")
+                    if random.random() < fake.profiles["bfl"].submit_error_rate:
+                        return self._send(503, {"detail": "fake BFL overload"})
+                    job_id = fake._new_job("bfl")
+                    return self._send(200, {"id": job_id, "polling_url": f"{fake.url}/bfl/poll/{job_id}"})
+                if path.endswith(":predictLongRunning"):
+                    fake._count("veo.submit")
+                    if random.random() < fake.profiles["veo"].submit_error_rate:
+                        return self._send(503, {"error": {"code": 503, "message": "fake Veo overload"}})
+                    model = path.rsplit("/", 1)[-1].split(":")[0]
+                    job_id = fake._new_job("veo")
+                    return self._send(200, {"name": f"models/{model}/operations/{job_id}"})
+                self._send(404, {"error": "unknown path"})
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if path.startswith("/bfl/poll/"):
+                    fake._count("bfl.poll")
+                    job_id = path.rsplit("/", 1)[-1]
+                    state = fake._job_state(job_id)
+                    if state is None:
+                        return self._send(404, {"status": "Task not found"})
+                    done, failed = state
+                    if not done:
+                        return self._send(200, {"id": job_id, "status": "Pending"})
+                    if failed:
+                        return self._send(200, {"id": job_id, "status": "Error"})
+                    sample = f"{fake.url}/bfl/sample/{job_id}.jpg"
+                    return self._send(200, {"id": job_id, "status": "Ready", "result": {"sample": sample}})
+                if path.startswith("/bfl/sample/"):
+                    fake._count("bfl.sample")
+                    return self._send(200, fake._image, "image/jpeg")
+                if "/operations/" in path:
+                    fake._count("veo.poll")
+                    name = path[len("/v1beta/"):]
+                    state = fake._job_state(name.rsplit("/", 1)[-1])
+                    if state is None:
+                        return self._send(404, {"error": {"code": 404, "message": "no such operation"}})
+                    done, failed = state
+                    if not done:
+                        return self._send(200, {"name": name})
+                    if failed:
+                        return self._send(200, {"name": name, "done": True, "error": {"code": 13, "message": "fake Veo failure"}})
+                    video = {"uri": f"files/{uuid.uuid4().hex}"}
+                    body = {"generateVideoResponse": {"generatedSamples": [{"video": video}]}}
+                    return self._send(200, {"name": name, "done": True, "response": body})
+                if path.startswith("/v1beta/files/"):
+                    fake._count("veo.download")
+                    return self._send(200, fake._video, "video/mp4")
+                self._send(404, {"error": "unknown path"})
+
+        return Handler
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--gemini-latency", default="1.5:0.4", help="median[:sigma] seconds")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--bfl-latency", default="3:0.4", help="job completion median[:sigma] seconds")
+    parser.add_argument("--bfl-error-rate", type=float, default=0.0, help="share of jobs that end as Error")
+    parser.add_argument("--bfl-submit-error-rate", type=float, default=0.0, help="share of submits answered 503")
+    parser.add_argument("--veo-latency", default="8:0.3", help="operation completion median[:sigma] seconds")
+    parser.add_argument("--veo-error-rate", type=float, default=0.0)
+
+
+def from_args(args, host="127.0.0.1", port=0) -> FakeProviders:
+    return FakeProviders(
+        gemini=LatencyProfile.parse(args.gemini_latency, args.gemini_error_rate),
+        bfl=LatencyProfile.parse(args.bfl_latency, args.bfl_error_rate, args.bfl_submit_error_rate),
+        veo=LatencyProfile.parse(args.veo_latency, args.veo_error_rate),
+        host=host,
+        port=port,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_arguments(parser)
+    args = parser.parse_args()
+    fake = from_args(args, args.host, args.port)
+    print(f"Fake providers on {fake.url}; export:")
+    for key, value in fake.env().items():
+        print(f"  {key}={value}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
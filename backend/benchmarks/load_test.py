@@ -0,0 +1,264 @@
+"""
+Offline load test for the backend.
+
+Starts the fake providers (fake_providers.py) and the Flask app (or, with
+--app fastapi, the async app in app.py under uvicorn) in this process, with all state (caches, job DBs, media) in a temporary
+directory. It then drives the chosen endpoints at a fixed concurrency and
+reports, per scenario, the request count, errors, throughput,
+p50/p95/p99/max latency and the process's peak RSS.
+
+  prompt  POST /model/prompt with a small EHR note and synthetic CT slices
+  images  POST /model/generate_images (unique prompt per request, 4 timepoints)
+  video   POST /model/generate_video, then poll status_url to completion
+
+Every request uses a distinct prompt, so the result caches are not
+measured unless --repeat-prompts is given.
+
+Usage (from backend/):
+  python benchmarks/load_test.py                                  # all scenarios
+  python benchmarks/load_test.py images -n 200 -c 32 --bfl-latency 2:0.5
+  python benchmarks/load_test.py prompt --ct-slices 20 --json results.json
+  python benchmarks/load_test.py images --app fastapi -n 400 -c 200
+"""
+
+import argparse
+import io
+import json
+import os
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import requests
+from PIL import Image
+
+BACKEND = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import fake_providers  # noqa: E402
+
+SCENARIOS = ("prompt", "images", "video")
+
+
+def _peak_rss_mib() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[idx]
+
+
+def _ct_slices(n: int, size: int = 512):
+    rng = np.random.default_rng(0)
+    files = []
+    for i in range(n):
+        arr = (rng.random((size, size)) * 40 + 100 + 20 * np.sin(i / 3)).astype(np.uint8)
+        buf = io.BytesIO()
+        Image.fromarray(np.stack([arr] * 3, axis=-1)).save(buf, format="PNG")
+        files.append((f"ct_{i:03d}.png", buf.getvalue()))
+    return files
+
+
+class Driver:
+    def __init__(self, base_url: str, args):
+        self.base_url = base_url
+        self.args = args
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(10, args.concurrency))
+        self.session.mount("http://", adapter)
+        self.ct = _ct_slices(args.ct_slices) if args.ct_slices else []
+        self.ehr = ("Patient with progressive headaches. MRI 2024: small left frontal lesion. "
+                    "Medications: levetiracetam 500 mg BID. ") * 20
+
+    def _prompt_text(self, i: int) -> str:
+        return "Benchmark brain CT" if self.args.repeat_prompts else f"Benchmark brain CT #{i}"
+
+    def prompt(self, i: int):
+        files = [("ehr_files", ("note.txt", self.ehr.encode(), "text/plain"))]
+        files += [("ct_scans", (name, data, "image/png")) for name, data in self.ct]
+        resp = self.session.post(
+            f"{self.base_url}/model/prompt",
+            data={"base_prompt": self._prompt_text(i), "patient": json.dumps({"firstName": "Load", "age": 50})},
+            files=files,
+            timeout=300,
+        )
+        body = resp.json()
+        return resp.ok and "fallback" not in body.get("generated_prompt", "") and len(body.get("prompts") or {}) == 4
+
+    def images(self, i: int):
+        resp = self.session.post(
+            f"{self.base_url}/model/generate_images",
+            json={"prompt": self._prompt_text(i)},
+            timeout=300,
+        )
+        return resp.ok and all(resp.json().get("images", {}).values())
+
+    def video(self, i: int):
+        resp = self.session.post(
+            f"{self.base_url}/model/generate_video",
+            json={"prompt": self._prompt_text(i), "seconds": 4},
+            timeout=60,
+        )
+        if resp.status_code != 202:
+            return False
+        status_url = self.base_url + resp.json()["status_url"]
+        deadline = time.time() + 900
+        while time.time() < deadline:
+            job = self.session.get(status_url, timeout=30).json()
+            if job["status"] in ("succeeded", "failed"):
+                return job["status"] == "succeeded"
+            time.sleep(self.args.status_poll)
+        return False
+
+
+def run_scenario(driver: Driver, name: str, n: int, concurrency: int) -> dict:
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    fn = getattr(driver, name)
+
+    def one(i):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            ok = fn(i)
+        except Exception as e:
+            print(f"{name} #{i} failed: {e}")
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            errors += 0 if ok else 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(n)))
+    wall = time.perf_counter() - started
+    lat = sorted(latencies)
+    return {
+        "scenario": name,
+        "app": driver.args.app,
+        "requests": n,
+        "concurrency": concurrency,
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(n / wall, 3) if wall else None,
+        "p50": round(_percentile(lat, 0.50), 3),
+        "p95": round(_percentile(lat, 0.95), 3),
+        "p99": round(_percentile(lat, 0.99), 3),
+        "max": round(lat[-1], 3) if lat else None,
+        "peak_rss_mib": round(_peak_rss_mib(), 1),
+    }
+
+
+def _configure_env(state_dir: Path, fake: fake_providers.FakeProviders, fast_polls: bool):
+    env = {
+        "GEMINI_API_KEY": "bench",
+        "BFL_API_KEY": "bench",
+        "GOOGLE_API_KEY": "bench",
+        "PROMPT_CACHE_DIR": str(state_dir / "prompts"),
+        "VIDEO_JOBS_DB": str(state_dir / "video_jobs.sqlite3"),
+        "BATCH_DIR": str(state_dir / "batches"),
+        "MEDIA_ROOT": str(state_dir / "videos"),
+        "MEDIA_INDEX": str(state_dir / "media.sqlite3"),
+        "REF_CACHE_DIR": str(state_dir / "refs"),
+        "CASE_STORE_PATH": str(state_dir / "cases.sqlite3"),
+        **fake.env(),
+    }
+    if fast_polls:
+        # The stand-ins finish in seconds, so poll like it.
+        env.update(VEO_POLL_FIRST_DELAY="1", VEO_POLL_MIN_INTERVAL="0.5", VEO_POLL_MAX_INTERVAL="2")
+    for key, value in env.items():
+        os.environ.setdefault(key, value)
+
+
+def _serve_flask():
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    import flask_app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, flask_app.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+
+def _serve_fastapi():
+    import uvicorn
+
+    import app
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(
+        app.app, host="127.0.0.1", port=port, log_level="warning", access_log=False, backlog=4096,
+    ))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+
+    return f"http://127.0.0.1:{port}", stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="*", metavar="scenario", help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("-n", "--requests", type=int, default=40, help="requests per scenario")
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("--ct-slices", type=int, default=4, help="CT images per /model/prompt request")
+    parser.add_argument("--repeat-prompts", action="store_true", help="reuse one prompt (measures caching)")
+    parser.add_argument("--status-poll", type=float, default=0.5, help="video status poll interval")
+    parser.add_argument("--no-fast-polls", dest="fast_polls", action="store_false",
+                        help="keep the production Veo poll profile")
+    parser.add_argument("--app", choices=("flask", "fastapi"), default="flask", help="which app to serve")
+    parser.add_argument("--json", type=Path, help="also write results to this file")
+    fake_providers.add_arguments(parser)
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    fake = fake_providers.from_args(args).start()
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as state_dir:
+        _configure_env(Path(state_dir), fake, args.fast_polls)
+        base_url, stop = _serve_flask() if args.app == "flask" else _serve_fastapi()
+        print(f"{args.app} app on {base_url}, fake providers on {fake.url}; baseline RSS {_peak_rss_mib():.1f} MiB")
+
+        driver = Driver(base_url, args)
+        results = []
+        for name in args.scenarios or SCENARIOS:
+            print(f"-- {name}: {args.requests} requests at concurrency {args.concurrency}")
+            results.append(run_scenario(driver, name, args.requests, args.concurrency))
+        stop()
+    fake.stop()
+
+    cols = ("scenario", "requests", "errors", "throughput_rps", "p50", "p95", "p99", "max", "peak_rss_mib")
+    print()
+    print("".join(f"{c:>15}" for c in cols))
+    for row in results:
+        print("".join(f"{str(row[c]):>15}" for c in cols))
+    print(f"\nupstream calls: {json.dumps(fake.counts, sort_keys=True)}")
+    if args.json:
+        args.json.write_text(json.dumps({"results": results, "upstream_calls": fake.counts}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+BFL image generation pieces shared by the Flask app and the FastAPI app:
+configuration, per-timepoint prompt composition and the submit / poll
+request and response handling. Each app sends the requests with its own
+client (`providers.bfl` or `providers.bfl_async`).
+"""
+
+import os
+
+import caching
+
+# BFL model endpoint; override to use another model (or a local stand-in)
+BFL_URL = os.environ.get("BFL_URL", "https://api.bfl.ai/v1/flux-kontext-pro")
+# Upper bound on timepoints generated in parallel for a single request
+BFL_MAX_CONCURRENCY = int(os.environ.get("BFL_MAX_CONCURRENCY", "4"))
+# Process-wide cap on outstanding BFL jobs (interactive + batch); `reserve`
+# of them are only ever used by interactive requests
+BFL_GLOBAL_CONCURRENCY = int(os.environ.get("BFL_GLOBAL_CONCURRENCY", "8"))
+BFL_INTERACTIVE_RESERVE = int(os.environ.get("BFL_INTERACTIVE_RESERVE", "2"))
+# Finished BFL results are reused for identical prompts; sample URLs
+# expire upstream, so keep the TTL short.
+BFL_CACHE_TTL = float(os.environ.get("BFL_CACHE_TTL", "600"))
+BFL_CACHE_MAX_ENTRIES = int(os.environ.get("BFL_CACHE_MAX_ENTRIES", "512"))
+
+TIMEPOINTS = ("now", "3m", "6m", "12m")
+
+# Slightly tailor the prompt by timepoint; hard-coded phrasing
+TP_TO_SUFFIX = {
+    "now": "current brain state",
+    "3m": "brain state in approximately 3 months",
+    "6m": "brain state in approximately 6 months",
+    "12m": "brain state in approximately 12 months",
+}
+
+
+def compose_timepoint_prompts(prompt, timepoints) -> dict:
+    """
+    If prompt is an object like { "now": "...", "3m": "...", ... } use those directly.
+    Otherwise if it's a string, fall back to suffix composition for each timepoint.
+    """
+    prompt_per_tp = {}
+    if isinstance(prompt, dict):
+        # Normalize keys to expected timepoints
+        for tp in timepoints:
+            prompt_per_tp[tp] = prompt.get(tp) or ""
+    else:
+        # Single string prompt for all timepoints
+        for tp in timepoints:
+            suffix = TP_TO_SUFFIX.get(tp, str(tp))
+            prompt_per_tp[tp] = f"{prompt}. Please depict the {suffix}."
+    return prompt_per_tp
+
+
+def result_key(prompt: str) -> str:
+    """Key under which identical prompts share one job and its cached result."""
+    return caching.hash_key(BFL_URL, prompt)
+
+
+def submit_headers(api_key: str) -> dict:
+    return {
+        "accept": "application/json",
+        "x-key": api_key,
+        "Content-Type": "application/json",
+    }
+
+
+def poll_headers(api_key: str) -> dict:
+    return {"accept": "application/json", "x-key": api_key}
+
+
+def parse_submit(resp: dict) -> str:
+    """The job's polling URL from BFL's submit response."""
+    polling_url = resp.get("polling_url")
+    if not polling_url:
+        raise RuntimeError(f"Bad response: {resp}")
+    return polling_url
+
+
+def parse_poll(result: dict):
+    """One poll of a BFL job: (True, sample_url) when ready, else (False, status)."""
+    status = result.get("status")
+    if status == "Ready":
+        return True, result["result"]["sample"]
+    if status in ("Error", "Failed"):
+        raise RuntimeError(f"Generation failed: {result}")
+    return False, status
+
+
+def unchanged_images(prompt_per_tp: dict, previous) -> dict:
+    """
+    {tp: url} for the timepoints that need no new job: `previous[tp]` (an
+    ImageResult-like {"url", "promptUsed"}) was generated from exactly the
+    prompt now composed for tp.
+    """
+    reuse = {}
+    if not isinstance(previous, dict):
+        return reuse
+    for tp, prompt in prompt_per_tp.items():
+        prev = previous.get(tp)
+        if isinstance(prev, dict) and prev.get("url") and prev.get("promptUsed") == prompt:
+            reuse[tp] = prev["url"]
+    return reuse
@@ -0,0 +1,276 @@
+"""
+Small caching primitives shared by the backend.
+
+- LRUCache: thread-safe in-memory LRU with an optional per-entry TTL.
+- DiskCache: one JSON file per key under a directory, with TTL and a
+  total-size cap enforced by evicting least-recently-used files.
+- TieredCache: memory in front of disk; disk hits are promoted.
+- SingleFlight: deduplicates concurrent identical calls, with an optional
+  result cache in front.
+
+Keys are expected to be hex digests (see `hash_key`), so they are safe to
+use directly as file names.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+
+_MISSING = object()
+
+
+def hash_key(*parts) -> str:
+    """sha256 over a sequence of str/bytes/JSON-able parts, order-sensitive."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            data = part.encode("utf-8")
+        elif isinstance(part, (bytes, bytearray)):
+            data = bytes(part)
+        else:
+            data = json.dumps(part, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        # Length-prefix each part so ("ab", "c") and ("a", "bc") differ.
+        h.update(len(data).to_bytes(8, "big"))
+        h.update(data)
+    return h.hexdigest()
+
+
+class LRUCache:
+    def __init__(self, max_entries: int = 256, ttl: float = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expires, value = item
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[1]
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache:
+    def __init__(self, directory, ttl: float = None, max_bytes: int = 64 << 20):
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = sum(p.stat().st_size for p in self.dir.glob("*.json"))
+
+    def _path(self, key: str) -> Path:
+        return self.dir / f"{key}.json"
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                entry = json.load(fh)
+        except (OSError, ValueError):
+            return default
+        if self.ttl and entry.get("created", 0) + self.ttl < time.time():
+            self._remove(path)
+            return default
+        # Bump atime only: size eviction is least-recently-used by atime,
+        # while mtime stays the write time that TTL eviction goes by.
+        try:
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except OSError:
+            pass
+        return entry.get("value")
+
+    def set(self, key, value):
+        path = self._path(key)
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        data = json.dumps({"created": time.time(), "value": value})
+        with open(tmp, "w", encoding="utf-8") as fh:
+            fh.write(data)
+        with self._lock:
+            old = path.stat().st_size if path.exists() else 0
+            os.replace(tmp, path)
+            self._total += len(data.encode("utf-8")) - old
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _remove(self, path: Path):
+        with self._lock:
+            try:
+                size = path.stat().st_size
+                path.unlink()
+                self._total -= size
+            except OSError:
+                pass
+
+    def _evict(self):
+        """
+        Drop expired entries (by write time, mtime), then least recently
+        read ones (by atime, see get) until under max_bytes.
+        """
+        files = []
+        for p in self.dir.glob("*.json"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            files.append((max(st.st_atime, st.st_mtime), st.st_mtime, st.st_size, p))
+        files.sort()
+        total = sum(size for _, _, size, _ in files)
+        now = time.time()
+        for _, mtime, size, p in files:
+            expired = self.ttl and mtime + self.ttl < now
+            if total <= self.max_bytes and not expired:
+                continue
+            try:
+                p.unlink()
+                total -= size
+            except OSError:
+                pass
+        self._total = total
+
+
+class TieredCache:
+    def __init__(self, memory: LRUCache, disk: DiskCache = None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key, default=None):
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key, _MISSING)
+            if value is not _MISSING:
+                self.memory.set(key, value)
+                return value
+        return default
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+
+def _resolved(value) -> Future:
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one execution, and
+    optionally remember successful results in an `LRUCache`.
+
+    Failures are propagated to every waiter but never cached; so is a
+    cancelled `start()` future, as a RuntimeError (waiters that await the
+    shared future from asyncio would otherwise be cancelled themselves).
+    """
+
+    def __init__(self, cache: LRUCache = None):
+        self.cache = cache
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def submit(self, key, start) -> Future:
+        """
+        Future for `key`. Only the first caller's `start()` runs; it must
+        return a Future (or raise). Everyone else shares that outcome.
+        """
+        if self.cache is not None:
+            value = self.cache.get(key, _MISSING)
+            if value is not _MISSING:
+                with self._lock:
+                    self.hits += 1
+                return _resolved(value)
+
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            if self.cache is not None:
+                # A leader may have finished between the lookup above and here.
+                value = self.cache.get(key, _MISSING)
+                if value is not _MISSING:
+                    self.hits += 1
+                    return _resolved(value)
+            future = Future()
+            self._inflight[key] = future
+            self.misses += 1
+
+        try:
+            inner = start()
+        except BaseException as e:
+            self._settle(key, future, None, e)
+        else:
+            inner.add_done_callback(lambda f: self._settle(key, future, f))
+        return future
+
+    def do(self, key, fn):
+        """Blocking form of `submit`: `fn()` runs in the calling thread."""
+
+        def start():
+            return _resolved(fn())
+
+        return self.submit(key, start).result()
+
+    def _settle(self, key, future: Future, inner: Future, error=None):
+        try:
+            if inner is not None:
+                if inner.cancelled():
+                    error = RuntimeError(f"in-flight call for {key} was cancelled")
+                else:
+                    error = inner.exception()
+            if error is None and self.cache is not None:
+                self.cache.set(key, inner.result())
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        if future.done():
+            # Cancelled by one of its callers; the others already got that.
+            return
+        if error is None:
+            future.set_result(inner.result())
+        else:
+            future.set_exception(error)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._inflight),
+                "cached": len(self.cache) if self.cache is not None else 0,
+            }
@@ -0,0 +1,287 @@
+"""
+Case repositories for the FastAPI app (app.py).
+
+Cases are plain dicts shaped like the `Case` model. `images` and
+`videoUrl` are stored apart from the rest of the case so they can be
+updated without rewriting it:
+
+  cases(id PK, created_at, patient_mrn, data, video_url)
+  case_images(case_id, timepoint, url, prompt_used, mirrors)  PK (case_id, timepoint)
+
+(`mirrors` is the image's {variant: url} map from image_mirror.py, as JSON.)
+
+with indexes on created_at and patient_mrn. Listing is keyset-paginated
+on (created_at, id), newest first, so deep pages cost the same as the
+first one.
+
+Backends, chosen with CASE_STORE:
+  sqlite (default)  CASE_STORE_PATH, shared by every worker on the host
+  memory            per-process dict, for local hacking
+
+`CachedCaseRepository` adds a small read-through LRU in front of any
+backend. Writes through the same process invalidate it; writes from other
+workers become visible after CASE_CACHE_TTL seconds.
+"""
+
+import base64
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import caching
+
+CASE_STORE = os.environ.get("CASE_STORE", "sqlite")
+CASE_STORE_PATH = os.environ.get(
+    "CASE_STORE_PATH", str(Path(__file__).parent / "var" / "cases.sqlite3")
+)
+CASE_CACHE_ENTRIES = int(os.environ.get("CASE_CACHE_ENTRIES", "256"))
+CASE_CACHE_TTL = float(os.environ.get("CASE_CACHE_TTL", "5"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    patient_mrn TEXT,
+    data TEXT NOT NULL,
+    video_url TEXT
+);
+CREATE INDEX IF NOT EXISTS cases_created ON cases (created_at, id);
+CREATE INDEX IF NOT EXISTS cases_mrn ON cases (patient_mrn, created_at);
+CREATE TABLE IF NOT EXISTS case_images (
+    case_id TEXT NOT NULL REFERENCES cases (id) ON DELETE CASCADE,
+    timepoint TEXT NOT NULL,
+    url TEXT NOT NULL,
+    prompt_used TEXT NOT NULL,
+    mirrors TEXT,
+    PRIMARY KEY (case_id, timepoint)
+);
+"""
+
+
+def encode_cursor(case: dict) -> str:
+    raw = json.dumps([case["createdAt"], case["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str):
+    created_at, case_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    return created_at, case_id
+
+
+class CaseRepository(ABC):
+    """Interface shared by the backends."""
+
+    @abstractmethod
+    def create(self, case: dict) -> dict:
+        ...
+
+    @abstractmethod
+    def get(self, case_id: str):
+        ...
+
+    @abstractmethod
+    def list(self, limit: int = 20, cursor: str = None, mrn: str = None):
+        """Returns (cases, next_cursor); next_cursor is None on the last page."""
+
+    @abstractmethod
+    def update_images(self, case_id: str, images: dict) -> bool:
+        """Upsert {timepoint: {url, timepoint, promptUsed, mirrors?}}; other timepoints untouched."""
+
+    @abstractmethod
+    def set_video_url(self, case_id: str, video_url: str) -> bool:
+        ...
+
+
+class MemoryCaseRepository(CaseRepository):
+    def __init__(self):
+        self._cases = {}
+        self._lock = threading.Lock()
+
+    def create(self, case):
+        with self._lock:
+            self._cases[case["id"]] = json.loads(json.dumps(case))
+        return case
+
+    def get(self, case_id):
+        with self._lock:
+            case = self._cases.get(case_id)
+            return json.loads(json.dumps(case)) if case else None
+
+    def list(self, limit=20, cursor=None, mrn=None):
+        with self._lock:
+            cases = sorted(self._cases.values(), key=lambda c: (c["createdAt"], c["id"]), reverse=True)
+        if mrn is not None:
+            cases = [c for c in cases if (c.get("patient") or {}).get("mrn") == mrn]
+        if cursor:
+            after = decode_cursor(cursor)
+            cases = [c for c in cases if (c["createdAt"], c["id"]) < after]
+        page = cases[:limit]
+        next_cursor = encode_cursor(page[-1]) if len(cases) > limit else None
+        return [json.loads(json.dumps(c)) for c in page], next_cursor
+
+    def update_images(self, case_id, images):
+        with self._lock:
+            case = self._cases.get(case_id)
+            if case is None:
+                return False
+            case.setdefault("images", {}).update(json.loads(json.dumps(images)))
+            return True
+
+    def set_video_url(self, case_id, video_url):
+        with self._lock:
+            case = self._cases.get(case_id)
+            if case is None:
+                return False
+            case["videoUrl"] = video_url
+            return True
+
+
+class SQLiteCaseRepository(CaseRepository):
+    def __init__(self, path: str = CASE_STORE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        # Databases created before images carried mirror URLs
+        columns = {r["name"] for r in conn.execute("PRAGMA table_info(case_images)")}
+        if "mirrors" not in columns:
+            conn.execute("ALTER TABLE case_images ADD COLUMN mirrors TEXT")
+
+    def _conn(self):
+        # One connection per thread; WAL lets readers run alongside a writer.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def create(self, case):
+        data = {k: v for k, v in case.items() if k not in ("images", "videoUrl")}
+        mrn = (case.get("patient") or {}).get("mrn")
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO cases (id, created_at, patient_mrn, data, video_url) VALUES (?, ?, ?, ?, ?)",
+                (case["id"], case["createdAt"], mrn, json.dumps(data), case.get("videoUrl")),
+            )
+        if case.get("images"):
+            self.update_images(case["id"], case["images"])
+        return case
+
+    def _hydrate(self, rows):
+        if not rows:
+            return []
+        ids = [r["id"] for r in rows]
+        marks = ",".join("?" * len(ids))
+        images = {case_id: {} for case_id in ids}
+        for img in self._conn().execute(
+            f"SELECT case_id, timepoint, url, prompt_used, mirrors FROM case_images WHERE case_id IN ({marks})",
+            ids,
+        ):
+            images[img["case_id"]][img["timepoint"]] = {
+                "url": img["url"],
+                "timepoint": img["timepoint"],
+                "promptUsed": img["prompt_used"],
+                "mirrors": json.loads(img["mirrors"]) if img["mirrors"] else None,
+            }
+        cases = []
+        for r in rows:
+            case = json.loads(r["data"])
+            case["images"] = images[r["id"]]
+            case["videoUrl"] = r["video_url"]
+            cases.append(case)
+        return cases
+
+    def get(self, case_id):
+        row = self._conn().execute(
+            "SELECT id, data, video_url FROM cases WHERE id = ?", (case_id,)
+        ).fetchone()
+        return self._hydrate([row])[0] if row else None
+
+    def list(self, limit=20, cursor=None, mrn=None):
+        where, args = [], []
+        if mrn is not None:
+            where.append("patient_mrn = ?")
+            args.append(mrn)
+        if cursor:
+            where.append("(created_at, id) < (?, ?)")
+            args.extend(decode_cursor(cursor))
+        sql = "SELECT id, data, video_url FROM cases"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        rows = self._conn().execute(sql, (*args, limit + 1)).fetchall()
+        cases = self._hydrate(rows[:limit])
+        next_cursor = encode_cursor(cases[-1]) if len(rows) > limit else None
+        return cases, next_cursor
+
+    def update_images(self, case_id, images):
+        with self._conn() as conn:
+            if not conn.execute("SELECT 1 FROM cases WHERE id = ?", (case_id,)).fetchone():
+                return False
+            conn.executemany(
+                "INSERT INTO case_images (case_id, timepoint, url, prompt_used, mirrors) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (case_id, timepoint) DO UPDATE SET "
+                "url = excluded.url, prompt_used = excluded.prompt_used, mirrors = excluded.mirrors",
+                [
+                    (case_id, tp, img["url"], img["promptUsed"], json.dumps(img["mirrors"]) if img.get("mirrors") else None)
+                    for tp, img in images.items()
+                ],
+            )
+        return True
+
+    def set_video_url(self, case_id, video_url):
+        with self._conn() as conn:
+            cur = conn.execute("UPDATE cases SET video_url = ? WHERE id = ?", (video_url, case_id))
+        return cur.rowcount == 1
+
+
+class CachedCaseRepository(CaseRepository):
+    """Read-through LRU in front of another repository."""
+
+    def __init__(self, inner: CaseRepository, max_entries: int = CASE_CACHE_ENTRIES, ttl: float = CASE_CACHE_TTL):
+        self.inner = inner
+        self.cache = caching.LRUCache(max_entries, ttl=ttl)
+
+    def create(self, case):
+        created = self.inner.create(case)
+        self.cache.set(case["id"], json.loads(json.dumps(created)))
+        return created
+
+    def get(self, case_id):
+        case = self.cache.get(case_id)
+        if case is None:
+            case = self.inner.get(case_id)
+            if case is not None:
+                self.cache.set(case_id, case)
+        # Callers may mutate what they get back; never hand out the cached dict.
+        return json.loads(json.dumps(case)) if case is not None else None
+
+    def list(self, limit=20, cursor=None, mrn=None):
+        return self.inner.list(limit, cursor, mrn)
+
+    def update_images(self, case_id, images):
+        ok = self.inner.update_images(case_id, images)
+        self.cache.pop(case_id)
+        return ok
+
+    def set_video_url(self, case_id, video_url):
+        ok = self.inner.set_video_url(case_id, video_url)
+        self.cache.pop(case_id)
+        return ok
+
+
+def from_env() -> CaseRepository:
+    if CASE_STORE == "memory":
+        inner = MemoryCaseRepository()
+    elif CASE_STORE == "sqlite":
+        inner = SQLiteCaseRepository(CASE_STORE_PATH)
+    else:
+        raise ValueError(f"Unknown CASE_STORE: {CASE_STORE!r}")
+    return CachedCaseRepository(inner)
@@ -0,0 +1,243 @@
+"""
+CT image preprocessing before Gemini submission.
+
+All CT uploads of a request are treated as one series (multi-frame files
+such as TIFF stacks contribute one slice per frame). For each slice:
+
+  1. decode at reduced size (JPEG draft mode) and downscale so the long
+     edge is at most CT_MAX_EDGE;
+  2. convert to grayscale (vectorized luma) and apply an intensity window,
+     either fixed (CT_WINDOW_CENTER/CT_WINDOW_WIDTH, in pixel units) or
+     automatic between two percentiles;
+  3. drop near-duplicates of the previous kept slice, compared on a
+     32x32 signature;
+  4. recompress as JPEG.
+
+If more than CT_MAX_SLICES remain, a representative subset is picked by
+farthest-point sampling over the signatures, starting from the slice with
+the most contrast, and returned in original order.
+
+Uploads Pillow cannot decode (e.g. DICOM) are passed through untouched,
+but still count against CT_MAX_SLICES: decoded slices are kept first and
+pass-throughs fill whatever slots remain.
+"""
+
+import io
+import os
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+_SIG = 32
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else default
+
+
+CONFIG = {
+    "enabled": os.environ.get("CT_PREPROCESS", "1") != "0",
+    "max_edge": int(_env_float("CT_MAX_EDGE", 768)),
+    "jpeg_quality": int(_env_float("CT_JPEG_QUALITY", 85)),
+    "max_slices": int(_env_float("CT_MAX_SLICES", 16)),
+    "dedup_threshold": _env_float("CT_DEDUP_THRESHOLD", 0.015),
+    "window_center": _env_float("CT_WINDOW_CENTER", None),
+    "window_width": _env_float("CT_WINDOW_WIDTH", None),
+    "window_percentiles": (1.0, 99.0),
+}
+
+
+@dataclass
+class PreparedImage:
+    """Duck-types the bits of werkzeug's FileStorage that the encoder uses."""
+
+    stream: io.BytesIO
+    mimetype: str
+    filename: str
+
+
+@dataclass
+class PrepareReport:
+    input_files: int = 0
+    input_slices: int = 0
+    duplicates_dropped: int = 0
+    subset_dropped: int = 0
+    passthrough: int = 0
+    # Files whose frames stopped decoding part way; see per_file[...]["errors"]
+    truncated: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    seconds: float = 0.0
+    per_file: list = field(default_factory=list)
+
+
+def to_grayscale(arr: np.ndarray) -> np.ndarray:
+    """HxW or HxWxC array -> float32 HxW luma."""
+    if arr.ndim == 2:
+        return arr.astype(np.float32, copy=False)
+    if arr.shape[2] == 2:  # LA
+        return arr[..., 0].astype(np.float32)
+    return arr[..., :3].astype(np.float32) @ _LUMA
+
+
+def apply_window(gray: np.ndarray, center=None, width=None, percentiles=(1.0, 99.0)) -> np.ndarray:
+    """Clip to [center - width/2, center + width/2] and rescale to uint8."""
+    if center is not None and width:
+        lo, hi = center - width / 2.0, center + width / 2.0
+    else:
+        lo, hi = np.percentile(gray, percentiles)
+    if hi <= lo:
+        hi = lo + 1.0
+    out = (gray - lo) * (255.0 / (hi - lo))
+    np.clip(out, 0, 255, out=out)
+    return out.astype(np.uint8)
+
+
+def signature(img: np.ndarray) -> np.ndarray:
+    """32x32 block-mean thumbnail in [0, 1], used for similarity tests."""
+    h, w = img.shape
+    ys = np.linspace(0, h, _SIG + 1).astype(int)
+    xs = np.linspace(0, w, _SIG + 1).astype(int)
+    # Row/column cumulative sums give every block mean in one pass.
+    c = np.pad(img.astype(np.float32).cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    y0, y1 = ys[:-1, None], ys[1:, None]
+    x0, x1 = xs[None, :-1], xs[None, 1:]
+    sums = c[y1, x1] - c[y0, x1] - c[y1, x0] + c[y0, x0]
+    area = np.outer(np.diff(ys), np.diff(xs)).clip(min=1)
+    return sums / area / 255.0
+
+
+def select_representative(signatures: np.ndarray, k: int) -> list:
+    """Indices of k mutually dissimilar slices (farthest-point sampling)."""
+    n = len(signatures)
+    if n <= k:
+        return list(range(n))
+    flat = signatures.reshape(n, -1)
+    chosen = [int(flat.std(axis=1).argmax())]
+    dist = np.abs(flat - flat[chosen[0]]).mean(axis=1)
+    for _ in range(k - 1):
+        nxt = int(dist.argmax())
+        chosen.append(nxt)
+        dist = np.minimum(dist, np.abs(flat - flat[nxt]).mean(axis=1))
+    return sorted(chosen)
+
+
+def _open_frames(stream, max_edge: int):
+    """
+    Open an image and return (frame_count, iterator of downscaled numpy
+    frames). Raises if Pillow cannot identify the file.
+    """
+    stream.seek(0)
+    im = Image.open(stream)
+    if im.format == "JPEG":
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale when possible.
+        im.draft("L", (max_edge, max_edge))
+
+    def frames():
+        with im:
+            for frame in ImageSequence.Iterator(im):
+                if frame.mode.startswith("I;16"):
+                    frame = frame.convert("I")
+                elif frame.mode not in ("L", "LA", "RGB", "RGBA", "I", "F"):
+                    frame = frame.convert("RGB")
+                else:
+                    frame = frame.copy()
+                frame.thumbnail((max_edge, max_edge), Image.BILINEAR)
+                yield np.asarray(frame)
+        stream.seek(0)
+
+    return getattr(im, "n_frames", 1), frames()
+
+
+def _encode_jpeg(img: np.ndarray, quality: int) -> bytes:
+    buf = io.BytesIO()
+    Image.fromarray(img).save(buf, format="JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def prepare_series(ct_files, config: dict = None):
+    """
+    Returns (prepared, report): `prepared` is a list of upload-like objects
+    (PreparedImage, or the original upload when it could not be decoded).
+    """
+    cfg = dict(CONFIG, **(config or {}))
+    report = PrepareReport(input_files=len(ct_files))
+    started = time.perf_counter()
+    if not cfg["enabled"]:
+        files = list(ct_files)
+        if len(files) > cfg["max_slices"] > 0:
+            report.subset_dropped = len(files) - cfg["max_slices"]
+            files = files[:cfg["max_slices"]]
+        report.passthrough = len(files)
+        return files, report
+
+    # Keep only small artifacts per slice: its JPEG bytes and signature.
+    kept = []  # (order, PreparedImage | upload, signature | None, nbytes)
+    last_sig = None
+    for file_idx, f in enumerate(ct_files):
+        stream = getattr(f, "stream", f)
+        name = getattr(f, "filename", None) or f"ct_{file_idx}"
+        stream.seek(0, os.SEEK_END)
+        size_in = stream.tell()
+        stream.seek(0)
+        report.bytes_in += size_in
+        try:
+            n_frames, frames = _open_frames(stream, cfg["max_edge"])
+        except Exception:
+            stream.seek(0)
+            report.passthrough += 1
+            kept.append((len(kept), f, None, size_in))
+            report.per_file.append({"file": name, "bytes_in": size_in, "bytes_out": size_in, "slices": 0, "errors": []})
+            continue
+
+        size_out = 0
+        errors = []
+        try:
+            for frame_idx, arr in enumerate(frames):
+                report.input_slices += 1
+                gray = apply_window(
+                    to_grayscale(arr),
+                    cfg["window_center"],
+                    cfg["window_width"],
+                    cfg["window_percentiles"],
+                )
+                sig = signature(gray)
+                if last_sig is not None and np.abs(sig - last_sig).mean() < cfg["dedup_threshold"]:
+                    report.duplicates_dropped += 1
+                    continue
+                last_sig = sig
+                data = _encode_jpeg(gray, cfg["jpeg_quality"])
+                size_out += len(data)
+                label = f"{name}#{frame_idx}" if n_frames > 1 else name
+                kept.append((len(kept), PreparedImage(io.BytesIO(data), "image/jpeg", label), sig, len(data)))
+        except Exception as e:
+            # Truncated/corrupt frame: keep the slices decoded so far.
+            report.truncated += 1
+            errors.append(f"stopped early: {e}")
+            stream.seek(0)
+        report.per_file.append(
+            {"file": name, "bytes_in": size_in, "bytes_out": size_out, "slices": n_frames, "errors": errors}
+        )
+
+    decoded = [k for k in kept if k[2] is not None]
+    opaque = [k for k in kept if k[2] is None]
+    if len(kept) > cfg["max_slices"] > 0:
+        if len(decoded) > cfg["max_slices"]:
+            picks = select_representative(np.stack([k[2] for k in decoded]), cfg["max_slices"])
+        else:
+            picks = range(len(decoded))
+        keep_orders = {decoded[i][0] for i in picks}
+        # Pass-throughs have no signature to sample by; they get the slots left.
+        keep_orders |= {k[0] for k in opaque[:cfg["max_slices"] - len(keep_orders)]}
+        report.subset_dropped = len(kept) - len(keep_orders)
+        report.passthrough = len([k for k in opaque if k[0] in keep_orders])
+        kept = [k for k in kept if k[0] in keep_orders]
+
+    prepared = [item for _, item, _, _ in kept]
+    report.bytes_out = sum(nbytes for _, _, _, nbytes in kept)
+    report.seconds = time.perf_counter() - started
+    return prepared, report
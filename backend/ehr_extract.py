@@ -0,0 +1,363 @@
+"""
+EHR extraction engine: parse uploaded records into sections, rank them
+against the request context, and pack the best ones into a token budget.
+
+Parsing
+  PDF (via pypdf, when installed), DOCX (stdlib zip + XML), CSV, JSON and
+  plain text/markdown are split into titled sections. Parsed sections are
+  cached per file sha256, and batches of uncached files larger than
+  EHR_PARSE_POOL_MIN are parsed in a process pool.
+
+Ranking
+  Each section gets a BM25 score against terms from the base prompt and
+  patient context, plus a boost for clinically dense headings
+  (impression, imaging, assessment, medications, ...).
+
+Packing
+  Sections are taken greedily by score per token until EHR_TOKEN_BUDGET
+  is used (the last one may be cut to fit), then emitted in document
+  order so the excerpt still reads naturally.
+"""
+
+import csv
+import io
+import json
+import math
+import multiprocessing
+import os
+import re
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from xml.etree import ElementTree
+
+import caching
+import ingest
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # optional: PDFs are reported as unparsed without it
+    PdfReader = None
+
+CONFIG = {
+    "token_budget": int(os.environ.get("EHR_TOKEN_BUDGET", "2000")),
+    "max_parse_bytes": int(os.environ.get("EHR_MAX_PARSE_BYTES", str(20 << 20))),
+    "section_chars": int(os.environ.get("EHR_SECTION_CHARS", "2400")),
+}
+EHR_PARSE_POOL_MIN = int(os.environ.get("EHR_PARSE_POOL_MIN", "4"))
+EHR_PARSE_WORKERS = int(os.environ.get("EHR_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+EHR_SECTION_CACHE_ENTRIES = int(os.environ.get("EHR_SECTION_CACHE_ENTRIES", "512"))
+
+# Rough chars-per-token for English clinical text.
+CHARS_PER_TOKEN = 4
+
+_HEADING_BOOST = {
+    "impression": 2.0,
+    "findings": 2.0,
+    "imaging": 1.8,
+    "radiology": 1.8,
+    "ct": 1.6,
+    "mri": 1.6,
+    "assessment": 1.6,
+    "plan": 1.3,
+    "diagnosis": 1.6,
+    "diagnoses": 1.6,
+    "history": 1.3,
+    "hpi": 1.3,
+    "neuro": 1.5,
+    "neurologic": 1.5,
+    "medications": 1.3,
+    "meds": 1.3,
+    "labs": 1.2,
+    "allergies": 1.0,
+    "billing": 0.3,
+    "insurance": 0.3,
+    "demographics": 0.6,
+}
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it of on or that the this to was were with "
+    "patient please depict state brain".split()
+)
+_WORD = re.compile(r"[a-z0-9][a-z0-9\-/\.]*")
+_MD_HEADING = re.compile(r"^\s{0,3}#{1,6}\s+(.+?)\s*#*\s*$")
+_COLON_HEADING = re.compile(r"^\s*([A-Z][A-Za-z /&\-]{2,40}):\s*(.*)$")
+_CAPS_HEADING = re.compile(r"^\s*([A-Z][A-Z0-9 /&\-]{2,40})\s*$")
+
+_section_cache = caching.LRUCache(EHR_SECTION_CACHE_ENTRIES)
+_pool = None
+
+
+@dataclass
+class Section:
+    source: str
+    title: str
+    text: str
+    order: int = 0
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def tokenize(text: str):
+    return [w.strip(".-/") for w in _WORD.findall(text.lower()) if w not in _STOPWORDS and len(w) > 1]
+
+
+# ---------------------------------------------------------------------------
+# Parsing
+# ---------------------------------------------------------------------------
+
+def _kind(filename: str, mime: str, head: bytes) -> str:
+    name = (filename or "").lower()
+    mime = (mime or "").lower()
+    if head.startswith(b"%PDF") or name.endswith(".pdf") or mime.endswith("pdf"):
+        return "pdf"
+    if name.endswith(".docx") or "wordprocessingml" in mime:
+        return "docx"
+    if name.endswith(".csv") or mime in ("text/csv", "application/csv"):
+        return "csv"
+    if name.endswith(".json") or mime.endswith("json"):
+        return "json"
+    if "text" in mime or name.endswith((".txt", ".md", ".text", ".note")):
+        return "text"
+    if head.startswith(b"PK"):
+        return "docx"
+    # Last resort: anything without NUL bytes up front is treated as text.
+    return "binary" if b"\x00" in head else "text"
+
+
+def _split_text(source: str, text: str, section_chars: int):
+    """Split on markdown/ALL-CAPS/"Heading:" lines, then cap section size."""
+    sections = []
+    title, buf = "", []
+
+    def flush():
+        body = "\n".join(buf).strip()
+        if body:
+            sections.append(Section(source, title, body))
+
+    for line in text.splitlines():
+        m = _MD_HEADING.match(line) or _CAPS_HEADING.match(line)
+        colon = None if m else _COLON_HEADING.match(line)
+        if m or (colon and colon.group(1).split()[0].lower() in _HEADING_BOOST):
+            flush()
+            title = (m or colon).group(1).strip()
+            buf = [colon.group(2)] if colon and colon.group(2) else []
+        else:
+            buf.append(line)
+    flush()
+
+    out = []
+    for s in sections:
+        for i in range(0, len(s.text), section_chars):
+            part = s.text[i:i + section_chars]
+            out.append(Section(source, s.title + (f" (cont. {i // section_chars})" if i else ""), part))
+    return out
+
+
+def _parse_pdf(data: bytes):
+    if PdfReader is None:
+        return None
+    reader = PdfReader(io.BytesIO(data))
+    return "\n".join((page.extract_text() or "") for page in reader.pages)
+
+
+def _parse_docx(data: bytes):
+    ns = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        root = ElementTree.fromstring(zf.read("word/document.xml"))
+    lines = []
+    for p in root.iter(f"{ns}p"):
+        text = "".join(t.text or "" for t in p.iter(f"{ns}t")).strip()
+        if not text:
+            continue
+        style = p.find(f"{ns}pPr/{ns}pStyle")
+        if style is not None and style.get(f"{ns}val", "").lower().startswith(("heading", "title")):
+            text = f"# {text}"
+        lines.append(text)
+    return "\n".join(lines)
+
+
+def _parse_csv(source: str, text: str, section_chars: int):
+    rows = list(csv.reader(io.StringIO(text)))
+    if not rows:
+        return []
+    header, body = rows[0], rows[1:]
+    sections, buf, start = [], [], 0
+    for i, row in enumerate(body):
+        buf.append("; ".join(f"{h}: {v}" for h, v in zip(header, row) if v.strip()))
+        if sum(len(b) for b in buf) >= section_chars:
+            sections.append(Section(source, f"rows {start + 1}-{i + 1}", "\n".join(buf)))
+            buf, start = [], i + 1
+    if buf:
+        sections.append(Section(source, f"rows {start + 1}-{len(body)}", "\n".join(buf)))
+    return sections
+
+
+def _parse_json(source: str, text: str, section_chars: int):
+    obj = json.loads(text)
+    items = obj.items() if isinstance(obj, dict) else enumerate(obj if isinstance(obj, list) else [obj])
+    sections = []
+    for key, value in items:
+        body = value if isinstance(value, str) else json.dumps(value, separators=(",", ":"))
+        for i in range(0, len(body), section_chars):
+            sections.append(Section(source, str(key), body[i:i + section_chars]))
+    return sections
+
+
+def parse_document(filename: str, mime: str, data: bytes, section_chars: int):
+    """Bytes of one EHR file -> list of Sections. Top-level so it can run in a pool."""
+    source = filename or "ehr_file"
+    kind = _kind(filename, mime, data[:512])
+    try:
+        if kind == "pdf":
+            text = _parse_pdf(data)
+            if text is None:
+                return [Section(source, "", f"[{source}: PDF not parsed (pypdf not installed)]")]
+            return _split_text(source, text, section_chars)
+        if kind == "docx":
+            return _split_text(source, _parse_docx(data), section_chars)
+        if kind == "binary":
+            return [Section(source, "", f"[{source}: non-text EHR document (unsupported format)]")]
+        text = data.decode("utf-8", errors="ignore")
+        if kind == "csv":
+            return _parse_csv(source, text, section_chars)
+        if kind == "json":
+            try:
+                return _parse_json(source, text, section_chars)
+            except ValueError:
+                pass
+        return _split_text(source, text, section_chars)
+    except Exception as e:
+        return [Section(source, "", f"[{source}: could not be parsed ({type(e).__name__})]")]
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # spawn: the web worker is multi-threaded, so forking it is unsafe.
+        _pool = ProcessPoolExecutor(EHR_PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def load_sections(ehr_files, config: dict = None):
+    """Sections for every upload, from the per-hash cache where possible."""
+    cfg = dict(CONFIG, **(config or {}))
+    results = [None] * len(ehr_files)
+    todo = []
+    for i, f in enumerate(ehr_files):
+        key = caching.hash_key(ingest.file_digest(f), f.filename or "", cfg["section_chars"])
+        cached = _section_cache.get(key)
+        if cached is not None:
+            results[i] = cached
+        else:
+            todo.append((i, key, f))
+
+    def read(f):
+        stream = getattr(f, "stream", f)
+        stream.seek(0)
+        data = stream.read(cfg["max_parse_bytes"])
+        stream.seek(0)
+        return data
+
+    if len(todo) >= EHR_PARSE_POOL_MIN:
+        pool = _get_pool()
+        futures = [
+            (i, key, pool.submit(parse_document, f.filename, f.mimetype, read(f), cfg["section_chars"]))
+            for i, key, f in todo
+        ]
+        parsed = [(i, key, fut.result()) for i, key, fut in futures]
+    else:
+        parsed = [
+            (i, key, parse_document(f.filename, f.mimetype, read(f), cfg["section_chars"]))
+            for i, key, f in todo
+        ]
+    for i, key, sections in parsed:
+        _section_cache.set(key, sections)
+        results[i] = sections
+
+    out = []
+    for sections in results:
+        for s in sections:
+            out.append(Section(s.source, s.title, s.text, order=len(out)))
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Ranking and packing
+# ---------------------------------------------------------------------------
+
+def _heading_boost(title: str) -> float:
+    boosts = [_HEADING_BOOST[w] for w in tokenize(title) if w in _HEADING_BOOST]
+    if not boosts:
+        return 1.0
+    # "Imaging billing" is still imaging; only purely low-value titles sink.
+    return max(boosts) if max(boosts) >= 1 else min(boosts)
+
+
+def score_sections(sections, query: str, k1: float = 1.2, b: float = 0.75):
+    """BM25 of each section against the query terms, times a heading prior."""
+    if not sections:
+        return []
+    docs = [Counter(tokenize(s.title + " " + s.text)) for s in sections]
+    lengths = [sum(d.values()) for d in docs]
+    avg_len = (sum(lengths) / len(lengths)) or 1.0
+    df = Counter(term for d in docs for term in d)
+    n = len(docs)
+    terms = set(tokenize(query))
+    scores = []
+    for s, d, length in zip(sections, docs, lengths):
+        bm25 = 0.0
+        for term in terms:
+            tf = d.get(term)
+            if not tf:
+                continue
+            idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+            bm25 += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_len))
+        # A small floor keeps unmatched-but-clinical sections in the running.
+        scores.append((bm25 + 0.5) * _heading_boost(s.title))
+    return scores
+
+
+def pack(sections, scores, token_budget: int):
+    """Greedy by score per token; returns the chosen sections in document order."""
+    ranked = sorted(
+        zip(sections, scores),
+        key=lambda pair: pair[1] / max(1, estimate_tokens(pair[0].text)),
+        reverse=True,
+    )
+    chosen, used = [], 0
+    for section, _ in ranked:
+        # The BEGIN/END lines render() wraps the text in, plus the newlines between sections.
+        overhead = estimate_tokens(render([Section(section.source, section.title, "")])) + 1
+        cost = estimate_tokens(section.text) + overhead
+        if used + cost <= token_budget:
+            chosen.append(section)
+            used += cost
+        elif token_budget - used - overhead > 64:
+            # Cut the section to the remaining space rather than skip it.
+            room = (token_budget - used - overhead) * CHARS_PER_TOKEN - len(" …")
+            chosen.append(Section(section.source, section.title, section.text[:room] + " …", section.order))
+            used = token_budget
+        if used >= token_budget:
+            break
+    return sorted(chosen, key=lambda s: s.order)
+
+
+def render(sections) -> str:
+    chunks = []
+    for s in sections:
+        label = f"{s.source} — {s.title}" if s.title else s.source
+        chunks.append(f"\n--- BEGIN EHR: {label} ---\n{s.text}\n--- END EHR: {label} ---\n")
+    return "".join(chunks).strip()
+
+
+def extract(ehr_files, query: str, token_budget: int = None, config: dict = None) -> str:
+    """Ranked, budgeted EHR excerpt for the prompt."""
+    cfg = dict(CONFIG, **(config or {}))
+    budget = cfg["token_budget"] if token_budget is None else token_budget
+    sections = load_sections(ehr_files, cfg)
+    if not sections or budget <= 0:
+        return ""
+    return render(pack(sections, score_sections(sections, query), budget))
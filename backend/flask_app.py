@@ -8,173 +8,198 @@ Endpoint:
       - patient: JSON string for patient info
       - ehr_files: 0..n files
       - ct_scans: 0..n files
-    - returns: { "generated_prompt": str }
+    - returns: { "generated_prompt": str, "prompts": { "now", "3m", "6m", "12m" } }
 
 Replace the stubbed logic with your model inference.
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, g, redirect, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 import json
 import os
 import time
-import requests
 import uuid
 from pathlib import Path
-from google import genai
-from google.genai import types
-import base64
-import mimetypes
-import time
-from google import genai
+import tempfile
+import threading
+import queue
+from concurrent.futures import Future
+import batch_jobs
+import bfl_images
+import caching
+import gemini_prompt
+import governor
+import idempotency
+import image_mirror
+import ingest
+import media_store
+import metrics
+import poller
+import providers
+import ref_cache
+import resilience
+import veo_video
+import video_jobs
+
+
+
+class _IngestRequest(Request):
+  """Streams multipart uploads into size-checked, hashing spools."""
+
+  def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+    budget = getattr(self, "_upload_budget", None)
+    if budget is None:
+      budget = self._upload_budget = ingest.UploadBudget()
+    return budget.open(filename)
+
 
 app = Flask(__name__)
+app.request_class = _IngestRequest
 # Allow frontend (http://localhost:3000) to call Flask (http://localhost:5001)
 # Loosened for dev; tighten origins in production.
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
-GEMINI_API_KEY = os.environ["GEMINI_API_KEY"]
-GEMINI_MODEL_NAME = os.environ.get("GEMINI_MODEL_NAME", "gemini-pro-latest")
-
-def _encode_ct_files(ct_files):
-    """Turn CT scan uploads into Gemini inlineData parts."""
-    image_parts = []
-    for f in ct_files:
-        img_bytes = f.read()
-        f.seek(0)  # reset so you can reuse if needed later
-        b64 = base64.b64encode(img_bytes).decode("utf-8")
-        mime = f.mimetype or "image/png"  # adjust if you send DICOM
-        image_parts.append({
-            "inlineData": {
-                "mimeType": mime,
-                "data": b64,
-            }
-        })
-    return image_parts
-
-
-
-def _extract_ehr_text(ehr_files, max_chars: int = 8000) -> str:
-    """
-    Naive EHR extraction:
-      - Reads text-like files directly (txt, json, csv, etc.)
-      - Ignores binary/PDFs (you can plug in a PDF parser here)
-    Truncates to max_chars to keep the prompt manageable.
-    """
-    chunks = []
-    remaining = max_chars
-
-    for f in ehr_files:
-        fname = f.filename or "ehr_file"
-        mime = (f.mimetype or "").lower()
-
-        # Simple heuristic for text-like files
-        is_texty = (
-            "text" in mime
-            or mime.endswith("json")
-            or fname.endswith((".txt", ".json", ".csv", ".md"))
-        )
+# Responses to generation POSTs sent with an Idempotency-Key (see idempotency.py)
+_idempotent = idempotency.flask_idempotent(idempotency.IdempotencyStore())
+# Worker threads shared by all BFL/Veo submits and status checks
+POLLER_MAX_WORKERS = int(os.environ.get("POLLER_MAX_WORKERS", "8"))
+# Image batches: on-disk job/result files and jobs fed to the governor at once
+BATCH_DIR = os.environ.get("BATCH_DIR", str(Path(__file__).parent / "var" / "batches"))
+BATCH_MAX_IN_FLIGHT = int(os.environ.get("BATCH_MAX_IN_FLIGHT", "4"))
+# Comment line sent on idle event streams so proxies keep them open
+SSE_KEEPALIVE_SECONDS = float(os.environ.get("SSE_KEEPALIVE_SECONDS", "15"))
+# Gemini, BFL and Veo settings live in gemini_prompt.py, bfl_images.py
+# and veo_video.py (shared with the FastAPI app).
+
+@app.before_request
+def _start_request_metrics():
+  g.metrics_started = time.perf_counter()
+  g.metrics_token = metrics.begin_request()
+
+
+@app.after_request
+def _finish_request_metrics(resp):
+  started = g.get("metrics_started")
+  if started is not None:
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.HTTP_SECONDS.observe(
+      elapsed, app="flask", method=request.method, route=route, status=resp.status_code
+    )
+    if metrics.SERVER_TIMING:
+      resp.headers["Server-Timing"] = metrics.server_timing(elapsed)
+  return resp
 
-        if not is_texty:
-            # You can integrate a PDF/Word parser here if you want.
-            chunks.append(f"[{fname}: non-text EHR document (not parsed in this stub)]\n")
-            continue
 
-        raw = f.read()
-        f.seek(0)
+@app.teardown_request
+def _end_request_metrics(_exc):
+  token = g.pop("metrics_token", None)
+  if token is not None:
+    metrics.end_request(token)
 
-        try:
-            text = raw.decode("utf-8", errors="ignore")
-        except AttributeError:
-            # Already str
-            text = raw
 
-        if not text.strip():
-            continue
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+  """Prometheus text format; see metrics.py."""
+  return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
-        if len(text) > remaining:
-            text = text[:remaining]
-        remaining -= len(text)
 
-        chunks.append(f"\n--- BEGIN EHR: {fname} ---\n{text}\n--- END EHR: {fname} ---\n")
+@app.errorhandler(ingest.UploadTooLarge)
+def _upload_too_large(e):
+  return jsonify({"error": str(e)}), 413
 
-        if remaining <= 0:
-            break
 
-    return "".join(chunks).strip()
+@app.errorhandler(providers.MissingCredentials)
+def _missing_credentials(e):
+  return jsonify({"error": str(e)}), 503
 
 
-def call_gemini_with_ct_and_ehr(context_text: str, ehr_text: str, ct_files) -> str:
-    """Call Gemini with clinical context + EHR text + CT images."""
-    url = (
-        f"https://generativelanguage.googleapis.com/v1beta/"
-        f"models/{GEMINI_MODEL_NAME}:generateContent?key={GEMINI_API_KEY}"
-    )
-    headers = {"Content-Type": "application/json"}
-
-    image_parts = _encode_ct_files(ct_files)
-
-    parts = [
-        {
-            "text": (
-                "You are a clinical prompt generator for a downstream CT scan image generator. "
-                "You receive clinical context, structured EHR data, unstructured EHR notes, "
-                "and CT brain images. Your task is ONLY to craft a single, rich, well-structured "
-                "prompt that is an extremely detailed clinical explanation of the CT scans and EHR data"
-                "with patient and treatment context.\n\n"
-                "Do NOT give diagnoses or findings directly—just write the best possible prompt."
-            )
-        },
-        {"text": "\n\nClinical / patient context:\n" + context_text},
-    ]
-
-    if ehr_text:
-        parts.append({
-            "text": "\n\nEHR documents (structured & narrative excerpts):\n" + ehr_text
-        })
-
-    if image_parts:
-        parts.append({
-            "text": "\n\nAttached CT brain images (inline): use their visual information."
-        })
-        parts.extend(image_parts)
-
-    parts.append({
-        "text": (
-            "\n\nNow output a SINGLE prompt string of about 4-5 sentences, ready to be fed into a brain CT generation LLM. "
-            "Include: extremely specific detailed clinical explanation of the CT scans, patient demographics, key history, relevant labs/meds, and what the model should focus on."
+def call_gemini_with_ct_and_ehr(base_prompt: str, patient: dict, ehr_files, ct_files):
+    """
+    Call Gemini with clinical context + EHR text + CT images, fitted to the
+    request token budget. Returns {"generated_prompt", "prompts"} (see
+    gemini_prompt.parse_response).
+    """
+    body = gemini_prompt.build_request(base_prompt, patient, ehr_files, ct_files)
+    payload = gemini_prompt.encode_request(body)
+    # Includes base64-encoding the CT images, which happens while sending.
+    with metrics.stage("gemini"):
+        resp = providers.gemini.post(
+            gemini_prompt.url(providers.api_key("gemini")), headers=gemini_prompt.HEADERS, data=payload
         )
-    })
-    
-    body = {
-        "contents": [{"parts": parts}],
-        "generationConfig": {
-            "temperature": 0.2,
-            "maxOutputTokens": 1000000,
-            "topK": 40,
-            "topP": 0.95,
-        },
-    }
-
-    resp = requests.post(url, headers=headers, json=body, timeout=60)
     resp.raise_for_status()
-    data = resp.json()
-    
-
-    try:
-        candidate = data["candidates"][0]
-        part = candidate["content"]["parts"][0]
-        text = part.get("text", "")
-    except Exception:
-        text = ""
-    
-   
+    return gemini_prompt.parse_response(resp.json())
+
+
+# Process-wide: identical prompts in flight share one BFL job, and recent
+# results are served from memory.
+_bfl_flight = caching.SingleFlight(
+  caching.LRUCache(bfl_images.BFL_CACHE_MAX_ENTRIES, ttl=bfl_images.BFL_CACHE_TTL)
+)
+# Process-wide: every outstanding BFL/Veo job is polled from one scheduler.
+# A check refused by an open breaker is retried later, not treated as a failed job.
+_poller = poller.Poller(max_workers=POLLER_MAX_WORKERS, transient=(resilience.ProviderUnavailable,))
+# Process-wide: caps BFL jobs across all requests and batches.
+_bfl_governor = governor.PriorityGovernor(
+  bfl_images.BFL_GLOBAL_CONCURRENCY, reserve=bfl_images.BFL_INTERACTIVE_RESERVE
+)
+
+metrics.gauge_callback(
+  "poller_jobs_in_flight", "Upstream jobs being polled",
+  lambda: {p: v["in_flight"] for p, v in _poller.snapshot().items()}, ["provider"],
+)
+metrics.gauge_callback(
+  "bfl_governor_active", "BFL jobs holding a governor slot",
+  lambda: _bfl_governor.stats()["active_by_priority"], ["priority"],
+)
+metrics.gauge_callback(
+  "bfl_governor_queued", "BFL jobs waiting for a governor slot",
+  lambda: _bfl_governor.stats()["queued_by_priority"], ["priority"],
+)
+
+
+def _bfl_image_future(prompt: str, api_key: str, on_progress=None, priority=governor.INTERACTIVE):
+    """
+    Future resolving to the image URL for prompt. Deduplicated and cached
+    by (model, prompt); new jobs wait for a governor slot at `priority`
+    and are then polled by the shared poller, so no thread is held while
+    BFL works.
+    """
+    key = bfl_images.result_key(prompt)
+    return _bfl_flight.submit(key, lambda: _bfl_governor.submit(lambda: _poller.start(
+        "bfl",
+        submit=lambda: _submit_bfl_image(prompt, api_key),
+        check=lambda polling_url: _check_bfl_image(polling_url, api_key),
+        on_progress=on_progress,
+    ), priority))
+
+
+def _generate_bfl_image(prompt: str, api_key: str) -> str:
+    """Blocking form of `_bfl_image_future`."""
+    return _bfl_image_future(prompt, api_key).result()
+
+
+def _submit_bfl_image(prompt: str, api_key: str) -> str:
+    """Submit one prompt to BFL; returns the job's polling URL."""
+    resp = providers.bfl.post(
+        bfl_images.BFL_URL,
+        headers=bfl_images.submit_headers(api_key),
+        json={"prompt": prompt},
+    ).json()
+    return bfl_images.parse_submit(resp)
 
-    return text.strip()
 
+def _check_bfl_image(polling_url: str, api_key: str):
+    """One poll of a BFL job: (True, sample_url) when ready, else (False, status)."""
+    result = providers.bfl.get(polling_url, headers=bfl_images.poll_headers(api_key)).json()
+    return bfl_images.parse_poll(result)
 
 
 @app.route("/model/prompt", methods=["POST"])
+@_idempotent
 def model_prompt():
+  # No Gemini key: 503 here, rather than a fallback prompt on every call
+  providers.api_key("gemini")
+
   # Parse text fields
   
   base_prompt = request.form.get("base_prompt", "", type=str)
@@ -190,223 +215,461 @@ def model_prompt():
   ct_scans = request.files.getlist("ct_scans")
   #ct_scans = [FakeUpload("ct997.png")]
 
-  # TODO: Persist files to storage if needed and pass paths to your model
-  # TODO: Call your model with patient + files + base_prompt to get a refined prompt
-  name = " ".join([
-        str(patient.get("firstName") or ""),
-        str(patient.get("lastName") or "")
-    ]).strip()
-
-  ctx_lines = [f"Base prompt:\n{base_prompt}\n"]
-  if name:
-      ctx_lines.append(f"Patient name: {name}")
-  if patient:
-      ctx_lines.append("Structured patient JSON:")
-      ctx_lines.append(json.dumps(patient, indent=2))
-
-  ctx_lines.append(
-      f"\nAttachments: {len(ehr_files)} EHR file(s) and {len(ct_scans)} CT scan image(s)."
-  )
-  context_text = "\n".join(ctx_lines)
-
-  # Extract EHR text
-  ehr_text = _extract_ehr_text(ehr_files)
+  # Identical resubmissions (same inputs, same file bytes) reuse the
+  # previous Gemini answer and skip extraction/encoding entirely.
+  cache_key = gemini_prompt.cache_key(base_prompt, patient, ehr_files, ct_scans)
+  cached = gemini_prompt.cache.get(cache_key)
+  if cached:
+    return jsonify(cached)
 
   try:
-      generated_prompt = call_gemini_with_ct_and_ehr(context_text, ehr_text, ct_scans)
-      if not generated_prompt:
-          generated_prompt = f"{base_prompt} [patient:{name or 'n/a'}]"
+      result = call_gemini_with_ct_and_ehr(base_prompt, patient, ehr_files, ct_scans)
+      if result:
+          gemini_prompt.cache.set(cache_key, result)
+      else:
+          result = gemini_prompt.fallback_result(base_prompt, patient)
   except Exception as e:
-      generated_prompt = (
-          f"{base_prompt} [fallback: Gemini error: {e}; "
-          f"patient:{name or 'n/a'}, EHR:{len(ehr_files)}, CT:{len(ct_scans)}]"
+      result = gemini_prompt.fallback_result(
+          base_prompt, patient, e, len(ehr_files), len(ct_scans)
       )
 
-  return jsonify({"generated_prompt": generated_prompt})
+  return jsonify(result)
+
+
+def _run_video_job(job: dict, report):
+  """
+  Worker-side body of a video job: fetch the reference image, start (or
+  resume) the Veo operation, then leave the polling to the shared poller;
+  finish() saves the MP4 under static/videos once the operation is done.
+  """
+  params = job["params"]
+  client = providers.veo_client()
+  # SDK calls go through the same rate limit / breaker as the HTTP clients.
+  veo = resilience.limiter("veo")
+
+  if job.get("operation_name"):
+    # A previous worker already started this operation; just keep polling it.
+    operation = veo_video.pending_operation(job["operation_name"])
+  else:
+    report("fetching_reference")
+    image_url = params.get("image_url")
+    ref = None
+    if image_url:
+      try:
+        ref = _ref_cache.get(image_url)
+      except Exception as e:
+        print(f"Failed to use reference image {image_url}: {e}")
+
+    # Configure generation; include the reference image if available
+    gen_config = veo_video.generate_config(ref)
+
+    operation = veo.call(lambda: client.models.generate_videos(
+      model=veo_video.VEO_MODEL_NAME,
+      prompt=params["prompt"],
+      config=gen_config,
+    ))
+    report("generating", operation_name=operation.name)
+
+  def finish():
+    if operation.error:
+      raise RuntimeError(f"Video generation failed: {operation.error}")
+
+    # Download the video and hand it to the media store (quota + index).
+    report("downloading")
+    video = operation.response.generated_videos[0]
+    veo.call(lambda: client.files.download(file=video.video))
+    filename = f"brain_{uuid.uuid4().hex}.mp4"
+    fd, tmp_path = tempfile.mkstemp(suffix=".mp4")
+    os.close(fd)
+    video.video.save(tmp_path)
+    meta = _media.put(tmp_path, filename, "video/mp4")
+    print(f"Generated video saved as {filename} ({meta['size']} bytes)")
+    # Served by serve_video below: /static/videos/<filename>
+    return {"video_url": f"{params['base_url']}/static/videos/{filename}"}
+
+  if operation.done:
+    return finish()
+
+  # Hand the operation to the shared poller and release this worker; the
+  # queue runs finish() when the poller resolves. Each progress report()
+  # also refreshes the job's lease so it is not reclaimed mid-flight.
+  def check_operation():
+    nonlocal operation
+    operation = veo.call(lambda: client.operations.get(operation))
+    return operation.done, operation
+
+  return video_jobs.then(_poller.watch(
+    "veo",
+    check_operation,
+    on_progress=lambda polls, elapsed, _: report(f"generating (poll {polls}, {int(elapsed)}s)"),
+  ), finish)
+
+
+# Reference images for Veo, stored base64-encoded and revalidated on reuse.
+_ref_cache = ref_cache.RefCache()
+
+# Generated videos: indexed, quota-bounded, served with Range/ETag support.
+_media = media_store.MediaStore()
+# Generated images: mirrored in the background as thumb/preview/full WebP.
+_image_mirror = image_mirror.ImageMirror()
+
+
+@app.route("/static/videos/<name>", methods=["GET"])
+def serve_video(name):
+  """Range-capable, conditionally cached video download."""
+  meta = _media.get(name)
+  if meta is None:
+    return jsonify({"error": "Unknown video"}), 404
+  resp = send_file(
+    meta["path"],
+    mimetype=meta["content_type"],
+    conditional=True,
+    etag=meta["etag"],
+    last_modified=meta["mtime"],
+    max_age=media_store.CACHE_MAX_AGE,
+  )
+  resp.headers["Cache-Control"] = media_store.cache_headers(meta)["Cache-Control"]
+  return resp
+
+
+@app.route("/media/images/<key>/<variant>.webp", methods=["GET"])
+def serve_mirrored_image(key, variant):
+  """A mirrored image variant; redirects upstream until the mirror is ready."""
+  found = _image_mirror.resolve(key, variant)
+  if found is None:
+    return jsonify({"error": "Unknown image"}), 404
+  state, value = found
+  if state == "pending":
+    resp = redirect(value, code=302)
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+  resp = send_file(
+    value["path"],
+    mimetype=value["content_type"],
+    conditional=True,
+    etag=value["etag"],
+    last_modified=value["mtime"],
+    max_age=media_store.CACHE_MAX_AGE,
+  )
+  resp.headers["Cache-Control"] = media_store.cache_headers(value)["Cache-Control"]
+  return resp
+
+
+@app.route("/model/media", methods=["GET"])
+def media_stats():
+  """Files and bytes held by the media store, the image mirror and the reference-image cache."""
+  return jsonify({**_media.stats(), "images": _image_mirror.stats(), "references": _ref_cache.stats()})
+
+
+_video_jobs = video_jobs.lazy_queue(lambda: video_jobs.JobQueue(
+  video_jobs.JobStore(veo_video.VIDEO_JOBS_DB),
+  _run_video_job,
+  max_workers=veo_video.VIDEO_MAX_WORKERS,
+))
+
+
+@app.route("/model/generate_images/cache", methods=["GET"])
+def generate_images_cache_stats():
+  """Returns BFL result-cache counters: hits, misses, coalesced, in_flight, cached."""
+  return jsonify(_bfl_flight.stats())
+
+
+@app.route("/model/governor", methods=["GET"])
+def governor_stats():
+  """BFL slots in use and work queued, by priority."""
+  return jsonify(_bfl_governor.stats())
+
+
+@app.route("/model/providers", methods=["GET"])
+def provider_stats():
+  """Per-provider rate/concurrency limits, usage and circuit-breaker state."""
+  return jsonify(resilience.snapshot())
+
+
+@app.route("/model/poller", methods=["GET"])
+def poller_stats():
+  """Per-provider in-flight jobs, checks issued and observed completion quantiles."""
+  return jsonify(_poller.snapshot())
 
 
 @app.route("/model/generate_video", methods=["POST"])
+@_idempotent
 def generate_video():
-  api_key = os.environ.get("GOOGLE_API_KEY")
-  if not api_key:
-    return jsonify({"error": "Missing GOOGLE_API_KEY"}), 500
-  client = genai.Client(api_key=api_key)
+  """
+  JSON body: { "image_url": str?, "prompt": str | dict | list, "time_point": str?, "seconds": int? }
+  Returns 202: { "job_id", "status", "stage", "status_url" }
+
+  The Veo call runs on a background worker; poll status_url until
+  status is "succeeded" (response then carries video_url) or "failed".
+  """
+  providers.api_key("veo")
 
   payload = request.get_json(silent=True) or {}
-  image_url = payload.get("image_url")
-  user_prompt = payload.get("prompt")
-  time_point = payload.get("time_point")
-  seconds = int(payload.get("seconds") or 7)
-
-  # Normalize prompt:
-  # - If a list is provided (e.g., [{time_point, prompt}, ...]), pick by time_point or first available
-  # - If a dict is provided (e.g., {prompt: "..."}), extract "prompt"
-  # - Else expect a string
-  if isinstance(user_prompt, list):
-    chosen = None
-    if time_point:
-      for item in user_prompt:
-        if isinstance(item, dict) and item.get("time_point") == time_point and isinstance(item.get("prompt"), str):
-          chosen = item.get("prompt")
-          break
-    if not chosen:
-      for item in user_prompt:
-        if isinstance(item, dict) and isinstance(item.get("prompt"), str):
-          chosen = item.get("prompt")
-          break
-    if not chosen:
-      for item in user_prompt:
-        if isinstance(item, str):
-          chosen = item
-          break
-    user_prompt = chosen
-  elif isinstance(user_prompt, dict):
-    maybe = user_prompt.get("prompt")
-    user_prompt = maybe if isinstance(maybe, str) else None
-
-  # Use normalized client prompt when available, otherwise fallback to a sensible default
-  prompt = user_prompt or (
-    "Create a 7‑second, ultra high‑resolution, 360‑degree, eye‑level orbit around a single human brain matching the provided CT/MRI reference image. "
-    "Subject is a medically accurate human brain with realistic cortical gyri and sulci; preserve anatomical proportions and density cues from the reference. "
-    "Camera performs a smooth, stabilized dolly‑orbit over the full duration. "
-    "Composition begins medium‑wide, transitions briefly to a medium shot revealing temporal and hippocampal contours, then returns to medium‑wide by the end. "
-    "Style is clinical, photorealistic medical visualization; no artistic liberties. "
-    "Deep focus with a 35–50mm feel; minimal lens breathing; no motion blur artifacts. "
-    "Neutral medium‑gray background with soft key and subtle rim light to accent form; balanced, natural contrast and color. "
-    "No text, logos, watermarks, or extraneous elements."
-  )
+  params = veo_video.job_params(payload, request.host_url)
+  job_id = _video_jobs().submit(params)
+  job = _video_jobs().store.get(job_id)
+  return jsonify(veo_video.job_response(job)), 202
 
-  # Download the provided image URL and upload it as a reference asset
-  reference_images = []
-  if image_url:
-    try:
-      resp = requests.get(image_url, timeout=30)
-      resp.raise_for_status()
-      content_bytes = resp.content
-      mime = resp.headers.get("Content-Type") or mimetypes.guess_type(image_url)[0] or "image/jpeg"
-      brain_reference = types.VideoGenerationReferenceImage(
-        image={
-          "bytesBase64Encoded": base64.b64encode(content_bytes).decode("utf-8"),
-          "mimeType": mime,
-        },
-        reference_type="inline",
-      )
-      reference_images.append(brain_reference)
-    except Exception as e:
-      print(f"Failed to use reference image {image_url}: {e}")
 
-  # Configure generation; include reference_images if available
-  gen_config = types.GenerateVideosConfig(
-    reference_images=reference_images if reference_images else None,
-    # If duration is supported in your SDK version, you can add it here, e.g.:
-    # duration_seconds=seconds,
-  )
+@app.route("/model/generate_video/<job_id>", methods=["GET"])
+def generate_video_status(job_id):
+  """Returns the job's status/stage, plus video_url once it has succeeded."""
+  job = _video_jobs().store.get(job_id)
+  if job is None:
+    return jsonify({"error": "Unknown job"}), 404
+  return jsonify(veo_video.job_response(job))
 
-  operation = client.models.generate_videos(
-    model="veo-3.1-generate-preview",
-    prompt=prompt,
-    config=gen_config,
-  )
+def _parse_generate_images_payload():
+  payload = request.get_json(silent=True) or {}
+  prompt = payload.get("prompt") or ""
+  print("recieved prompt: ", prompt)
+  timepoints = payload.get("timepoints") or ["now", "3m", "6m", "12m"]
+  # Optional { tp: { "url", "promptUsed" } } from an earlier generation
+  previous = payload.get("previous") or {}
+  return prompt, timepoints, previous
 
-  # Poll the operation status until the video is ready.
-  while not operation.done:
-      print("Waiting for video generation to complete...")
-      time.sleep(10)
-      operation = client.operations.get(operation)
-
-  # Download the video and save to static/videos with a unique filename.
-  video = operation.response.generated_videos[0]
-  client.files.download(file=video.video)
-  filename = f"brain_{uuid.uuid4().hex}.mp4"
-  static_dir = Path(__file__).parent / "static" / "videos"
-  static_dir.mkdir(parents=True, exist_ok=True)
-  output_path = static_dir / filename
-  video.video.save(str(output_path))
-  print(f"Generated video saved to {output_path}")
-  # Serve via Flask static: /static/videos/<filename>
-  base = request.host_url.rstrip("/")
-  video_url = f"{base}/static/videos/{filename}"
-  return jsonify({"video_url": video_url})
 
 @app.route("/model/generate_images", methods=["POST"])
+@_idempotent
 def generate_images():
   """
-  JSON body: { "prompt": str, "timepoints": ["now","3m","6m","12m"]? }
-  Returns: { "images": { "now": url, "3m": url, "6m": url, "12m": url } }
+  JSON body: { "prompt": str, "timepoints": ["now","3m","6m","12m"]?,
+               "previous": { tp: { "url", "promptUsed" } }? }
+  Returns: { "images": { "now": url, "3m": url, "6m": url, "12m": url },
+             "prompts_used": { tp: str }, "reused": [tp],
+             "mirrors": { tp: { "thumb", "preview", "full": url } } }
+
+  Timepoints are submitted concurrently (at most BFL_MAX_CONCURRENCY at a
+  time) and polled by the shared poller; a failed timepoint maps to null.
+  A timepoint whose `previous` image was made from the same composed
+  prompt (its `prompts_used` entry) keeps that image and costs no job.
+  Every image is mirrored locally in the background (see image_mirror.py).
   """
-  payload = request.get_json(silent=True) or {}
-  prompt = payload.get("prompt") or ""
-  print("recieved prompt: ", prompt)
-  timepoints = payload.get("timepoints") or ["now", "3m", "6m", "12m"]
+  prompt, timepoints, previous = _parse_generate_images_payload()
 
-  # Hard-coded BFL endpoint; replace with your own model as needed
-  bfl_url = "https://api.bfl.ai/v1/flux-kontext-pro"
-  api_key = os.environ.get("BFL_API_KEY")
-  if not api_key:
-    return jsonify({"error": "Missing BFL_API_KEY"}), 500
-
-  def generate_one(p: str) -> str:
-    resp = requests.post(
-      bfl_url,
-      headers={
-        "accept": "application/json",
-        "x-key": api_key,
-        "Content-Type": "application/json",
-      },
-      json={"prompt": p},
-      timeout=30,
-    ).json()
-    polling_url = resp.get("polling_url")
-    if not polling_url:
-      raise RuntimeError(f"Bad response: {resp}")
-    # Poll up to ~60s
-    started = time.time()
-    while True:
-      time.sleep(0.5)
-      result = requests.get(
-        polling_url,
-        headers={"accept": "application/json", "x-key": api_key},
-        timeout=30,
-      ).json()
-      status = result.get("status")
-      if status == "Ready":
-        return result["result"]["sample"]
-      if status in ("Error", "Failed"):
-        raise RuntimeError(f"Generation failed: {result}")
-      if time.time() - started > 90:
-        raise TimeoutError("Timed out waiting for image")
-
-  # Slightly tailor the prompt by timepoint; hard-coded phrasing
-  tp_to_suffix = {
-    "now": "current brain state",
-    "3m": "brain state in approximately 3 months",
-    "6m": "brain state in approximately 6 months",
-    "12m": "brain state in approximately 12 months",
-  }
-  images = {}
-
-  # If prompt is an object like { "now": "...", "3m": "...", ... } use those directly.
-  # Otherwise if it's a string, fall back to suffix composition for each timepoint.
-  prompt_per_tp = {}
-  if isinstance(prompt, dict):
-    # Normalize keys to expected timepoints
-    for tp in timepoints:
-      prompt_per_tp[tp] = prompt.get(tp)
-  else:
-    # Single string prompt for all timepoints
+  api_key = providers.api_key("bfl")
+
+  prompt_per_tp = bfl_images.compose_timepoint_prompts(prompt, timepoints)
+  images = bfl_images.unchanged_images(prompt_per_tp, previous)
+  reused = sorted(images)
+
+  # At most BFL_MAX_CONCURRENCY of this request's jobs are outstanding at once;
+  # a slot frees up as soon as one of them resolves.
+  slots = threading.BoundedSemaphore(max(1, bfl_images.BFL_MAX_CONCURRENCY))
+  futures = {}
+  with metrics.stage("bfl_images"):
     for tp in timepoints:
-      suffix = tp_to_suffix.get(tp, str(tp))
-      prompt_per_tp[tp] = f"{prompt}. Please depict the {suffix}."
+      if tp in images:
+        continue
+      slots.acquire()
+      fut = _bfl_image_future(prompt_per_tp[tp], api_key)
+      fut.add_done_callback(lambda _: slots.release())
+      futures[tp] = fut
+    for tp, fut in futures.items():
+      try:
+        images[tp] = fut.result()
+      except Exception as e:
+        print(f"Image generation failed for timepoint {tp}: {e}")
+        images[tp] = None
+
+  return jsonify({
+    "images": images,
+    "prompts_used": prompt_per_tp,
+    "reused": reused,
+    "mirrors": {
+      **_image_mirror.mirrors({tp: images[tp] for tp in reused}, request.host_url, fetch=False),
+      **_image_mirror.mirrors({tp: images[tp] for tp in futures}, request.host_url),
+    },
+  })
+
+
+def _sse(event: str, data: dict) -> str:
+  return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/model/generate_images/stream", methods=["POST"])
+def generate_images_stream():
+  """
+  Same JSON body as /model/generate_images, answered as text/event-stream:
+    event: progress  { timepoint, polls, elapsed, status }          while BFL works
+    event: image     { timepoint, url, prompt_used, reused, mirrors } as each finishes
+    event: error     { timepoint, error }                           per failed timepoint
+    event: done      { images: {tp: url|null}, prompts_used, reused, mirrors, elapsed }
+  Reused timepoints (see /model/generate_images) are sent first.
+  """
+  prompt, timepoints, previous = _parse_generate_images_payload()
 
-  for tp in timepoints:
-    composed = prompt_per_tp.get(tp) or ""
-    try:
-      url = generate_one(composed)
+  api_key = providers.api_key("bfl")
+
+  prompt_per_tp = bfl_images.compose_timepoint_prompts(prompt, timepoints)
+  unchanged = bfl_images.unchanged_images(prompt_per_tp, previous)
+  events = queue.Queue()
+  base_url = request.host_url
+  mirrors = {}
+
+  def image_event(tp, url, reused):
+    # Reused URLs come from the client: only look up an existing mirror.
+    mirrors.update(_image_mirror.mirrors({tp: url}, base_url, fetch=not reused))
+    return _sse("image", {
+      "timepoint": tp, "url": url, "prompt_used": prompt_per_tp[tp], "reused": reused, "mirrors": mirrors.get(tp),
+    })
+
+  def start(tp):
+    def on_progress(polls, elapsed, status):
+      events.put(("progress", {"timepoint": tp, "polls": polls, "elapsed": round(elapsed, 1), "status": status}))
+
+    fut = _bfl_image_future(prompt_per_tp[tp], api_key, on_progress=on_progress)
+    fut.add_done_callback(lambda f: events.put(("result", (tp, f))))
+
+  def stream():
+    started = time.time()
+    pending = [tp for tp in timepoints if tp not in unchanged]
+    images = {}
+    for tp, url in unchanged.items():
       images[tp] = url
+      yield image_event(tp, url, True)
+    active = 0
+    while pending and active < max(1, bfl_images.BFL_MAX_CONCURRENCY):
+      start(pending.pop(0))
+      active += 1
+    while active:
+      try:
+        kind, data = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+      except queue.Empty:
+        yield ": keepalive\n\n"
+        continue
+      if kind == "progress":
+        yield _sse("progress", data)
+        continue
+      tp, fut = data
+      active -= 1
+      if pending:
+        start(pending.pop(0))
+        active += 1
+      try:
+        images[tp] = fut.result()
+        yield image_event(tp, images[tp], False)
+      except Exception as e:
+        print(f"Image generation failed for timepoint {tp}: {e}")
+        images[tp] = None
+        yield _sse("error", {"timepoint": tp, "error": str(e)})
+    yield _sse("done", {
+      "images": images,
+      "prompts_used": prompt_per_tp,
+      "reused": sorted(unchanged),
+      "mirrors": mirrors,
+      "elapsed": round(time.time() - started, 1),
+    })
+
+  return Response(
+    stream_with_context(stream()),
+    mimetype="text/event-stream",
+    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+  )
+
+def _run_batch_job(job: dict) -> Future:
+  """
+  One batch line -> Future of {"images": {tp: url|None}, "errors"?: {tp: msg}}.
+  Timepoints go to the governor at batch priority, behind interactive work.
+  """
+  api_key = providers.api_key("bfl")
+  timepoints = job.get("timepoints") or ["now", "3m", "6m", "12m"]
+  prompt_per_tp = bfl_images.compose_timepoint_prompts(job["prompt"], timepoints)
+  done = Future()
+  images, errors = {}, {}
+  remaining = [len(timepoints)]
+  lock = threading.Lock()
+
+  def collect(tp, fut):
+    try:
+      images[tp] = fut.result()
     except Exception as e:
       images[tp] = None
+      errors[tp] = str(e)
+    with lock:
+      remaining[0] -= 1
+      finished = remaining[0] == 0
+    if finished:
+      done.set_result({"images": images, **({"errors": errors} if errors else {})})
+
+  for tp in timepoints:
+    fut = _bfl_image_future(prompt_per_tp[tp], api_key, priority=governor.BATCH)
+    fut.add_done_callback(lambda f, tp=tp: collect(tp, f))
+  return done
+
+
+_image_batches = batch_jobs.lazy_runner(
+  lambda: batch_jobs.BatchRunner(BATCH_DIR, _run_batch_job, max_in_flight=BATCH_MAX_IN_FLIGHT)
+)
+
+
+def _iter_ndjson(stream):
+  for line in stream:
+    line = line.strip()
+    if line:
+      try:
+        yield json.loads(line)
+      except ValueError:
+        raise batch_jobs.BatchError("Body is not valid NDJSON")
+
+
+@app.route("/model/generate_images/batch", methods=["POST"])
+def generate_images_batch():
+  """
+  Body: { "jobs": [{ "id"?: any, "prompt": str | dict, "timepoints"?: [...] }, ...] }
+  or the same jobs as application/x-ndjson, one per line (spooled to disk
+  as it arrives, for very large batches).
+  Returns 202: { "batch_id", "status_url", "results_url", "total" }
+  """
+  providers.api_key("bfl")
+
+  if request.mimetype == "application/x-ndjson":
+    jobs = _iter_ndjson(request.stream)
+  else:
+    jobs = (request.get_json(silent=True) or {}).get("jobs") or []
+  try:
+    batch_id = _image_batches().create(jobs)
+  except batch_jobs.BatchError as e:
+    return jsonify({"error": str(e)}), 400
+  status = _image_batches().status(batch_id)
+  return jsonify({
+    "batch_id": batch_id,
+    "status_url": f"/model/generate_images/batch/{batch_id}",
+    "results_url": f"/model/generate_images/batch/{batch_id}/results",
+    "total": status["total"],
+  }), 202
+
+
+@app.route("/model/generate_images/batch/<batch_id>", methods=["GET"])
+def generate_images_batch_status(batch_id):
+  """Returns { batch_id, state: running|completed, total, done, failed, ... }."""
+  status = _image_batches().status(batch_id)
+  if status is None:
+    return jsonify({"error": "Unknown batch"}), 404
+  return jsonify(status)
+
+
+@app.route("/model/generate_images/batch/<batch_id>/results", methods=["GET"])
+def generate_images_batch_results(batch_id):
+  """
+  Results written so far, as NDJSON in completion order:
+    { "index", "id"?, "images": {tp: url|null}, "errors"?: {tp: msg} }
+  `?after=N` skips the first N lines, for incremental readers.
+  """
+  if _image_batches().status(batch_id) is None:
+    return jsonify({"error": "Unknown batch"}), 404
+  after = request.args.get("after", 0, type=int)
+  path = _image_batches().results_path(batch_id)
+
+  def lines():
+    with open(path, encoding="utf-8") as f:
+      for i, line in enumerate(f):
+        # A line without its newline is still being written.
+        if i >= after and line.endswith("\n"):
+          yield line
+
+  return Response(lines(), mimetype="application/x-ndjson")
 
-  return jsonify({"images": images})
 
 if __name__ == "__main__":
   # For local testing:
@@ -0,0 +1,341 @@
+"""
+Gemini prompt generation shared by the Flask app and the FastAPI app.
+
+Everything except the HTTP call lives here, so both apps send the same
+request for the same inputs and share one prompt cache:
+
+- `build_context()` turns the form fields into the clinical context text;
+- `build_request()` does the CPU-bound work (EHR ranking, CT
+  preprocessing), fitted to a token budget by `request_planner`, and
+  returns the generateContent body, with the CT images as
+  `ingest.Base64Blob`s for `ingest.JsonStreamBody`;
+- `parse_response()` validates Gemini's structured (JSON) reply and
+  `fallback_result()` is what is returned when that fails.
+
+One call yields both the overall prompt and a tailored prompt per
+timepoint: `{"generated_prompt": str, "prompts": {"now", "3m", "6m",
+"12m"}}`, enforced with a response schema and checked again here.
+
+Uploads are anything with werkzeug's `filename` / `mimetype` / `stream`
+(see `ingest.FileUpload` for other frameworks' uploads).
+"""
+
+import json
+import os
+from pathlib import Path
+
+import bfl_images
+import caching
+import ct_preprocess
+import ehr_extract
+import ingest
+import metrics
+import request_planner
+
+GEMINI_MODEL_NAME = os.environ.get("GEMINI_MODEL_NAME", "gemini-pro-latest")
+# Five prompts of a few sentences each need well under 2k tokens; the rest
+# is headroom for the model's thinking tokens, which count against this.
+GEMINI_MAX_OUTPUT_TOKENS = int(os.environ.get("GEMINI_MAX_OUTPUT_TOKENS", "8192"))
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "generated_prompt": {"type": "STRING"},
+        "prompts": {
+            "type": "OBJECT",
+            "properties": {tp: {"type": "STRING"} for tp in bfl_images.TIMEPOINTS},
+            "required": list(bfl_images.TIMEPOINTS),
+            "propertyOrdering": list(bfl_images.TIMEPOINTS),
+        },
+    },
+    "required": ["generated_prompt", "prompts"],
+    "propertyOrdering": ["generated_prompt", "prompts"],
+}
+GEMINI_GENERATION_CONFIG = {
+    "temperature": 0.2,
+    "maxOutputTokens": GEMINI_MAX_OUTPUT_TOKENS,
+    "topK": 40,
+    "topP": 0.95,
+    "responseMimeType": "application/json",
+    "responseSchema": RESPONSE_SCHEMA,
+}
+# Bump when the instructions sent to Gemini change, so cached prompts
+# produced by the old wording are not reused.
+GEMINI_PROMPT_VERSION = "2"
+# Gemini REST base URL; override to point at a proxy or local stand-in
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+# Generated-prompt cache: in-memory LRU in front of an on-disk tier
+PROMPT_CACHE_DIR = os.environ.get(
+    "PROMPT_CACHE_DIR", str(Path(__file__).parent / "var" / "cache" / "prompts")
+)
+PROMPT_CACHE_TTL = float(os.environ.get("PROMPT_CACHE_TTL", str(7 * 24 * 3600)))
+PROMPT_CACHE_MAX_BYTES = int(os.environ.get("PROMPT_CACHE_MAX_BYTES", str(64 << 20)))
+PROMPT_CACHE_MEMORY_ENTRIES = int(os.environ.get("PROMPT_CACHE_MEMORY_ENTRIES", "256"))
+
+HEADERS = {"Content-Type": "application/json"}
+
+cache = caching.TieredCache(
+    caching.LRUCache(PROMPT_CACHE_MEMORY_ENTRIES, ttl=PROMPT_CACHE_TTL),
+    caching.DiskCache(PROMPT_CACHE_DIR, ttl=PROMPT_CACHE_TTL, max_bytes=PROMPT_CACHE_MAX_BYTES),
+)
+
+
+def url(api_key: str) -> str:
+    return (
+        f"{GEMINI_API_BASE.rstrip('/')}/v1beta/"
+        f"models/{GEMINI_MODEL_NAME}:generateContent?key={api_key}"
+    )
+
+
+def cache_key(base_prompt: str, patient: dict, ehr_files, ct_files) -> str:
+    """
+    Content address for a /model/prompt submission: everything that can
+    change Gemini's answer (inputs, file bytes, model and generation config).
+    """
+    ehr = [(f.filename or "", f.mimetype or "", ingest.file_digest(f)) for f in ehr_files]
+    ct = [(f.mimetype or "", ingest.file_digest(f)) for f in ct_files]
+    return caching.hash_key(
+        GEMINI_PROMPT_VERSION,
+        GEMINI_MODEL_NAME,
+        GEMINI_GENERATION_CONFIG,
+        ct_preprocess.CONFIG,
+        ehr_extract.CONFIG,
+        request_planner.CONFIG,
+        base_prompt,
+        patient,
+        ehr,
+        ct,
+    )
+
+
+def patient_name(patient: dict) -> str:
+    return " ".join([
+        str(patient.get("firstName") or ""),
+        str(patient.get("lastName") or ""),
+    ]).strip()
+
+
+def patient_json(patient: dict, compact: bool = False) -> str:
+    if compact:
+        return json.dumps(patient, separators=(",", ":"), ensure_ascii=False)
+    return json.dumps(patient, indent=2)
+
+
+def build_context(base_prompt: str, patient: dict, n_ehr: int, n_ct: int, compact: bool = False) -> str:
+    name = patient_name(patient)
+    ctx_lines = [f"Base prompt:\n{base_prompt}\n"]
+    if name:
+        ctx_lines.append(f"Patient name: {name}")
+    if patient:
+        ctx_lines.append("Structured patient JSON:")
+        ctx_lines.append(patient_json(patient, compact))
+
+    ctx_lines.append(
+        f"\nAttachments: {n_ehr} EHR file(s) and {n_ct} CT scan image(s)."
+    )
+    return "\n".join(ctx_lines)
+
+
+def extract_ehr_text(ehr_files, query: str = "", token_budget: int = None) -> str:
+    """
+    Ranked EHR excerpt: files are parsed into sections (PDF/DOCX/CSV/JSON/
+    text), scored against `query` (base prompt + patient context) and the
+    best ones packed into `token_budget` (default EHR_TOKEN_BUDGET). See
+    ehr_extract.py.
+    """
+    if not ehr_files:
+        return ""
+    with metrics.stage("ehr_extract"):
+        text = ehr_extract.extract(ehr_files, query, token_budget)
+    metrics.PAYLOAD_BYTES.observe(len(text.encode("utf-8")), kind="ehr_text")
+    return text
+
+
+def encode_ct_files(ct_files):
+    """
+    Turn CT scan uploads into Gemini inlineData parts. The data is a
+    Base64Blob: it is encoded chunk by chunk while the request is sent.
+    """
+    image_parts = []
+    for f in ct_files:
+        mime = f.mimetype or "image/png"  # adjust if you send DICOM
+        image_parts.append({
+            "inlineData": {
+                "mimeType": mime,
+                "data": ingest.Base64Blob(f),
+            }
+        })
+    return image_parts
+
+
+_SYSTEM_TEXT = (
+    "You are a clinical prompt generator for a downstream CT scan image generator. "
+    "You receive clinical context, structured EHR data, unstructured EHR notes, "
+    "and CT brain images. Your task is ONLY to craft a single, rich, well-structured "
+    "prompt that is an extremely detailed clinical explanation of the CT scans and EHR data"
+    "with patient and treatment context.\n\n"
+    "Do NOT give diagnoses or findings directly—just write the best possible prompt."
+)
+_CONTEXT_HEADER = "\n\nClinical / patient context:\n"
+_EHR_HEADER = "\n\nEHR documents (structured & narrative excerpts):\n"
+_IMAGES_TEXT = "\n\nAttached CT brain images (inline): use their visual information."
+_OUTPUT_TEXT = (
+    "\n\nNow output a JSON object with:\n"
+    "- \"generated_prompt\": a SINGLE prompt string of about 4-5 sentences, ready to be fed into a brain CT generation LLM. "
+    "Include: extremely specific detailed clinical explanation of the CT scans, patient demographics, key history, relevant labs/meds, and what the model should focus on.\n"
+    "- \"prompts\": an object with keys \"now\", \"3m\", \"6m\" and \"12m\". Each value is a self-contained prompt of 3-5 sentences "
+    "for the brain CT image at that timepoint (current state, and the expected state in approximately 3, 6 and 12 months "
+    "given the history and treatment), stating what has changed relative to the current scan."
+)
+
+
+def plan_request(base_prompt: str, patient: dict, ehr_files, ct_files):
+    """
+    (plan, context_text, ehr_text): the request_planner.Plan for these
+    inputs and the context and EHR excerpt it settled on.
+    """
+    tokens = ehr_extract.estimate_tokens
+    n_ehr, n_ct = len(ehr_files), len(ct_files)
+    context_text = build_context(base_prompt, patient, n_ehr, n_ct)
+    ehr_text = extract_ehr_text(ehr_files, context_text)
+    json_tokens = tokens(patient_json(patient)) if patient else 0
+    compact_tokens = tokens(patient_json(patient, compact=True)) if patient else 0
+    fixed = "".join((
+        _SYSTEM_TEXT, _CONTEXT_HEADER, context_text,
+        _EHR_HEADER if ehr_text else "", _IMAGES_TEXT if n_ct else "", _OUTPUT_TEXT,
+    ))
+    plan = request_planner.plan(
+        text_tokens=tokens(fixed) - json_tokens,
+        json_tokens=json_tokens,
+        compact_json_tokens=compact_tokens,
+        ehr_tokens=tokens(ehr_text),
+        n_ct=n_ct,
+    )
+    if plan.compact_json:
+        context_text = build_context(base_prompt, patient, n_ehr, n_ct, compact=True)
+    if ehr_text and plan.ehr_tokens < tokens(ehr_text):
+        # Sections are cached, so this only re-ranks and re-packs.
+        ehr_text = extract_ehr_text(ehr_files, context_text, plan.ehr_token_budget) if plan.ehr_tokens else ""
+    return plan, context_text, ehr_text
+
+
+def build_request(base_prompt: str, patient: dict, ehr_files, ct_files) -> dict:
+    """
+    generateContent body for clinical context + EHR text + CT images,
+    fitted to REQUEST_TOKEN_BUDGET (see request_planner.py).
+    """
+    plan, context_text, ehr_text = plan_request(base_prompt, patient, ehr_files, ct_files)
+
+    # Grayscale/window/downscale/dedupe/recompress before upload.
+    with metrics.stage("ct_preprocess"):
+        prepared, ct_report = ct_preprocess.prepare_series(ct_files, plan.ct_config())
+    if ct_files:
+        metrics.PAYLOAD_BYTES.observe(ct_report.bytes_in, kind="ct_upload")
+        metrics.PAYLOAD_BYTES.observe(ct_report.bytes_out, kind="ct_prepared")
+        if ct_report.truncated:
+            metrics.CT_TRUNCATED_FILES.inc(ct_report.truncated)
+        print(
+            f"CT preprocessing: {ct_report.input_slices} slice(s) -> {len(prepared)} image(s), "
+            f"{ct_report.bytes_in} -> {ct_report.bytes_out} bytes in {ct_report.seconds * 1000:.0f} ms"
+        )
+        # Replace the per-upload guess with the images actually sent.
+        plan.images = len(prepared)
+        plan.image_tokens = request_planner.estimate_image_tokens(prepared, plan.max_edge)
+    print(f"Gemini request plan: {plan.describe()}")
+    metrics.REQUEST_TOKENS.observe(plan.total, part="total")
+    metrics.REQUEST_TOKENS.observe(plan.image_tokens, part="images")
+    with metrics.stage("ct_encode"):
+        image_parts = encode_ct_files(prepared)
+
+    parts = [
+        {"text": _SYSTEM_TEXT},
+        {"text": _CONTEXT_HEADER + context_text},
+    ]
+
+    if ehr_text:
+        parts.append({"text": _EHR_HEADER + ehr_text})
+
+    if image_parts:
+        parts.append({"text": _IMAGES_TEXT})
+        parts.extend(image_parts)
+
+    parts.append({"text": _OUTPUT_TEXT})
+
+    return {
+        "contents": [{"parts": parts}],
+        "generationConfig": GEMINI_GENERATION_CONFIG,
+    }
+
+
+def encode_request(body: dict) -> ingest.JsonStreamBody:
+    payload = ingest.JsonStreamBody(body)
+    metrics.PAYLOAD_BYTES.observe(len(payload), kind="gemini_request")
+    return payload
+
+
+def _result_from_prompt(generated_prompt: str) -> dict:
+    """Result shape for a single prompt: timepoints get the suffix composition."""
+    return {
+        "generated_prompt": generated_prompt,
+        "prompts": bfl_images.compose_timepoint_prompts(generated_prompt, bfl_images.TIMEPOINTS),
+    }
+
+
+def validate(obj) -> dict:
+    """Check a structured reply against RESPONSE_SCHEMA; raises ValueError."""
+    if not isinstance(obj, dict):
+        raise ValueError("Gemini reply is not a JSON object")
+    generated_prompt = obj.get("generated_prompt")
+    if not isinstance(generated_prompt, str) or not generated_prompt.strip():
+        raise ValueError("Gemini reply has no generated_prompt")
+    prompts = obj.get("prompts") or {}
+    if not isinstance(prompts, dict):
+        raise ValueError("Gemini reply: prompts is not an object")
+    result = _result_from_prompt(generated_prompt.strip())
+    missing = []
+    for tp in bfl_images.TIMEPOINTS:
+        value = prompts.get(tp)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"Gemini reply: prompts[{tp!r}] is not a string")
+        if value and value.strip():
+            result["prompts"][tp] = value.strip()
+        else:
+            missing.append(tp)
+    if missing:
+        print(f"Gemini reply lacks prompts for {', '.join(missing)}; composed from generated_prompt")
+    return result
+
+
+def parse_response(data: dict):
+    """
+    {"generated_prompt", "prompts"} from a generateContent reply, or None if
+    it has no text. Raises ValueError for truncated or malformed replies.
+    """
+    try:
+        candidate = data["candidates"][0]
+        text = "".join(
+            p.get("text", "") for p in candidate["content"]["parts"] if not p.get("thought")
+        )
+    except Exception:
+        candidate, text = {}, ""
+    if candidate.get("finishReason") == "MAX_TOKENS":
+        raise ValueError(f"Gemini output truncated at {GEMINI_MAX_OUTPUT_TOKENS} tokens")
+    text = text.strip()
+    if not text:
+        return None
+    try:
+        obj = json.loads(text)
+    except ValueError:
+        # Plain-text answer (e.g. a model or proxy without JSON mode).
+        return _result_from_prompt(text)
+    return validate(obj)
+
+
+def fallback_result(base_prompt: str, patient: dict, error=None, n_ehr: int = 0, n_ct: int = 0) -> dict:
+    """What /model/prompt returns when Gemini fails (`error`) or answers with nothing."""
+    name = patient_name(patient)
+    if error is None:
+        return _result_from_prompt(f"{base_prompt} [patient:{name or 'n/a'}]")
+    return _result_from_prompt(
+        f"{base_prompt} [fallback: Gemini error: {error}; "
+        f"patient:{name or 'n/a'}, EHR:{n_ehr}, CT:{n_ct}]"
+    )
@@ -0,0 +1,91 @@
+"""
+Process-wide cap on concurrent upstream jobs, with priorities.
+
+`PriorityGovernor.submit(start, priority)` runs `start()` (which must
+return a Future, e.g. from the shared poller) once a slot is free and
+frees the slot when that future resolves. Waiting work is dispatched
+lowest priority value first, FIFO within a priority, so interactive
+requests overtake queued batch work. `reserve` slots are kept for
+interactive traffic only, so a full batch never makes a user wait for a
+batch job to finish before theirs is submitted.
+
+Nothing blocks: queued work is a heap entry, not a parked thread.
+"""
+
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+
+INTERACTIVE = 0
+BATCH = 10
+
+
+class PriorityGovernor:
+    def __init__(self, limit: int, reserve: int = 0):
+        self.limit = max(1, limit)
+        self.reserve = max(0, min(reserve, self.limit - 1))
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._active = 0
+        self._active_by_priority = {}
+
+    def submit(self, start, priority: int = INTERACTIVE) -> Future:
+        """Future mirroring the one `start()` returns once it has a slot."""
+        proxy = Future()
+        with self._lock:
+            heapq.heappush(self._heap, (priority, next(self._seq), start, proxy))
+        self._dispatch()
+        return proxy
+
+    def stats(self) -> dict:
+        with self._lock:
+            queued = {}
+            for priority, _, _, _ in self._heap:
+                queued[priority] = queued.get(priority, 0) + 1
+            return {
+                "limit": self.limit,
+                "reserve": self.reserve,
+                "active": self._active,
+                "active_by_priority": {_name(p): n for p, n in self._active_by_priority.items() if n},
+                "queued_by_priority": {_name(p): n for p, n in queued.items()},
+            }
+
+    def _can_start(self, priority: int) -> bool:
+        cap = self.limit if priority <= INTERACTIVE else self.limit - self.reserve
+        return self._active < cap
+
+    def _dispatch(self):
+        while True:
+            with self._lock:
+                if not self._heap or not self._can_start(self._heap[0][0]):
+                    return
+                priority, _, start, proxy = heapq.heappop(self._heap)
+                self._active += 1
+                self._active_by_priority[priority] = self._active_by_priority.get(priority, 0) + 1
+            try:
+                inner = start()
+            except BaseException as e:
+                self._release(priority)
+                proxy.set_exception(e)
+                continue
+            inner.add_done_callback(lambda f, p=priority, out=proxy: self._settle(f, p, out))
+
+    def _settle(self, inner: Future, priority: int, proxy: Future):
+        self._release(priority)
+        error = inner.exception()
+        if error is not None:
+            proxy.set_exception(error)
+        else:
+            proxy.set_result(inner.result())
+        self._dispatch()
+
+    def _release(self, priority: int):
+        with self._lock:
+            self._active -= 1
+            self._active_by_priority[priority] -= 1
+
+
+def _name(priority: int) -> str:
+    return {INTERACTIVE: "interactive", BATCH: "batch"}.get(priority, str(priority))
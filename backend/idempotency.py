@@ -0,0 +1,274 @@
+"""
+Idempotency-Key support for the generation POST endpoints.
+
+A client that sends `Idempotency-Key: <token>` may repeat the request
+(retry, double submit) without starting another upstream job:
+
+- first request with a key: runs, and its response is remembered for
+  IDEMPOTENCY_TTL seconds (at most IDEMPOTENCY_MAX_ENTRIES keys, LRU);
+- repeat while the first is still running: waits for it (up to
+  IDEMPOTENCY_WAIT seconds, then 409) and gets the same response;
+- repeat after it finished: gets the stored response, with
+  `Idempotent-Replayed: true`;
+- same key with a different request body: 422.
+
+Keys are scoped to the endpoint (method + path), and the body is compared
+by fingerprint: canonical JSON, or form fields plus file digests for
+multipart, so a browser's fresh multipart boundary does not count as a
+change. Responses with status >= 500 (and exceptions) are handed to
+requests already waiting but not kept, so a later retry runs again.
+
+The store is per process, like the other caches; with several workers,
+route retries to the same one or accept a duplicate across workers.
+
+`flask_idempotent(store)` decorates Flask views; `run_fastapi()` wraps a
+FastAPI handler's body.
+"""
+
+import asyncio
+import functools
+import json
+import os
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from dataclasses import dataclass, field
+
+import caching
+import ingest
+import metrics
+
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", "2048"))
+IDEMPOTENCY_WAIT = float(os.environ.get("IDEMPOTENCY_WAIT", "600"))
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+# Response headers worth replaying besides the body's content type
+_KEPT_HEADERS = ("Location",)
+
+
+class KeyMismatch(Exception):
+    """The key was first used with a different request body."""
+
+
+class StillRunning(Exception):
+    """The first request with this key did not finish within the wait."""
+
+
+@dataclass
+class StoredResponse:
+    status: int
+    body: bytes
+    content_type: str
+    headers: dict = field(default_factory=dict)
+
+
+@dataclass
+class _Entry:
+    cache_key: str
+    fingerprint: str
+    future: Future = field(default_factory=Future)
+
+
+def fingerprint_body(content_type: str, body: bytes) -> str:
+    """Fingerprint of a raw request body; JSON bodies are canonicalized."""
+    if (content_type or "").split(";")[0].strip() == "application/json":
+        try:
+            return caching.hash_key("json", json.loads(body or b"null"))
+        except ValueError:
+            pass
+    return caching.hash_key("raw", body or b"")
+
+
+def fingerprint_form(fields, files) -> str:
+    """
+    Fingerprint of a multipart form: `fields` is (name, value) pairs,
+    `files` (name, upload) pairs of upload-like objects (see ingest).
+    """
+    return caching.hash_key(
+        "form",
+        sorted((str(name), str(value)) for name, value in fields),
+        [(name, f.filename or "", ingest.file_digest(f)) for name, f in files],
+    )
+
+
+class IdempotencyStore:
+    def __init__(self, max_entries: int = IDEMPOTENCY_MAX_ENTRIES, ttl: float = IDEMPOTENCY_TTL):
+        self._entries = caching.LRUCache(max_entries, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def begin(self, scope: str, key: str, fingerprint: str):
+        """
+        (entry, leader). The leader must call `finish()`; everyone else
+        waits on the entry with `result()`. Raises KeyMismatch.
+        """
+        cache_key = caching.hash_key(scope, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                if entry.fingerprint != fingerprint:
+                    metrics.IDEMPOTENT_REQUESTS.inc(outcome="mismatch")
+                    raise KeyMismatch(key)
+                done = entry.future.done()
+                metrics.IDEMPOTENT_REQUESTS.inc(outcome="replayed" if done else "attached")
+                return entry, False
+            entry = _Entry(cache_key, fingerprint)
+            self._entries.set(cache_key, entry)
+        metrics.IDEMPOTENT_REQUESTS.inc(outcome="new")
+        return entry, True
+
+    def finish(self, entry: _Entry, response: StoredResponse = None, error: BaseException = None):
+        """Publish the leader's outcome; only non-5xx responses are kept."""
+        if response is None or response.status >= 500:
+            with self._lock:
+                if self._entries.get(entry.cache_key) is entry:
+                    self._entries.pop(entry.cache_key)
+        if response is not None:
+            entry.future.set_result(response)
+        elif isinstance(error, Exception):
+            entry.future.set_exception(error)
+        else:
+            # Cancellation/exit of the first request: fail the waiters, don't cancel them.
+            entry.future.set_exception(RuntimeError(f"original request did not complete ({error!r})"))
+
+    @staticmethod
+    def result(entry: _Entry, timeout: float = IDEMPOTENCY_WAIT) -> StoredResponse:
+        """The leader's response (blocking); raises StillRunning on timeout."""
+        try:
+            return entry.future.result(timeout=timeout)
+        except FutureTimeout:
+            raise StillRunning() from None
+
+    def stats(self) -> dict:
+        return {"keys": len(self._entries)}
+
+
+def _valid_key(key: str) -> bool:
+    return 0 < len(key) <= MAX_KEY_LENGTH and key.isprintable()
+
+
+# -- Flask --------------------------------------------------------------------
+
+def flask_idempotent(store: IdempotencyStore):
+    """Decorator for Flask views; requests without the header pass through."""
+    from flask import Response, jsonify, make_response, request
+
+    def replay(stored: StoredResponse):
+        resp = Response(stored.body, status=stored.status, content_type=stored.content_type)
+        resp.headers.update(stored.headers)
+        resp.headers[REPLAYED_HEADER] = "true"
+        return resp
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            if key is None:
+                return view(*args, **kwargs)
+            if not _valid_key(key):
+                return jsonify({"error": f"Invalid {HEADER}"}), 400
+            if request.mimetype == "multipart/form-data":
+                fingerprint = fingerprint_form(request.form.items(multi=True), request.files.items(multi=True))
+            else:
+                fingerprint = fingerprint_body(request.mimetype, request.get_data(cache=True))
+            try:
+                entry, leader = store.begin(f"{request.method} {request.path}", key, fingerprint)
+            except KeyMismatch:
+                return jsonify({"error": f"{HEADER} was already used with a different request"}), 422
+            if not leader:
+                try:
+                    return replay(store.result(entry))
+                except StillRunning:
+                    return jsonify({"error": f"A request with this {HEADER} is still in progress"}), 409
+            try:
+                resp = make_response(view(*args, **kwargs))
+            except BaseException as e:
+                store.finish(entry, error=e)
+                raise
+            if resp.is_streamed:
+                store.finish(entry, error=RuntimeError("streamed responses are not stored"))
+                return resp
+            store.finish(entry, StoredResponse(
+                resp.status_code,
+                resp.get_data(),
+                resp.content_type,
+                {h: resp.headers[h] for h in _KEPT_HEADERS if h in resp.headers},
+            ))
+            return resp
+
+        return wrapper
+
+    return decorator
+
+
+# -- FastAPI --------------------------------------------------------------------
+
+async def request_fingerprint(request) -> str:
+    """Fingerprint of a Starlette request's body (reads the cached body/form)."""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        fields, files = [], []
+        for name, value in form.multi_items():
+            if isinstance(value, str):
+                fields.append((name, value))
+            else:
+                files.append((name, ingest.FileUpload(value.file, value.filename, value.content_type)))
+        # Hashing the uploads reads them; keep that off the event loop.
+        return await asyncio.to_thread(fingerprint_form, fields, files)
+    return fingerprint_body(content_type, await request.body())
+
+
+async def run_fastapi(store: IdempotencyStore, request, handler, fingerprint: str = None):
+    """
+    Run `await handler()` under the request's Idempotency-Key, if any.
+    The handler's return value is JSON-encoded as FastAPI would; the result
+    is always a Response.
+    """
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse, Response
+
+    async def respond():
+        result = await handler()
+        if isinstance(result, Response):
+            return result
+        return JSONResponse(jsonable_encoder(result))
+
+    key = request.headers.get(HEADER)
+    if key is None:
+        return await respond()
+    if not _valid_key(key):
+        return JSONResponse({"error": f"Invalid {HEADER}"}, status_code=400)
+    if fingerprint is None:
+        fingerprint = await request_fingerprint(request)
+    try:
+        entry, leader = store.begin(f"{request.method} {request.url.path}", key, fingerprint)
+    except KeyMismatch:
+        return JSONResponse({"error": f"{HEADER} was already used with a different request"}, status_code=422)
+
+    if not leader:
+        try:
+            # Shielded: a waiter timing out or going away must not cancel the entry.
+            stored = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(entry.future)), IDEMPOTENCY_WAIT)
+        except asyncio.TimeoutError:
+            return JSONResponse({"error": f"A request with this {HEADER} is still in progress"}, status_code=409)
+        headers = {**stored.headers, REPLAYED_HEADER: "true"}
+        return Response(stored.body, status_code=stored.status, media_type=stored.content_type, headers=headers)
+
+    try:
+        resp = await respond()
+    except BaseException as e:
+        store.finish(entry, error=e)
+        raise
+    body = getattr(resp, "body", None)
+    if body is None:
+        store.finish(entry, error=RuntimeError("streamed responses are not stored"))
+        return resp
+    store.finish(entry, StoredResponse(
+        resp.status_code,
+        bytes(body),
+        resp.headers.get("content-type", "application/json"),
+        {h: resp.headers[h] for h in _KEPT_HEADERS if h in resp.headers},
+    ))
+    return resp
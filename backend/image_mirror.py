@@ -0,0 +1,257 @@
+"""
+Local mirror of generated images, with a small WebP variant pyramid.
+
+BFL sample URLs are remote, full-resolution and expire. Every image URL
+a generation job returns is handed to `ImageMirror.enqueue()` (never a
+URL supplied by a client), which downloads it in the background and stores one WebP file per variant:
+
+  thumb    long edge IMAGE_MIRROR_THUMB_EDGE (grids, timelines)
+  preview  long edge IMAGE_MIRROR_PREVIEW_EDGE (case page)
+  full     original size
+
+Files are content-addressed (`<sha256>_<variant>.webp`, so two URLs that
+served the same bytes share them) and kept in a `media_store.MediaStore`
+with its own root, quota and last-access eviction. The mirror table
+(in the same SQLite file as the store's index) maps the URL hash to the
+content hash:
+
+  url_hash -> url, sha256, status (pending | ready | failed), error
+
+Clients get `/media/images/<url_hash>/<variant>.webp` URLs immediately
+(see `mirror_urls()`); until the download is done those redirect to the
+upstream URL, afterwards they serve the local file as `immutable`. A
+ready entry whose files were evicted is mirrored again on next request;
+a failed one at most every IMAGE_MIRROR_RETRY seconds.
+"""
+
+import hashlib
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+import media_store
+import metrics
+import providers
+
+IMAGE_MIRROR_ROOT = os.environ.get(
+    "IMAGE_MIRROR_ROOT", str(Path(__file__).parent / "static" / "images")
+)
+IMAGE_MIRROR_INDEX = os.environ.get(
+    "IMAGE_MIRROR_INDEX", str(Path(__file__).parent / "var" / "image_mirror.sqlite3")
+)
+IMAGE_MIRROR_WORKERS = int(os.environ.get("IMAGE_MIRROR_WORKERS", "2"))
+IMAGE_MIRROR_MAX_BYTES = int(os.environ.get("IMAGE_MIRROR_MAX_BYTES", str(2 << 30)))
+IMAGE_MIRROR_MAX_AGE = float(os.environ.get("IMAGE_MIRROR_MAX_AGE", str(180 * 24 * 3600)))
+# Larger downloads are refused (a BFL sample is a few MiB at most)
+IMAGE_MIRROR_MAX_DOWNLOAD = int(os.environ.get("IMAGE_MIRROR_MAX_DOWNLOAD", str(32 << 20)))
+IMAGE_MIRROR_RETRY = float(os.environ.get("IMAGE_MIRROR_RETRY", "300"))
+
+# variant -> (long edge or None for original size, WebP quality)
+VARIANTS = {
+    "thumb": (int(os.environ.get("IMAGE_MIRROR_THUMB_EDGE", "256")), 75),
+    "preview": (int(os.environ.get("IMAGE_MIRROR_PREVIEW_EDGE", "768")), 82),
+    "full": (None, 90),
+}
+ROUTE_PREFIX = "/media/images"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mirrors (
+    url_hash TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    sha256 TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def url_hash(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+
+def mirror_urls(key: str, base_url: str) -> dict:
+    """{variant: absolute URL} for a mirror key."""
+    return {v: f"{base_url.rstrip('/')}{ROUTE_PREFIX}/{key}/{v}.webp" for v in VARIANTS}
+
+
+def _variant_name(sha256: str, variant: str) -> str:
+    return f"{sha256}_{variant}.webp"
+
+
+def encode_variants(data: bytes) -> dict:
+    """{variant: WebP bytes} for an image's bytes."""
+    out = {}
+    with Image.open(io.BytesIO(data)) as im:
+        im.load()
+        if im.mode not in ("RGB", "RGBA", "L"):
+            im = im.convert("RGBA" if "A" in im.getbands() else "RGB")
+        for variant, (edge, quality) in VARIANTS.items():
+            img = im.copy()
+            if edge:
+                img.thumbnail((edge, edge), Image.LANCZOS)
+            buf = io.BytesIO()
+            img.save(buf, format="WEBP", quality=quality, method=4)
+            out[variant] = buf.getvalue()
+    return out
+
+
+class ImageMirror:
+    def __init__(
+        self,
+        root=IMAGE_MIRROR_ROOT,
+        index_path=IMAGE_MIRROR_INDEX,
+        max_bytes: int = IMAGE_MIRROR_MAX_BYTES,
+        max_age: float = IMAGE_MIRROR_MAX_AGE,
+        workers: int = IMAGE_MIRROR_WORKERS,
+        client: providers.ProviderClient = None,
+    ):
+        self.store = media_store.MediaStore(root, index_path, max_bytes=max_bytes, max_age=max_age)
+        self.index_path = Path(index_path)
+        # None: the shared fetch client, resolved on first download
+        self.client = client
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="image-mirror")
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            # Downloads interrupted by a restart are picked up again on request.
+            conn.execute(
+                "UPDATE mirrors SET status = 'failed', error = 'interrupted', updated_at = 0 "
+                "WHERE status = 'pending'"
+            )
+
+    def _connect(self):
+        conn = sqlite3.connect(str(self.index_path), timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _row(self, key: str):
+        with self._connect() as conn:
+            return conn.execute("SELECT * FROM mirrors WHERE url_hash = ?", (key,)).fetchone()
+
+    def enqueue(self, url: str) -> str:
+        """Start mirroring url (once) and return its key."""
+        key = url_hash(url)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO mirrors (url_hash, url, status, created_at, updated_at) "
+                "VALUES (?, ?, 'pending', ?, ?)",
+                (key, url, now, now),
+            )
+            row = conn.execute("SELECT * FROM mirrors WHERE url_hash = ?", (key,)).fetchone()
+        self._ensure(row)
+        return key
+
+    def mirrors(self, images: dict, base_url: str, fetch: bool = True) -> dict:
+        """
+        {tp: {variant: url}} for the http(s) URLs in {tp: url | None}.
+
+        Only pass fetch=True for URLs this server got from a provider job.
+        URLs a client sent back (e.g. `previous` images) use fetch=False: they
+        get mirror URLs only if they were mirrored before and are never
+        downloaded, so a client cannot make the server fetch arbitrary
+        addresses into the media store.
+        """
+        out = {}
+        for tp, url in images.items():
+            if not (isinstance(url, str) and url.startswith(("http://", "https://")) and ROUTE_PREFIX not in url):
+                continue
+            if fetch:
+                out[tp] = mirror_urls(self.enqueue(url), base_url)
+            elif self._row(url_hash(url)) is not None:
+                out[tp] = mirror_urls(url_hash(url), base_url)
+        return out
+
+    def resolve(self, key: str, variant: str):
+        """
+        ("ready", store meta) when the variant is mirrored, ("pending", url)
+        when it is not (yet), None for an unknown key or variant.
+        """
+        if variant not in VARIANTS:
+            return None
+        row = self._row(key)
+        if row is None:
+            return None
+        if row["status"] == "ready":
+            meta = self.store.get(_variant_name(row["sha256"], variant))
+            if meta is not None:
+                return "ready", meta
+        self._ensure(row)
+        return "pending", row["url"]
+
+    def _ensure(self, row):
+        """(Re)start the download for a row that is not usable as is."""
+        if row["status"] == "ready" and self._files_present(row["sha256"]):
+            return
+        if row["status"] == "failed" and time.time() - row["updated_at"] < IMAGE_MIRROR_RETRY:
+            return
+        self._submit(row["url_hash"], row["url"])
+
+    def _files_present(self, sha256) -> bool:
+        return bool(sha256) and all(
+            self.store.path(_variant_name(sha256, v)).exists() for v in VARIANTS
+        )
+
+    def _submit(self, key: str, url: str):
+        with self._lock:
+            if key in self._in_flight:
+                return
+            self._in_flight.add(key)
+        self._set(key, status="pending", error=None)
+        self._pool.submit(self._mirror, key, url)
+
+    def _set(self, key: str, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = :{name}" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE mirrors SET {assignments} WHERE url_hash = :key", {**fields, "key": key})
+
+    def _mirror(self, key: str, url: str):
+        try:
+            with metrics.stage("image_mirror"):
+                resp = (self.client or providers.fetch).get(url, stream=True)
+                resp.raise_for_status()
+                data = bytearray()
+                for chunk in resp.iter_content(1 << 16):
+                    data += chunk
+                    if len(data) > IMAGE_MIRROR_MAX_DOWNLOAD:
+                        resp.close()
+                        raise ValueError(f"image larger than {IMAGE_MIRROR_MAX_DOWNLOAD} bytes")
+                sha256 = hashlib.sha256(data).hexdigest()
+                if not self._files_present(sha256):
+                    for variant, webp in encode_variants(bytes(data)).items():
+                        self._put(sha256, variant, webp)
+            metrics.PAYLOAD_BYTES.observe(len(data), kind="mirrored_image")
+            metrics.IMAGE_MIRRORS.inc(outcome="ok")
+            self._set(key, status="ready", sha256=sha256, error=None)
+        except Exception as e:
+            # The message itself is kept on the mirrors row.
+            metrics.IMAGE_MIRRORS.inc(outcome=type(e).__name__)
+            self._set(key, status="failed", error=str(e))
+        finally:
+            with self._lock:
+                self._in_flight.discard(key)
+
+    def _put(self, sha256: str, variant: str, webp: bytes):
+        fd, tmp = tempfile.mkstemp(suffix=".webp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(webp)
+        self.store.put(tmp, _variant_name(sha256, variant), "image/webp")
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM mirrors GROUP BY status").fetchall())
+        with self._lock:
+            in_flight = len(self._in_flight)
+        return {"mirrors": counts, "in_flight": in_flight, **self.store.stats()}
+
@@ -0,0 +1,236 @@
+"""
+Memory-bounded handling of uploaded EHR/CT files.
+
+- `UploadBudget.open()` is used as the multipart stream factory: each
+  upload is written chunk by chunk into a `SpooledUpload`, which hashes
+  and counts bytes as they arrive, rolls over to a temp file above
+  `spool_bytes`, and raises `UploadTooLarge` as soon as a per-file or
+  per-request limit is crossed.
+- `Base64Blob` + `JsonStreamBody` let a JSON request body reference file
+  contents that are base64-encoded on the fly while the body is sent, so
+  the encoded payload never exists in memory as one string.
+- `read_text()` decodes at most `max_chars` characters incrementally.
+- `FileUpload` presents another framework's upload (e.g. Starlette's
+  `UploadFile`) with werkzeug's `filename` / `mimetype` / `stream`;
+  `spool()` copies such an upload through an `UploadBudget`, for
+  frameworks that don't let us supply the stream factory.
+"""
+
+import base64
+import codecs
+import hashlib
+import json
+import os
+import tempfile
+
+# 48 KiB of raw bytes -> 64 KiB of base64; a multiple of 3 keeps chunk
+# boundaries free of padding.
+_B64_CHUNK = 3 * 16 * 1024
+_READ_CHUNK = 64 * 1024
+
+UPLOAD_SPOOL_BYTES = int(os.environ.get("UPLOAD_SPOOL_BYTES", str(1 << 20)))
+UPLOAD_MAX_FILE_BYTES = int(os.environ.get("UPLOAD_MAX_FILE_BYTES", str(200 << 20)))
+UPLOAD_MAX_REQUEST_BYTES = int(os.environ.get("UPLOAD_MAX_REQUEST_BYTES", str(1 << 30)))
+
+
+class UploadTooLarge(Exception):
+    # Deliberately not a ValueError: werkzeug's form parser silently
+    # swallows ValueErrors, which would turn this into "no files".
+    pass
+
+
+class UploadBudget:
+    """Per-request byte accounting shared by all of the request's uploads."""
+
+    def __init__(
+        self,
+        max_request_bytes: int = UPLOAD_MAX_REQUEST_BYTES,
+        max_file_bytes: int = UPLOAD_MAX_FILE_BYTES,
+        spool_bytes: int = UPLOAD_SPOOL_BYTES,
+    ):
+        self.max_request_bytes = max_request_bytes
+        self.max_file_bytes = max_file_bytes
+        self.spool_bytes = spool_bytes
+        self.used = 0
+
+    def charge(self, n: int):
+        self.used += n
+        if self.used > self.max_request_bytes:
+            raise UploadTooLarge(f"Uploads exceed {self.max_request_bytes} bytes per request")
+
+    def open(self, filename: str = None) -> "SpooledUpload":
+        return SpooledUpload(self, filename)
+
+
+class SpooledUpload:
+    """
+    Writable/readable upload buffer: in memory up to the budget's
+    `spool_bytes`, then a temp file. `sha256` and `size` are final once
+    writing is done (werkzeug seeks back to 0 before handing it over).
+    """
+
+    def __init__(self, budget: UploadBudget, filename: str = None):
+        self.budget = budget
+        self.filename = filename
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = tempfile.SpooledTemporaryFile(max_size=budget.spool_bytes)
+
+    def write(self, data) -> int:
+        n = len(data)
+        if self.size + n > self.budget.max_file_bytes:
+            raise UploadTooLarge(
+                f"{self.filename or 'upload'} exceeds {self.budget.max_file_bytes} bytes"
+            )
+        self.budget.charge(n)
+        self.size += n
+        self._hash.update(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def __getattr__(self, name):
+        # read/seek/tell/readline/close/... go straight to the spool.
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class FileUpload:
+    """werkzeug `FileStorage`-like view of an upload: filename, mimetype, stream."""
+
+    def __init__(self, stream, filename: str = None, mimetype: str = None):
+        self.stream = stream
+        self.filename = filename
+        self.mimetype = mimetype or ""
+
+
+def spool(upload: FileUpload, budget: UploadBudget) -> FileUpload:
+    """
+    Copy an already received upload into a `SpooledUpload` charged to
+    `budget` (same limits as the multipart stream factory, and the digest
+    is computed on the way). Raises UploadTooLarge.
+    """
+    target = budget.open(upload.filename)
+    try:
+        upload.stream.seek(0)
+        for chunk in iter(lambda: upload.stream.read(_READ_CHUNK), b""):
+            target.write(chunk)
+    except BaseException:
+        target.close()
+        raise
+    target.seek(0)
+    return FileUpload(target, upload.filename, upload.mimetype)
+
+
+def file_digest(f) -> str:
+    """sha256 of an upload, reusing the digest computed while it streamed in."""
+    stream = getattr(f, "stream", f)
+    if isinstance(stream, SpooledUpload):
+        return stream.sha256
+    h = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(_READ_CHUNK), b""):
+        h.update(chunk)
+    stream.seek(0)
+    return h.hexdigest()
+
+
+def stream_size(f) -> int:
+    stream = getattr(f, "stream", f)
+    if isinstance(stream, SpooledUpload):
+        return stream.size
+    pos = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(pos)
+    return size
+
+
+def iter_base64(stream, chunk_size: int = _B64_CHUNK):
+    """Yield base64 (ASCII bytes) for a seekable stream, one chunk at a time."""
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        yield base64.b64encode(chunk)
+    stream.seek(0)
+
+
+def read_text(stream, max_chars: int, encoding: str = "utf-8") -> str:
+    """Decode up to max_chars characters without reading the rest of the file."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="ignore")
+    parts = []
+    remaining = max_chars
+    stream.seek(0)
+    while remaining > 0:
+        raw = stream.read(_READ_CHUNK)
+        text = decoder.decode(raw, final=not raw)
+        if text:
+            text = text[:remaining]
+            parts.append(text)
+            remaining -= len(text)
+        if not raw:
+            break
+    stream.seek(0)
+    return "".join(parts)
+
+
+class Base64Blob:
+    """Placeholder for a base64 string whose bytes come from `stream`."""
+
+    def __init__(self, stream, size: int = None):
+        self.stream = getattr(stream, "stream", stream)
+        self.size = stream_size(self.stream) if size is None else size
+
+    @property
+    def encoded_len(self) -> int:
+        return 4 * ((self.size + 2) // 3)
+
+
+class JsonStreamBody:
+    """
+    Iterable JSON request body in which `Base64Blob` values are streamed.
+
+    Re-iterable (so retries resend the whole body) and sized (so requests
+    sends a Content-Length instead of chunked encoding).
+    """
+
+    def __init__(self, obj):
+        self._blobs = []
+        encoded = json.dumps(self._substitute(obj), separators=(",", ":"))
+        self._pieces = []
+        for i, blob in enumerate(self._blobs):
+            head, encoded = encoded.split(f'"{_marker(i)}"', 1)
+            self._pieces.append(head.encode("utf-8"))
+        self._tail = encoded.encode("utf-8")
+
+    def _substitute(self, obj):
+        if isinstance(obj, Base64Blob):
+            self._blobs.append(obj)
+            return _marker(len(self._blobs) - 1)
+        if isinstance(obj, dict):
+            return {k: self._substitute(v) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return [self._substitute(v) for v in obj]
+        return obj
+
+    def __len__(self) -> int:
+        return (
+            sum(len(p) for p in self._pieces)
+            + sum(b.encoded_len + 2 for b in self._blobs)
+            + len(self._tail)
+        )
+
+    def __iter__(self):
+        for head, blob in zip(self._pieces, self._blobs):
+            yield head
+            yield b'"'
+            yield from iter_base64(blob.stream)
+            yield b'"'
+        yield self._tail
+
+
+def _marker(i: int) -> str:
+    return f"__ingest_blob_{i}__"
@@ -0,0 +1,261 @@
+"""
+Managed storage for generated media (videos under static/videos).
+
+Files live flat in one directory; a SQLite index next to them records
+size, content type, a strong ETag (sha256 of the bytes), creation time
+and last access. The index drives:
+
+- conditional GETs and long-lived caching: names are unique per render,
+  so responses can be `immutable`, and `not_modified()` answers
+  If-None-Match / If-Modified-Since without touching the file;
+- quota enforcement: after every `put()`, entries whose last access is
+  older than MEDIA_MAX_AGE are removed, then the least recently accessed
+  ones until the directory is under MEDIA_MAX_BYTES. The file just
+  written is never evicted by its own put.
+
+Range requests are left to the web frameworks' file responses (Flask's
+`send_file(conditional=True)`, Starlette's `FileResponse`), which are
+given the path, ETag and mtime from here.
+
+Files that appear in the directory without going through `put()` (e.g.
+from older versions), or whose size or mtime no longer match the index,
+are (re)hashed into it by a background thread started with the store, so
+startup does not wait on hashing a large directory. Until that scan is
+done, `get()` adopts an unindexed file on demand.
+"""
+
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", str(Path(__file__).parent / "static" / "videos"))
+MEDIA_INDEX = os.environ.get("MEDIA_INDEX", str(Path(__file__).parent / "var" / "media.sqlite3"))
+MEDIA_MAX_BYTES = int(os.environ.get("MEDIA_MAX_BYTES", str(5 << 30)))
+MEDIA_MAX_AGE = float(os.environ.get("MEDIA_MAX_AGE", str(30 * 24 * 3600)))
+# One year; safe because a name is never reused for different bytes.
+CACHE_MAX_AGE = 365 * 24 * 3600
+# Last-access updates are coalesced to at most one write per this many seconds.
+_TOUCH_INTERVAL = 60
+
+_NAME = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    content_type TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS media_last_access ON media (last_access);
+"""
+
+
+def _sha256_file(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class MediaStore:
+    def __init__(
+        self,
+        root=MEDIA_ROOT,
+        index_path=MEDIA_INDEX,
+        max_bytes: int = MEDIA_MAX_BYTES,
+        max_age: float = MEDIA_MAX_AGE,
+    ):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.index_path = Path(index_path)
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._reconciled = threading.Event()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            # Indexes created before the file mtime was recorded
+            columns = {r[1] for r in conn.execute("PRAGMA table_info(media)")}
+            if "mtime" not in columns:
+                conn.execute("ALTER TABLE media ADD COLUMN mtime REAL")
+        threading.Thread(target=self.reconcile, name="media-reconcile", daemon=True).start()
+
+    def _connect(self):
+        return sqlite3.connect(str(self.index_path), timeout=30)
+
+    def path(self, name: str) -> Path:
+        if not _NAME.match(name):
+            raise ValueError(f"Bad media name: {name!r}")
+        return self.root / name
+
+    def put(self, src, name: str, content_type: str = None) -> dict:
+        """Move the finished file at `src` into the store as `name`."""
+        dest = self.path(name)
+        tmp = dest.with_name(dest.name + ".part")
+        shutil.move(str(src), tmp)
+        etag = _sha256_file(tmp)[:32]
+        os.replace(tmp, dest)
+        now = time.time()
+        st = dest.stat()
+        meta = {
+            "name": name,
+            "size": st.st_size,
+            "content_type": content_type or mimetypes.guess_type(name)[0] or "application/octet-stream",
+            "etag": etag,
+            "created_at": now,
+            "last_access": now,
+            "mtime": st.st_mtime,
+        }
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO media (name, size, content_type, etag, created_at, last_access, mtime) "
+                "VALUES (:name, :size, :content_type, :etag, :created_at, :last_access, :mtime)",
+                meta,
+            )
+        self.enforce_quota(keep=name)
+        return meta
+
+    def get(self, name: str):
+        """Metadata for name (bumping its last access), or None if unknown/missing."""
+        try:
+            path = self.path(name)
+        except ValueError:
+            return None
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM media WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                if self._reconciled.is_set() or name.endswith(".part") or not path.is_file():
+                    return None
+                # On disk from before this process, not reached by reconcile() yet.
+                self._adopt(name, path.stat())
+                return self.get(name)
+            if not path.exists():
+                conn.execute("DELETE FROM media WHERE name = ?", (name,))
+                return None
+            meta = dict(row)
+            now = time.time()
+            if now - meta["last_access"] > _TOUCH_INTERVAL:
+                conn.execute("UPDATE media SET last_access = ? WHERE name = ?", (now, name))
+                meta["last_access"] = now
+        meta["path"] = path
+        meta["mtime"] = path.stat().st_mtime
+        return meta
+
+    def enforce_quota(self, keep: str = None) -> list:
+        """Evict expired, then least recently used, entries; returns evicted names."""
+        evicted = []
+        with self._lock, self._connect() as conn:
+            cutoff = time.time() - self.max_age
+            rows = conn.execute(
+                "SELECT name, size, last_access FROM media ORDER BY last_access ASC"
+            ).fetchall()
+            total = sum(size for _, size, _ in rows)
+            for name, size, last_access in rows:
+                if name == keep:
+                    continue
+                if last_access >= cutoff and total <= self.max_bytes:
+                    break
+                self.path(name).unlink(missing_ok=True)
+                conn.execute("DELETE FROM media WHERE name = ?", (name,))
+                total -= size
+                evicted.append(name)
+        if evicted:
+            print(f"Media store evicted {len(evicted)} file(s)")
+        return evicted
+
+    def reconcile(self):
+        """
+        Adopt files in root the index lacks or has with another size/mtime,
+        and forget index rows without a file. Only those files are hashed,
+        and not under the lock.
+        """
+        try:
+            with self._connect() as conn:
+                indexed = {name: (size, mtime) for name, size, mtime in conn.execute("SELECT name, size, mtime FROM media")}
+            on_disk = {}
+            for p in self.root.iterdir():
+                if _NAME.match(p.name) and not p.name.endswith(".part"):
+                    try:
+                        if p.is_file():
+                            on_disk[p.name] = p.stat()
+                    except OSError:
+                        continue
+            with self._lock, self._connect() as conn:
+                for name in indexed.keys() - on_disk.keys():
+                    # put() may have stored it since the scan.
+                    if not (self.root / name).exists():
+                        conn.execute("DELETE FROM media WHERE name = ?", (name,))
+                for name, st in on_disk.items():
+                    size, mtime = indexed.get(name, (None, None))
+                    if size == st.st_size and mtime is None:
+                        # Indexed before mtimes were recorded: trust it rather than rehash.
+                        conn.execute("UPDATE media SET mtime = ? WHERE name = ?", (st.st_mtime, name))
+                        indexed[name] = (size, st.st_mtime)
+            for name, st in on_disk.items():
+                if indexed.get(name) != (st.st_size, st.st_mtime):
+                    try:
+                        self._adopt(name, st)
+                    except OSError:
+                        continue
+        finally:
+            self._reconciled.set()
+
+    def _adopt(self, name: str, st: os.stat_result):
+        """(Re)index the file name from its bytes; keeps created_at/last_access of an existing row."""
+        etag = _sha256_file(self.root / name)[:32]
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO media (name, size, content_type, etag, created_at, last_access, mtime) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET size = excluded.size, etag = excluded.etag, mtime = excluded.mtime",
+                (
+                    name,
+                    st.st_size,
+                    mimetypes.guess_type(name)[0] or "application/octet-stream",
+                    etag,
+                    st.st_mtime,
+                    st.st_mtime,
+                    st.st_mtime,
+                ),
+            )
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM media").fetchone()
+        return {"files": count, "bytes": total, "max_bytes": self.max_bytes, "max_age": self.max_age}
+
+
+def cache_headers(meta: dict) -> dict:
+    return {
+        "ETag": f'"{meta["etag"]}"',
+        "Last-Modified": formatdate(meta["mtime"], usegmt=True),
+        "Cache-Control": f"public, max-age={CACHE_MAX_AGE}, immutable",
+        "Accept-Ranges": "bytes",
+    }
+
+
+def not_modified(meta: dict, if_none_match: str = None, if_modified_since: str = None) -> bool:
+    """True when a conditional GET can be answered with 304."""
+    if if_none_match:
+        tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+        return "*" in tags or f'"{meta["etag"]}"' in tags
+    if if_modified_since:
+        try:
+            return int(meta["mtime"]) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
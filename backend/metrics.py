@@ -0,0 +1,267 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms live in one process-wide registry and are
+rendered by `render()` for a `/metrics` endpoint (both apps expose one).
+Values are per process; scrape every worker.
+
+`stage(name)` times a block of work into the `stage_seconds` histogram
+and, when called while a request is being handled, also records it for
+that request's `Server-Timing` header (see `begin_request` /
+`server_timing`). Set METRICS_SERVER_TIMING=0 to leave the header off.
+
+Gauges that mirror state owned elsewhere (poller queue, governor slots,
+breaker state) are registered as callbacks with `gauge_callback` and
+sampled at scrape time.
+"""
+
+import contextvars
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+SERVER_TIMING = os.environ.get("METRICS_SERVER_TIMING", "1") != "0"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = tuple(float(1 << n) for n in range(10, 31, 2))  # 1 KiB .. 1 GiB
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+TOKEN_BUCKETS = tuple(float(1 << n) for n in range(8, 19))  # 256 .. 256k
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def lines(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    lines = Counter.lines
+
+
+class CallbackGauge(_Metric):
+    """Gauge sampled at scrape time: fn() -> number or {label tuple: number}."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def lines(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"Metric callback {self.name} failed: {e}")
+            return []
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        return [
+            f"{self.name}{_labels(self.labelnames, k if isinstance(k, tuple) else (k,))} {_num(v)}"
+            for k, v in sorted(items)
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def lines(self):
+        with self._lock:
+            items = sorted((k, (list(c), s, n)) for k, (c, s, n) in self._values.items())
+        out = []
+        for key, (counts, total, n) in items:
+            running = 0
+            for bound, c in zip(self.buckets, counts):
+                running += c
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _num(bound))])} {running}")
+            out.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {n}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_num(total)}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, key)} {n}")
+        return out
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _register(metric):
+    with _registry_lock:
+        existing = _registry.get(metric.name)
+        if existing is not None:
+            return existing
+        _registry[metric.name] = metric
+        return metric
+
+
+def counter(name, help, labelnames=()) -> Counter:
+    return _register(Counter(name, help, labelnames))
+
+
+def gauge(name, help, labelnames=()) -> Gauge:
+    return _register(Gauge(name, help, labelnames))
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, labelnames, buckets))
+
+
+def gauge_callback(name, help, fn, labelnames=()) -> CallbackGauge:
+    """Register (or replace) a scrape-time gauge."""
+    metric = CallbackGauge(name, help, fn, labelnames)
+    with _registry_lock:
+        _registry[name] = metric
+    return metric
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+    out = []
+    for metric in metrics:
+        out.extend(metric.header())
+        out.extend(metric.lines())
+    return "\n".join(out) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# -- shared metrics ---------------------------------------------------------
+
+STAGE_SECONDS = histogram("stage_seconds", "Time spent in a named processing stage", ["stage"])
+HTTP_SECONDS = histogram(
+    "http_request_seconds", "Request handling time", ["app", "method", "route", "status"]
+)
+UPSTREAM_REQUESTS = counter(
+    "upstream_requests_total", "Upstream HTTP attempts by outcome (status code or error class)",
+    ["provider", "outcome"],
+)
+UPSTREAM_SECONDS = histogram("upstream_request_seconds", "Upstream HTTP attempt latency", ["provider"])
+PAYLOAD_BYTES = histogram("payload_bytes", "Payload sizes", ["kind"], buckets=BYTES_BUCKETS)
+REQUEST_TOKENS = histogram(
+    "gemini_request_tokens", "Planned Gemini input tokens per request", ["part"], buckets=TOKEN_BUCKETS
+)
+IDEMPOTENT_REQUESTS = counter(
+    "idempotent_requests_total", "Requests carrying an Idempotency-Key, by outcome", ["outcome"]
+)
+CT_TRUNCATED_FILES = counter(
+    "ct_truncated_files_total", "CT uploads whose frames stopped decoding part way (earlier slices kept)"
+)
+IMAGE_MIRRORS = counter(
+    "image_mirrors_total", "Finished image mirror downloads by outcome (ok or error class)", ["outcome"]
+)
+POLL_CHECKS = counter("poll_checks_total", "Status checks issued by the shared poller", ["provider"])
+POLL_ITERATIONS = histogram(
+    "poll_iterations", "Status checks a finished job needed", ["provider", "outcome"], buckets=COUNT_BUCKETS
+)
+POLL_JOB_SECONDS = histogram("poll_job_seconds", "Time from registration to completion of polled jobs", ["provider", "outcome"])
+
+
+# -- per-request stage breakdown ----------------------------------------------
+
+_request_stages = contextvars.ContextVar("request_stages", default=None)
+
+_TOKEN = re.compile(r"[^A-Za-z0-9_-]")
+
+
+def begin_request():
+    """Start collecting stage timings for the current request; returns a reset token."""
+    return _request_stages.set([])
+
+
+def end_request(token):
+    _request_stages.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((name, elapsed))
+
+
+def server_timing(total: float = None) -> str:
+    """Server-Timing header value for the current request's stages."""
+    parts = [f"{_TOKEN.sub('_', n)};dur={s * 1000:.1f}" for n, s in (_request_stages.get() or [])]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
@@ -0,0 +1,269 @@
+"""
+One shared poller for long-running upstream jobs (BFL images, Veo videos).
+
+Instead of every request sleeping in its own `while not done` loop, jobs
+are registered here and a single scheduler thread decides when each one is
+checked next; the checks themselves run on a small worker pool. Callers
+get a `concurrent.futures.Future` that resolves with the job's result.
+
+Poll timing adapts per provider: completion times of finished jobs are
+recorded, and the next check for a job is scheduled at the next quantile
+of that distribution it has not yet passed (clamped between the
+provider's min and max interval). Jobs therefore get few checks while
+they are unlikely to be done, and dense checks around the typical
+completion time. Until enough history exists, intervals grow
+geometrically from `first_delay`.
+
+Exceptions listed in `transient` (e.g. an open circuit breaker) do not
+fail the job: the check is retried after the provider's max interval
+until the job's timeout.
+
+asyncio callers use `await poller.poll(provider, check)` instead, with a
+coroutine `check`: same schedule, timeout and completion statistics, but
+the waits are `asyncio.sleep`s on the caller's loop.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+
+import metrics
+
+_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99)
+# Below this many observations the distribution is not trusted.
+_MIN_HISTORY = 5
+
+
+@dataclass
+class PollProfile:
+    min_interval: float
+    max_interval: float
+    first_delay: float
+    growth: float
+    timeout: float
+
+
+def _profile(name: str, **defaults) -> PollProfile:
+    env = {k: os.environ.get(f"{name.upper()}_POLL_{k.upper()}") for k in defaults}
+    return PollProfile(**{k: float(env[k] or v) for k, v in defaults.items()})
+
+
+PROFILES = {
+    "bfl": _profile("bfl", min_interval=0.5, max_interval=3, first_delay=1, growth=1.5, timeout=90),
+    "veo": _profile("veo", min_interval=5, max_interval=20, first_delay=10, growth=1.3, timeout=900),
+}
+
+
+class CompletionStats:
+    """Rolling window of completion times for one provider."""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantiles(self):
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < _MIN_HISTORY:
+            return []
+        return [samples[min(len(samples) - 1, int(q * len(samples)))] for q in _QUANTILES]
+
+
+class _Watch:
+    def __init__(self, provider, check, future, on_progress):
+        self.provider = provider
+        self.check = check
+        self.future = future
+        self.on_progress = on_progress
+        self.started = time.time()
+        self.polls = 0
+        self.delay = None
+        # Elapsed time at the last check that still saw the job pending.
+        self.last_pending = 0.0
+
+
+class Poller:
+    def __init__(self, profiles=None, max_workers: int = 8, transient=()):
+        self.profiles = dict(profiles or PROFILES)
+        self.stats = {name: CompletionStats() for name in self.profiles}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="poller")
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self.transient = tuple(transient)
+        self._in_flight = {name: 0 for name in self.profiles}
+        self._polls = {name: 0 for name in self.profiles}
+
+    def start(self, provider: str, submit, check, on_progress=None) -> Future:
+        """
+        Run `submit()` on the worker pool, then poll `check(handle)` with the
+        handle it returned. `check` must return `(done, value)`; `value` is
+        the job result once done, otherwise a status passed to on_progress.
+        """
+        future = Future()
+
+        def run_submit():
+            try:
+                handle = submit()
+            except BaseException as e:
+                future.set_exception(e)
+                return
+            self._add(_Watch(provider, lambda: check(handle), future, on_progress))
+
+        self._pool.submit(run_submit)
+        return future
+
+    def watch(self, provider: str, check, on_progress=None) -> Future:
+        """Poll an already-submitted job; see `start` for the check contract."""
+        future = Future()
+        self._add(_Watch(provider, check, future, on_progress))
+        return future
+
+    async def poll(self, provider: str, check, on_progress=None):
+        """Coroutine form of `watch`: returns the job's result once `await check()` reports it done."""
+        profile = self.profiles[provider]
+        watch = _Watch(provider, check, None, on_progress)
+        with self._cond:
+            self._in_flight[provider] += 1
+        outcome = "cancelled"
+        delay = self._next_delay(watch, 0.0)
+        try:
+            while True:
+                watch.delay = delay
+                await asyncio.sleep(delay)
+                self._count_check(watch)
+                try:
+                    done, value = await check()
+                except self.transient:
+                    if time.time() - watch.started > profile.timeout:
+                        outcome = "timeout"
+                        raise
+                    delay = profile.max_interval
+                    continue
+                except Exception:
+                    outcome = "error"
+                    raise
+                elapsed = time.time() - watch.started
+                if done:
+                    self.stats[provider].add((watch.last_pending + elapsed) / 2)
+                    outcome = "ok"
+                    return value
+                if elapsed > profile.timeout:
+                    outcome = "timeout"
+                    raise TimeoutError(f"Timed out waiting for {provider} job")
+                watch.last_pending = elapsed
+                self._progress(watch, elapsed, value)
+                delay = self._next_delay(watch, elapsed)
+        finally:
+            self._finish(watch, outcome)
+
+    def snapshot(self) -> dict:
+        """Per-provider in-flight jobs, checks issued and completion quantiles."""
+        with self._cond:
+            return {
+                name: {
+                    "in_flight": self._in_flight[name],
+                    "polls": self._polls[name],
+                    "completion_quantiles": self.stats[name].quantiles(),
+                }
+                for name in self.profiles
+            }
+
+    def _add(self, watch: _Watch):
+        with self._cond:
+            self._in_flight[watch.provider] += 1
+        self._schedule(watch, self._next_delay(watch, 0.0))
+
+    def _schedule(self, watch: _Watch, delay: float):
+        watch.delay = delay
+        with self._cond:
+            heapq.heappush(self._heap, (time.time() + delay, next(self._seq), watch))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="poller-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.time():
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._cond.wait(timeout)
+                _, _, watch = heapq.heappop(self._heap)
+            self._pool.submit(self._check, watch)
+
+    def _finish(self, watch: _Watch, outcome: str):
+        with self._cond:
+            self._in_flight[watch.provider] -= 1
+        metrics.POLL_ITERATIONS.observe(watch.polls, provider=watch.provider, outcome=outcome)
+        metrics.POLL_JOB_SECONDS.observe(time.time() - watch.started, provider=watch.provider, outcome=outcome)
+
+    def _count_check(self, watch: _Watch):
+        watch.polls += 1
+        with self._cond:
+            self._polls[watch.provider] += 1
+        metrics.POLL_CHECKS.inc(provider=watch.provider)
+
+    def _progress(self, watch: _Watch, elapsed: float, status):
+        if watch.on_progress is not None:
+            try:
+                watch.on_progress(watch.polls, elapsed, status)
+            except Exception as e:
+                print(f"Poll progress callback failed: {e}")
+
+    def _check(self, watch: _Watch):
+        profile = self.profiles[watch.provider]
+        self._count_check(watch)
+        try:
+            done, value = watch.check()
+        except self.transient as e:
+            if time.time() - watch.started > profile.timeout:
+                self._finish(watch, "timeout")
+                watch.future.set_exception(e)
+            else:
+                self._schedule(watch, profile.max_interval)
+            return
+        except BaseException as e:
+            self._finish(watch, "error")
+            watch.future.set_exception(e)
+            return
+
+        elapsed = time.time() - watch.started
+        if done:
+            # The job finished somewhere between the previous check and this
+            # one; recording the midpoint (rather than `elapsed`) keeps the
+            # distribution from ratcheting up to our own poll times.
+            self.stats[watch.provider].add((watch.last_pending + elapsed) / 2)
+            self._finish(watch, "ok")
+            watch.future.set_result(value)
+            return
+        if elapsed > profile.timeout:
+            self._finish(watch, "timeout")
+            watch.future.set_exception(TimeoutError(f"Timed out waiting for {watch.provider} job"))
+            return
+        watch.last_pending = elapsed
+        self._progress(watch, elapsed, value)
+        self._schedule(watch, self._next_delay(watch, elapsed))
+
+    def _next_delay(self, watch: _Watch, elapsed: float) -> float:
+        profile = self.profiles[watch.provider]
+        upcoming = [q for q in self.stats[watch.provider].quantiles() if q > elapsed]
+        if upcoming:
+            delay = upcoming[0] - elapsed
+        elif watch.delay is None:
+            delay = profile.first_delay
+        else:
+            # No history, or already past the slowest observed completion.
+            delay = watch.delay * profile.growth
+        return max(profile.min_interval, min(profile.max_interval, delay))
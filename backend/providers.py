@@ -0,0 +1,355 @@
+"""
+Shared, long-lived clients for upstream providers (Gemini, BFL, Veo and
+plain image fetches).
+
+Each `ProviderClient` owns a `requests.Session` whose adapter keeps a pool
+of keep-alive connections per host, so repeated calls skip the TCP/TLS
+handshake. Calls retry on 429/5xx and connection errors with jittered
+exponential backoff (honoring Retry-After when the server sends one);
+non-idempotent calls (POST submits) only on 429/503 and connect errors.
+Every attempt first passes the provider's `resilience` limiter (rate,
+concurrency, circuit breaker); once the breaker opens, calls and pending
+retries fail fast with `resilience.CircuitOpen`.
+
+`AsyncProviderClient` is the same for asyncio code (the FastAPI app): an
+`httpx.AsyncClient` per provider with the same retry rules, limiter and
+metrics, so a request waiting on an upstream holds no thread.
+
+Per-provider knobs come from the environment, e.g. for BFL:
+  BFL_HTTP_TIMEOUT      read timeout in seconds
+  BFL_HTTP_RETRIES      retries after the first attempt
+  BFL_HTTP_POOL_SIZE    connections kept per host
+
+Clients, SDKs and API keys are looked up lazily through the registry at
+the end of this module; see `api_key()` and `MissingCredentials`.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import TYPE_CHECKING
+
+import metrics
+import resilience
+
+if TYPE_CHECKING:
+    import requests
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Methods that are safe to resend after a read timeout (the server may
+# already have acted on a POST, so only connect errors are retried there).
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+# Replies that mean the request was turned away, not acted on: the only
+# statuses a POST is resent for (a 500/502/504 may come after the upstream
+# already accepted the job).
+REJECTED_STATUSES = frozenset({429, 503})
+
+
+def _retry_status(method: str, status: int) -> bool:
+    if method in IDEMPOTENT_METHODS:
+        return status in RETRY_STATUSES
+    return status in REJECTED_STATUSES
+
+
+def _env(name: str, key: str, default, cast=float):
+    return cast(os.environ.get(f"{name.upper()}_HTTP_{key}", default))
+
+
+def _retry_delay(attempt: int, backoff: float, cap: float, resp=None) -> float:
+    if resp is not None:
+        retry_after = resp.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), cap)
+    # "Full jitter": uniform over [0, capped exponential step].
+    return random.uniform(0, min(cap, backoff * (2 ** attempt)))
+
+
+class ProviderClient:
+    def __init__(
+        self,
+        name: str,
+        timeout: float = 30,
+        connect_timeout: float = 5,
+        retries: int = 3,
+        backoff: float = 0.5,
+        backoff_cap: float = 8,
+        pool_size: int = 16,
+        pool_hosts: int = 4,
+        limiter: "resilience.ProviderLimiter" = None,
+    ):
+        self.name = name
+        self.limiter = limiter
+        self.timeout = (connect_timeout, _env(name, "TIMEOUT", timeout))
+        self.retries = _env(name, "RETRIES", retries, int)
+        self.backoff = backoff
+        self.backoff_cap = backoff_cap
+        pool_size = _env(name, "POOL_SIZE", pool_size, int)
+        # Imported here so that processes that only use the async clients
+        # (or none) don't load requests.
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _sleep_before_retry(self, attempt: int, resp=None):
+        time.sleep(_retry_delay(attempt, self.backoff, self.backoff_cap, resp))
+
+    def request(self, method: str, url: str, **kwargs) -> "requests.Response":
+        import requests
+
+        method = method.upper()
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            try:
+                resp = self._send(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                retryable = method in IDEMPOTENT_METHODS or not isinstance(e, requests.ReadTimeout)
+                if attempt >= self.retries or not retryable:
+                    raise
+                self._sleep_before_retry(attempt)
+                attempt += 1
+                continue
+            if _retry_status(method, resp.status_code) and attempt < self.retries:
+                resp.close()
+                self._sleep_before_retry(attempt, resp)
+                attempt += 1
+                continue
+            return resp
+
+    def _send(self, method: str, url: str, **kwargs) -> "requests.Response":
+        if self.limiter is None:
+            return self._attempt(method, url, **kwargs)
+        return self.limiter.call(
+            lambda: self._attempt(method, url, **kwargs),
+            is_failure=lambda r: f"HTTP {r.status_code}" if r.status_code in RETRY_STATUSES else None,
+        )
+
+    def _attempt(self, method: str, url: str, **kwargs) -> "requests.Response":
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            resp = self.session.request(method, url, **kwargs)
+            outcome = str(resp.status_code)
+            return resp
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            metrics.UPSTREAM_SECONDS.observe(time.perf_counter() - started, provider=self.name)
+            metrics.UPSTREAM_REQUESTS.inc(provider=self.name, outcome=outcome)
+
+    def get(self, url: str, **kwargs) -> "requests.Response":
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> "requests.Response":
+        return self.request("POST", url, **kwargs)
+
+
+class AsyncProviderClient:
+    """
+    asyncio counterpart of `ProviderClient`. The `httpx.AsyncClient` is
+    created on first use (httpx is only needed by the async app) and is
+    bound to the event loop it was created on.
+
+    `content` may be a sized, re-iterable body such as
+    `ingest.JsonStreamBody`; its chunks are produced on a worker thread
+    (they may read and base64-encode files) and it is re-sent on retry.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float = 30,
+        connect_timeout: float = 5,
+        retries: int = 3,
+        backoff: float = 0.5,
+        backoff_cap: float = 8,
+        pool_size: int = 64,
+        limiter: "resilience.ProviderLimiter" = None,
+    ):
+        self.name = name
+        self.limiter = limiter
+        self.timeout = _env(name, "TIMEOUT", timeout)
+        self.connect_timeout = connect_timeout
+        self.retries = _env(name, "RETRIES", retries, int)
+        self.backoff = backoff
+        self.backoff_cap = backoff_cap
+        self.pool_size = _env(name, "POOL_SIZE", pool_size, int)
+        self._client = None
+
+    def client(self):
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=None, max_keepalive_connections=self.pool_size),
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(self, method: str, url: str, **kwargs):
+        import httpx
+
+        method = method.upper()
+        attempt = 0
+        while True:
+            try:
+                resp = await self._send(method, url, **kwargs)
+            except httpx.TransportError as e:
+                # Like the sync client: only failures to connect are safe to resend for a POST.
+                retryable = method in IDEMPOTENT_METHODS or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if attempt >= self.retries or not retryable:
+                    raise
+                await asyncio.sleep(_retry_delay(attempt, self.backoff, self.backoff_cap))
+                attempt += 1
+                continue
+            if _retry_status(method, resp.status_code) and attempt < self.retries:
+                await asyncio.sleep(_retry_delay(attempt, self.backoff, self.backoff_cap, resp))
+                attempt += 1
+                continue
+            return resp
+
+    async def _send(self, method: str, url: str, **kwargs):
+        if self.limiter is None:
+            return await self._attempt(method, url, **kwargs)
+        return await self.limiter.acall(
+            lambda: self._attempt(method, url, **kwargs),
+            is_failure=lambda r: f"HTTP {r.status_code}" if r.status_code in RETRY_STATUSES else None,
+        )
+
+    async def _attempt(self, method: str, url: str, content=None, headers=None, **kwargs):
+        if content is not None and not isinstance(content, (bytes, str)):
+            headers = {**(headers or {}), "Content-Length": str(len(content))}
+            content = _aiter_in_thread(content)
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            resp = await self.client().request(method, url, content=content, headers=headers, **kwargs)
+            outcome = str(resp.status_code)
+            return resp
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            metrics.UPSTREAM_SECONDS.observe(time.perf_counter() - started, provider=self.name)
+            metrics.UPSTREAM_REQUESTS.inc(provider=self.name, outcome=outcome)
+
+    async def get(self, url: str, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+
+async def _aiter_in_thread(iterable):
+    it = iter(iterable)
+    done = object()
+    while True:
+        chunk = await asyncio.to_thread(next, it, done)
+        if chunk is done:
+            return
+        yield chunk
+
+
+# -- Registry -------------------------------------------------------------------
+#
+# Clients are built on first use and then cached: `providers.bfl`,
+# `providers.gemini_async` etc. resolve through the module `__getattr__`
+# below, `genai_client()` imports the SDK only when a Veo job runs. A
+# process that never calls a provider never pays for its client or SDK
+# import, and a missing API key is reported by the endpoint that needs it
+# (`api_key()` raises MissingCredentials) instead of failing at startup.
+
+# provider -> environment variable holding its API key
+CREDENTIALS = {
+    "gemini": "GEMINI_API_KEY",
+    "veo": "GOOGLE_API_KEY",
+    "bfl": "BFL_API_KEY",
+}
+
+
+class MissingCredentials(RuntimeError):
+    """A provider's API key is not configured; endpoints answer 503."""
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.env = CREDENTIALS[provider]
+        super().__init__(f"Missing {self.env}")
+
+
+def api_key(provider: str) -> str:
+    """The provider's API key from the environment; raises MissingCredentials."""
+    key = os.environ.get(CREDENTIALS[provider])
+    if not key:
+        raise MissingCredentials(provider)
+    return key
+
+
+_FACTORIES = {
+    "gemini": lambda: ProviderClient("gemini", timeout=60, limiter=resilience.limiter("gemini")),
+    "bfl": lambda: ProviderClient("bfl", timeout=30, limiter=resilience.limiter("bfl")),
+    # Reference-image downloads hit arbitrary CDN hosts, so pool more of them
+    # (and a breaker shared across unrelated hosts would be meaningless).
+    "fetch": lambda: ProviderClient("fetch", timeout=30, pool_hosts=16),
+    "gemini_async": lambda: AsyncProviderClient("gemini", timeout=60, limiter=resilience.limiter("gemini")),
+    "bfl_async": lambda: AsyncProviderClient("bfl", timeout=30, limiter=resilience.limiter("bfl")),
+    "fetch_async": lambda: AsyncProviderClient("fetch", timeout=30),
+}
+_built = {}
+_registry_lock = threading.Lock()
+
+
+def __getattr__(name: str):
+    factory = _FACTORIES.get(name)
+    if factory is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _registry_lock:
+        client = _built.get(name)
+        if client is None:
+            client = _built[name] = factory()
+            # Later lookups find the module global and skip this function.
+            globals()[name] = client
+        return client
+
+
+def built_clients() -> list:
+    """The HTTP clients created so far (e.g. to close them on shutdown)."""
+    with _registry_lock:
+        return list(_built.values())
+
+
+_genai_clients = {}
+_genai_lock = threading.Lock()
+
+
+def genai_client(api_key: str):
+    """
+    One `google.genai.Client` per API key, built on first use and reused.
+    GOOGLE_API_BASE overrides the SDK's endpoint (e.g. a local stand-in).
+    """
+    with _genai_lock:
+        client = _genai_clients.get(api_key)
+        if client is None:
+            from google import genai
+
+            base_url = os.environ.get("GOOGLE_API_BASE")
+            http_options = {"base_url": base_url} if base_url else None
+            client = genai.Client(api_key=api_key, http_options=http_options)
+            _genai_clients[api_key] = client
+        return client
+
+
+def veo_client():
+    """The genai client for Veo calls; raises MissingCredentials."""
+    return genai_client(api_key("veo"))
@@ -0,0 +1,237 @@
+"""
+Cache of reference images used to condition video generation.
+
+A reference is looked up by URL; its bytes are stored once per content
+hash, already base64-encoded, so repeated video attempts on the same
+timepoint image neither download nor re-encode it:
+
+  <REF_CACHE_DIR>/index.sqlite3   url -> sha256, mime, ETag, Last-Modified,
+                                  fetched_at, last_access
+  <REF_CACHE_DIR>/<sha256>.b64    base64 payload (shared by every URL
+                                  that served the same bytes)
+
+An entry younger than REF_CACHE_FRESH seconds is used as is. Older ones
+are revalidated with If-None-Match / If-Modified-Since; a 304 only
+refreshes `fetched_at`. If revalidation fails outright, the stale copy is
+served rather than failing the video job. Downloads are streamed and
+refused once they pass REF_CACHE_MAX_DOWNLOAD bytes, or if they are not
+served as an image, before anything is stored.
+
+After each insert, URLs not accessed within REF_CACHE_MAX_AGE are
+dropped, then least recently used ones until the payloads fit in
+REF_CACHE_MAX_BYTES; payload files no URL points at are deleted.
+Concurrent lookups of one URL share a single download.
+"""
+
+import base64
+import hashlib
+import mimetypes
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import caching
+import providers
+
+REF_CACHE_DIR = os.environ.get(
+    "REF_CACHE_DIR", str(Path(__file__).parent / "var" / "cache" / "refs")
+)
+REF_CACHE_FRESH = float(os.environ.get("REF_CACHE_FRESH", "300"))
+REF_CACHE_MAX_AGE = float(os.environ.get("REF_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+REF_CACHE_MAX_BYTES = int(os.environ.get("REF_CACHE_MAX_BYTES", str(256 << 20)))
+# Largest single reference image accepted (the URL comes from the client)
+REF_CACHE_MAX_DOWNLOAD = int(os.environ.get("REF_CACHE_MAX_DOWNLOAD", str(32 << 20)))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS refs (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    mime TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS refs_sha ON refs (sha256);
+CREATE INDEX IF NOT EXISTS refs_last_access ON refs (last_access);
+"""
+
+
+@dataclass
+class RefImage:
+    sha256: str
+    mime: str
+    b64: str
+
+
+class RefCache:
+    def __init__(
+        self,
+        root=REF_CACHE_DIR,
+        fresh: float = REF_CACHE_FRESH,
+        max_age: float = REF_CACHE_MAX_AGE,
+        max_bytes: int = REF_CACHE_MAX_BYTES,
+        max_download: int = REF_CACHE_MAX_DOWNLOAD,
+        client: providers.ProviderClient = None,
+    ):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.fresh = fresh
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.max_download = max_download
+        # None: the shared fetch client, resolved on first download
+        self.client = client
+        self._flight = caching.SingleFlight()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.downloads = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(str(self.root / "index.sqlite3"), timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _blob(self, sha256: str) -> Path:
+        return self.root / f"{sha256}.b64"
+
+    def get(self, url: str) -> RefImage:
+        return self._flight.do(url, lambda: self._get(url))
+
+    def _get(self, url: str) -> RefImage:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM refs WHERE url = ?", (url,)).fetchone()
+        if row is not None and not self._blob(row["sha256"]).exists():
+            row = None
+        now = time.time()
+
+        if row is not None and now - row["fetched_at"] < self.fresh:
+            self._count("hits")
+            self._touch(url, now)
+            return self._load(row)
+
+        headers = {}
+        if row is not None:
+            if row["etag"]:
+                headers["If-None-Match"] = row["etag"]
+            if row["last_modified"]:
+                headers["If-Modified-Since"] = row["last_modified"]
+        try:
+            resp = (self.client or providers.fetch).get(url, headers=headers, stream=True)
+            if resp.status_code == 304 and row is not None:
+                resp.close()
+                self._count("revalidated")
+                with self._connect() as conn:
+                    conn.execute(
+                        "UPDATE refs SET fetched_at = ?, last_access = ? WHERE url = ?", (now, now, url)
+                    )
+                return self._load(row)
+            resp.raise_for_status()
+            mime, data = self._read(url, resp)
+        except Exception as e:
+            if row is None:
+                raise
+            print(f"Revalidating reference {url} failed ({e}); using cached copy")
+            self._touch(url, now)
+            return self._load(row)
+
+        self._count("downloads")
+        sha256 = hashlib.sha256(data).hexdigest()
+        encoded = base64.b64encode(data).decode("ascii")
+        blob = self._blob(sha256)
+        # Under the lock so a concurrent evict() can't collect the payload
+        # between writing it and indexing it.
+        with self._lock:
+            if not blob.exists():
+                tmp = blob.with_suffix(".part")
+                tmp.write_text(encoded, "ascii")
+                os.replace(tmp, blob)
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO refs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (url, sha256, mime, resp.headers.get("ETag"), resp.headers.get("Last-Modified"), now, now),
+                )
+        self.evict(keep=sha256)
+        return RefImage(sha256, mime, encoded)
+
+    def _read(self, url: str, resp):
+        """(mime, body) of an image response, refusing non-images and bodies over max_download."""
+        try:
+            mime = (resp.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+            if not mime or mime == "application/octet-stream":
+                mime = mimetypes.guess_type(url)[0] or "image/jpeg"
+            if not mime.startswith("image/"):
+                raise ValueError(f"reference is {mime}, not an image")
+            if int(resp.headers.get("Content-Length") or 0) > self.max_download:
+                raise ValueError(f"reference larger than {self.max_download} bytes")
+            data = bytearray()
+            for chunk in resp.iter_content(1 << 16):
+                data += chunk
+                if len(data) > self.max_download:
+                    raise ValueError(f"reference larger than {self.max_download} bytes")
+            return mime, bytes(data)
+        finally:
+            resp.close()
+
+    def _load(self, row) -> RefImage:
+        return RefImage(row["sha256"], row["mime"], self._blob(row["sha256"]).read_text("ascii"))
+
+    def _touch(self, url: str, now: float):
+        with self._connect() as conn:
+            conn.execute("UPDATE refs SET last_access = ? WHERE url = ?", (now, url))
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def evict(self, keep: str = None) -> int:
+        """Apply the age and size limits; returns the number of payloads removed."""
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "DELETE FROM refs WHERE last_access < ? AND sha256 != ?",
+                (time.time() - self.max_age, keep or ""),
+            )
+            # One row per payload, ordered by its most recent use via any URL.
+            blobs = conn.execute(
+                "SELECT sha256, MAX(last_access) AS used FROM refs GROUP BY sha256 ORDER BY used ASC"
+            ).fetchall()
+            sizes = {}
+            for b in blobs:
+                path = self._blob(b["sha256"])
+                sizes[b["sha256"]] = path.stat().st_size if path.exists() else 0
+            total = sum(sizes.values())
+            for b in blobs:
+                if total <= self.max_bytes:
+                    break
+                if b["sha256"] == keep:
+                    continue
+                conn.execute("DELETE FROM refs WHERE sha256 = ?", (b["sha256"],))
+                total -= sizes[b["sha256"]]
+            referenced = {r["sha256"] for r in conn.execute("SELECT DISTINCT sha256 FROM refs")}
+            removed = 0
+            for path in self.root.glob("*.b64"):
+                if path.stem not in referenced:
+                    path.unlink(missing_ok=True)
+                    removed += 1
+        return removed
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            urls = conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        payloads = list(self.root.glob("*.b64"))
+        return {
+            "urls": urls,
+            "payloads": len(payloads),
+            "bytes": sum(p.stat().st_size for p in payloads),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "downloads": self.downloads,
+        }
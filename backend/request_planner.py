@@ -0,0 +1,182 @@
+"""
+Token-budget planning for Gemini multimodal requests.
+
+Before a /model/prompt request is built, `plan()` estimates its input
+tokens and fits them to REQUEST_TOKEN_BUDGET:
+
+  text    ~4 characters per token (ehr_extract.estimate_tokens);
+  images  258 tokens for an image with both sides <= 384 px, otherwise
+          258 per 768x768 tile (Gemini's image tokenization).
+
+When the estimate is over budget it degrades, in this order, until it
+fits: compact patient JSON, CT long edge down one tile row at a time
+(e.g. 2000 -> 1536 -> 768 px), EHR excerpt down to PLAN_MIN_EHR_TOKENS,
+CT image count down to PLAN_MIN_CT_IMAGES, then EHR and images down to
+nothing/one. CT images are the primary signal, so they are cut last.
+
+An image that fits one 768 px tile already costs the minimum 258 tokens
+(smaller ones cost the same), so with the default CT_MAX_EDGE of 768 the
+resolution step has nothing to save and only the slice count is reduced.
+
+The plan's `ct_config()` is passed to ct_preprocess.prepare_series, so
+the number of images sent is capped by the plan even for multi-frame
+uploads. `describe()` is the one-line summary logged per request.
+"""
+
+import math
+import os
+from dataclasses import dataclass, field
+
+from PIL import Image
+
+import ct_preprocess
+
+CONFIG = {
+    "token_budget": int(os.environ.get("REQUEST_TOKEN_BUDGET", "12000")),
+    "min_ct_images": int(os.environ.get("PLAN_MIN_CT_IMAGES", "4")),
+    "min_ehr_tokens": int(os.environ.get("PLAN_MIN_EHR_TOKENS", "500")),
+}
+
+TOKENS_PER_TILE = 258
+TILE_EDGE = 768
+SMALL_IMAGE_EDGE = 384
+
+
+def image_tokens(width: int, height: int) -> int:
+    """Estimated tokens for one image of the given size."""
+    if width <= SMALL_IMAGE_EDGE and height <= SMALL_IMAGE_EDGE:
+        return TOKENS_PER_TILE
+    return math.ceil(width / TILE_EDGE) * math.ceil(height / TILE_EDGE) * TOKENS_PER_TILE
+
+
+def estimate_image_tokens(files, max_edge: int) -> int:
+    """
+    Tokens for prepared CT images, from their actual size where Pillow can
+    read it (a header read) and as a max_edge square otherwise.
+    """
+    total = 0
+    for f in files:
+        stream = getattr(f, "stream", f)
+        try:
+            stream.seek(0)
+            with Image.open(stream) as im:
+                width, height = im.size
+        except Exception:
+            width = height = max_edge
+        finally:
+            stream.seek(0)
+        total += image_tokens(width, height)
+    return total
+
+
+@dataclass
+class Plan:
+    budget: int
+    compact_json: bool
+    ehr_token_budget: int
+    max_slices: int
+    max_edge: int
+    # Estimates; text_tokens covers everything but the patient JSON and EHR.
+    text_tokens: int
+    json_tokens: int
+    ehr_tokens: int
+    images: int
+    image_tokens: int
+    reductions: list = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return self.text_tokens + self.json_tokens + self.ehr_tokens + self.image_tokens
+
+    @property
+    def fits(self) -> bool:
+        return self.total <= self.budget
+
+    def ct_config(self) -> dict:
+        return {"max_slices": self.max_slices, "max_edge": self.max_edge}
+
+    def describe(self) -> str:
+        return (
+            f"~{self.total}/{self.budget} tokens (text {self.text_tokens}, "
+            f"patient JSON {self.json_tokens}{' compact' if self.compact_json else ''}, "
+            f"EHR {self.ehr_tokens}/{self.ehr_token_budget}, "
+            f"{self.images} image(s) {self.image_tokens} at <= {self.max_edge}px, cap {self.max_slices}); "
+            f"reduced: {', '.join(self.reductions) or 'nothing'}"
+            f"{'' if self.fits else '; STILL OVER BUDGET'}"
+        )
+
+
+def plan(
+    text_tokens: int,
+    json_tokens: int,
+    compact_json_tokens: int,
+    ehr_tokens: int,
+    n_ct: int,
+    config: dict = None,
+) -> Plan:
+    """
+    Fit a request to the token budget.
+
+    `ehr_tokens` is the size of the EHR excerpt at its configured budget,
+    `n_ct` the number of CT uploads (a multi-frame upload is estimated as
+    one image, but the plan's slice cap still bounds what is sent).
+    """
+    cfg = dict(CONFIG, **(config or {}))
+    ct_cfg = ct_preprocess.CONFIG
+    max_slices = ct_cfg["max_slices"] if ct_cfg["max_slices"] > 0 else max(n_ct, 1)
+    max_edge = ct_cfg["max_edge"]
+    p = Plan(
+        budget=cfg["token_budget"],
+        compact_json=False,
+        ehr_token_budget=ehr_tokens,
+        max_slices=max_slices,
+        max_edge=max_edge,
+        text_tokens=text_tokens,
+        json_tokens=json_tokens,
+        ehr_tokens=ehr_tokens,
+        images=0,
+        image_tokens=0,
+    )
+
+    def per_image():
+        return image_tokens(p.max_edge, p.max_edge)
+
+    def set_images(cap):
+        p.max_slices = max(1, cap)
+        p.images = min(n_ct, p.max_slices)
+        p.image_tokens = p.images * per_image()
+
+    def over():
+        return p.total - p.budget
+
+    set_images(p.max_slices)
+
+    if over() > 0 and compact_json_tokens < json_tokens:
+        p.compact_json, p.json_tokens = True, compact_json_tokens
+        p.reductions.append("compact JSON")
+
+    if over() > 0 and p.images and p.max_edge > TILE_EDGE:
+        edge = p.max_edge
+        # Drop a row/column of tiles per step; below one tile nothing is saved.
+        while over() > 0 and p.max_edge > TILE_EDGE:
+            p.max_edge = TILE_EDGE * (math.ceil(p.max_edge / TILE_EDGE) - 1)
+            set_images(p.max_slices)
+        p.reductions.append(f"CT edge {edge}->{p.max_edge}px")
+
+    def shrink_ehr(floor):
+        target = max(floor, p.ehr_tokens - over())
+        if over() > 0 and target < p.ehr_tokens:
+            p.reductions.append(f"EHR {p.ehr_tokens}->{target} tokens")
+            p.ehr_token_budget = p.ehr_tokens = target
+
+    def shrink_images(floor):
+        if over() > 0 and p.images > floor:
+            keep = max(floor, p.images - math.ceil(over() / per_image()))
+            p.reductions.append(f"CT images {p.images}->{keep}")
+            set_images(keep)
+
+    shrink_ehr(min(cfg["min_ehr_tokens"], p.ehr_tokens))
+    shrink_images(min(cfg["min_ct_images"], p.images))
+    shrink_ehr(0)
+    shrink_images(1)
+    return p
@@ -0,0 +1,315 @@
+"""
+Per-provider admission control: a token-bucket rate limit, a concurrency
+limit and a circuit breaker in front of every upstream call.
+
+`ProviderLimiter.call(fn, is_failure=None)` runs one upstream call:
+
+  1. the breaker is consulted; while it is open the call fails at once
+     with `CircuitOpen` instead of adding load to a degraded upstream;
+  2. a token is taken from the bucket (waiting at most `max_wait`
+     seconds, else `RateLimited`);
+  3. a concurrency slot is taken (same bound);
+  4. the outcome is recorded: exceptions, and results for which
+     `is_failure(result)` returns a reason (e.g. "HTTP 503"), count as
+     failures.
+
+Breaker states: closed -> open after `failures` consecutive failures;
+open -> half-open once `reset_seconds` have passed, letting
+`half_open_probes` calls through; a successful probe closes it, a failed
+one re-opens it for another `reset_seconds`.
+
+Knobs per provider, e.g. for BFL:
+  BFL_RATE_PER_SEC        sustained calls per second (0 = unlimited)
+  BFL_RATE_BURST          bucket size
+  BFL_MAX_CONCURRENT      calls in flight at once
+  BFL_BREAKER_FAILURES    consecutive failures that open the breaker
+  BFL_BREAKER_RESET       seconds the breaker stays open before probing
+
+`acall(fn, is_failure=None)` is the same for coroutines: waits happen with
+`asyncio.sleep`, so the event loop is never blocked.
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ProviderUnavailable(RuntimeError):
+    """Raised instead of calling the provider; nothing was sent upstream."""
+
+
+class CircuitOpen(ProviderUnavailable):
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} circuit open; retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+class RateLimited(ProviderUnavailable):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = max(1.0, burst)
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """Take a token if one is available (0.0), else the seconds until one is."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, max_wait: float) -> bool:
+        """Take one token, sleeping up to max_wait for it; False on timeout."""
+        if self.rate <= 0:
+            return True
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self._take()
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    async def acquire_async(self, max_wait: float) -> bool:
+        if self.rate <= 0:
+            return True
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self._take()
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failures: int = 5, reset_seconds: float = 30, half_open_probes: int = 1):
+        self.name = name
+        self.failure_threshold = max(1, failures)
+        self.reset_seconds = reset_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._opened_count = 0
+        self._rejected = 0
+        self._last_error = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == OPEN:
+                waited = time.monotonic() - self._opened_at
+                if waited < self.reset_seconds:
+                    self._rejected += 1
+                    raise CircuitOpen(self.name, self.reset_seconds - waited)
+                self.state = HALF_OPEN
+                self._probes = 0
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    self._rejected += 1
+                    raise CircuitOpen(self.name, 0)
+                self._probes += 1
+
+    def cancel_probe(self):
+        """The admitted call was never sent; give its half-open probe back."""
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = CLOSED
+
+    def record_failure(self, error: str = None):
+        with self._lock:
+            self._failures += 1
+            self._last_error = error
+            if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self._opened_count += 1
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            retry_in = 0.0
+            if self.state == OPEN:
+                retry_in = max(0.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+            return {
+                "state": self.state,
+                "consecutive_failures": self._failures,
+                "times_opened": self._opened_count,
+                "rejected": self._rejected,
+                "retry_in": round(retry_in, 1),
+                "last_error": self._last_error,
+            }
+
+
+class ProviderLimiter:
+    def __init__(
+        self,
+        name: str,
+        rate: float = 0,
+        burst: float = 1,
+        max_concurrent: int = 16,
+        failures: int = 5,
+        reset_seconds: float = 30,
+        max_wait: float = 30,
+    ):
+        env = lambda key, default: float(os.environ.get(f"{name.upper()}_{key}", default))
+        self.name = name
+        self.max_wait = max_wait
+        self.bucket = TokenBucket(env("RATE_PER_SEC", rate), env("RATE_BURST", burst))
+        self.max_concurrent = int(env("MAX_CONCURRENT", max_concurrent))
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+        self._in_flight = 0
+        self._calls = 0
+        self._lock = threading.Lock()
+        self.breaker = CircuitBreaker(
+            name, int(env("BREAKER_FAILURES", failures)), env("BREAKER_RESET", reset_seconds)
+        )
+
+    def call(self, fn, is_failure=None):
+        self.breaker.before_call()
+        try:
+            if not self.bucket.acquire(self.max_wait):
+                raise RateLimited(f"{self.name} rate limit: no token within {self.max_wait:.0f}s")
+            if not self._slots.acquire(timeout=self.max_wait):
+                raise RateLimited(f"{self.name} concurrency limit: no slot within {self.max_wait:.0f}s")
+        except RateLimited:
+            self.breaker.cancel_probe()
+            raise
+        self._started()
+        try:
+            result = fn()
+        except Exception as e:
+            self.breaker.record_failure(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            self._finished()
+        return self._record(result, is_failure)
+
+    async def acall(self, fn, is_failure=None):
+        """`call` for a coroutine function `fn`."""
+        self.breaker.before_call()
+        try:
+            if not await self.bucket.acquire_async(self.max_wait):
+                raise RateLimited(f"{self.name} rate limit: no token within {self.max_wait:.0f}s")
+            if not await self._acquire_slot_async():
+                raise RateLimited(f"{self.name} concurrency limit: no slot within {self.max_wait:.0f}s")
+        except BaseException:
+            # RateLimited, or the waiting task was cancelled.
+            self.breaker.cancel_probe()
+            raise
+        self._started()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            self.breaker.cancel_probe()
+            raise
+        except Exception as e:
+            self.breaker.record_failure(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            self._finished()
+        return self._record(result, is_failure)
+
+    async def _acquire_slot_async(self) -> bool:
+        # The slots are shared with threaded callers, so poll the semaphore
+        # instead of blocking the loop on it.
+        deadline = time.monotonic() + self.max_wait
+        delay = 0.005
+        while not self._slots.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.25)
+        return True
+
+    def _started(self):
+        with self._lock:
+            self._in_flight += 1
+            self._calls += 1
+
+    def _finished(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _record(self, result, is_failure):
+        reason = is_failure(result) if is_failure is not None else None
+        if reason:
+            self.breaker.record_failure(reason)
+        else:
+            self.breaker.record_success()
+        return result
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            usage = {"in_flight": self._in_flight, "calls": self._calls}
+        return {
+            "rate_per_sec": self.bucket.rate,
+            "burst": self.bucket.capacity,
+            "max_concurrent": self.max_concurrent,
+            **usage,
+            "breaker": self.breaker.snapshot(),
+        }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+# Defaults per provider; BFL counts status polls too, hence the higher rate.
+DEFAULTS = {
+    "gemini": dict(rate=5, burst=10, max_concurrent=8),
+    "bfl": dict(rate=10, burst=20, max_concurrent=16),
+    "veo": dict(rate=1, burst=5, max_concurrent=4),
+}
+
+
+def limiter(name: str) -> ProviderLimiter:
+    """The process-wide limiter for provider `name`, created on first use."""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = ProviderLimiter(name, **DEFAULTS.get(name, {}))
+        return _limiters[name]
+
+
+def snapshot() -> dict:
+    for name in DEFAULTS:
+        limiter(name)
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: lim.snapshot() for name, lim in limiters.items()}
+
+
+# Registered here rather than in an app so both apps' /metrics export it.
+metrics.gauge_callback(
+    "circuit_breaker_open", "1 when the provider's breaker is open, 0.5 half-open, 0 closed",
+    lambda: {
+        name: {"closed": 0, "half_open": 0.5, "open": 1}[snap["breaker"]["state"]]
+        for name, snap in snapshot().items()
+    },
+    ["provider"],
+)
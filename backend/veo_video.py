@@ -0,0 +1,115 @@
+"""
+Veo video generation pieces shared by the Flask app and the FastAPI app:
+request parsing, the generation config and the job status body. The
+job runners themselves live in each app (a worker thread in Flask, a
+task on the event loop in FastAPI) and use `video_jobs` for persistence.
+"""
+
+import os
+from pathlib import Path
+
+VEO_MODEL_NAME = os.environ.get("VEO_MODEL_NAME", "veo-3.1-generate-preview")
+# Background video jobs: worker pool size (Flask; only the submit and
+# download steps hold a worker, polling is left to the shared poller) or
+# concurrent tasks (FastAPI) and the on-disk job table shared by both
+VIDEO_MAX_WORKERS = int(os.environ.get("VIDEO_MAX_WORKERS", "2"))
+VIDEO_MAX_TASKS = int(os.environ.get("VIDEO_MAX_TASKS", "64"))
+VIDEO_JOBS_DB = os.environ.get(
+    "VIDEO_JOBS_DB", str(Path(__file__).parent / "var" / "video_jobs.sqlite3")
+)
+
+DEFAULT_VIDEO_PROMPT = (
+    "Create a 7‑second, ultra high‑resolution, 360‑degree, eye‑level orbit around a single human brain matching the provided CT/MRI reference image. "
+    "Subject is a medically accurate human brain with realistic cortical gyri and sulci; preserve anatomical proportions and density cues from the reference. "
+    "Camera performs a smooth, stabilized dolly‑orbit over the full duration. "
+    "Composition begins medium‑wide, transitions briefly to a medium shot revealing temporal and hippocampal contours, then returns to medium‑wide by the end. "
+    "Style is clinical, photorealistic medical visualization; no artistic liberties. "
+    "Deep focus with a 35–50mm feel; minimal lens breathing; no motion blur artifacts. "
+    "Neutral medium‑gray background with soft key and subtle rim light to accent form; balanced, natural contrast and color. "
+    "No text, logos, watermarks, or extraneous elements."
+)
+
+
+def _normalize_prompt(user_prompt, time_point):
+    # - If a list is provided (e.g., [{time_point, prompt}, ...]), pick by time_point or first available
+    # - If a dict is provided (e.g., {prompt: "..."}), extract "prompt"
+    # - Else expect a string
+    if isinstance(user_prompt, list):
+        chosen = None
+        if time_point:
+            for item in user_prompt:
+                if isinstance(item, dict) and item.get("time_point") == time_point and isinstance(item.get("prompt"), str):
+                    chosen = item.get("prompt")
+                    break
+        if not chosen:
+            for item in user_prompt:
+                if isinstance(item, dict) and isinstance(item.get("prompt"), str):
+                    chosen = item.get("prompt")
+                    break
+        if not chosen:
+            for item in user_prompt:
+                if isinstance(item, str):
+                    chosen = item
+                    break
+        return chosen
+    if isinstance(user_prompt, dict):
+        maybe = user_prompt.get("prompt")
+        return maybe if isinstance(maybe, str) else None
+    return user_prompt
+
+
+def job_params(payload: dict, base_url: str) -> dict:
+    """
+    Job parameters from a /model/generate_video body:
+    { "image_url": str?, "prompt": str | dict | list, "time_point": str?, "seconds": int? }
+    """
+    user_prompt = _normalize_prompt(payload.get("prompt"), payload.get("time_point"))
+    # Use normalized client prompt when available, otherwise fallback to a sensible default
+    return {
+        "prompt": user_prompt or DEFAULT_VIDEO_PROMPT,
+        "image_url": payload.get("image_url"),
+        "seconds": int(payload.get("seconds") or 7),
+        # Captured at submit time: the worker has no request context.
+        "base_url": base_url.rstrip("/"),
+    }
+
+
+def generate_config(ref=None):
+    """GenerateVideosConfig, conditioned on `ref` (a `ref_cache.RefImage`) if given."""
+    from google.genai import types
+
+    reference_images = []
+    if ref is not None:
+        reference_images.append(types.VideoGenerationReferenceImage(
+            image={
+                "bytesBase64Encoded": ref.b64,
+                "mimeType": ref.mime,
+            },
+            reference_type="inline",
+        ))
+    return types.GenerateVideosConfig(
+        reference_images=reference_images if reference_images else None,
+        # If duration is supported in your SDK version, you can add it here, e.g.:
+        # duration_seconds=params["seconds"],
+    )
+
+
+def pending_operation(name: str):
+    """Handle for a Veo operation started by an earlier worker."""
+    from google.genai import types
+
+    return types.GenerateVideosOperation(name=name)
+
+
+def job_response(job: dict) -> dict:
+    body = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "status_url": f"/model/generate_video/{job['id']}",
+    }
+    if job["result"]:
+        body.update(job["result"])
+    if job["error"]:
+        body["error"] = job["error"]
+    return body
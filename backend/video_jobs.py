@@ -0,0 +1,285 @@
+"""
+Background job queue for long-running video generation.
+
+Jobs are recorded in a small SQLite table so a restarted worker can pick
+up where the previous one stopped. Each job row carries a lease that the
+running worker refreshes on every progress update; jobs whose lease has
+expired (because their worker died) are reclaimed by `recover()`.
+
+The queue itself is generic: it is handed a `runner(job, report)` callable
+that does the actual work and calls `report(...)` to persist progress.
+A `JobQueue` runner may also hand off a long wait instead of blocking a
+worker on it: it returns a Future (see `then()`) that resolves to the
+job's next step, a no-argument callable that is then run on the pool and
+returns the result (or another such Future).
+`AsyncJobQueue` is the asyncio variant: jobs are tasks on the event loop
+rather than pool threads, so a process can hold many long-running jobs
+that mostly wait on the provider.
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS video_jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    stage TEXT,
+    params TEXT NOT NULL,
+    operation_name TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    lease_until REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS video_jobs_status ON video_jobs (status);
+"""
+
+
+class JobStore:
+    """SQLite-backed job table; one short-lived connection per call."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(str(self.path), timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self, params: dict) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO video_jobs (id, status, stage, params, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, QUEUED, json.dumps(params), now, now),
+            )
+        return job_id
+
+    def get(self, job_id: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM video_jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def update(self, job_id: str, lease_seconds: float = 0, **fields):
+        """Persist the given columns and push the job's lease forward."""
+        now = time.time()
+        fields["updated_at"] = now
+        if lease_seconds:
+            fields["lease_until"] = now + lease_seconds
+        if "result" in fields and fields["result"] is not None:
+            fields["result"] = json.dumps(fields["result"])
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE video_jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+
+    def claim(self, job_id: str, lease_seconds: float) -> bool:
+        """Take ownership of an unfinished job whose lease has expired."""
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE video_jobs SET lease_until = ?, updated_at = ? "
+                "WHERE id = ? AND status IN (?, ?) AND lease_until < ?",
+                (now + lease_seconds, now, job_id, QUEUED, RUNNING, now),
+            )
+        return cur.rowcount == 1
+
+    def unfinished(self):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM video_jobs WHERE status IN (?, ?) ORDER BY created_at",
+                (QUEUED, RUNNING),
+            ).fetchall()
+        return [_row_to_job(r) for r in rows]
+
+
+def _row_to_job(row) -> dict:
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+class JobQueue:
+    """Bounded worker pool that runs jobs recorded in a `JobStore`."""
+
+    def __init__(self, store: JobStore, runner, max_workers: int = 2, lease_seconds: float = 120):
+        self.store = store
+        self.runner = runner
+        self.lease_seconds = lease_seconds
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="video-job")
+
+    def submit(self, params: dict) -> str:
+        job_id = self.store.create(params)
+        self.store.claim(job_id, self.lease_seconds)
+        self._pool.submit(self._run, job_id)
+        return job_id
+
+    def recover(self) -> int:
+        """Re-enqueue queued/running jobs abandoned by a previous worker."""
+        resumed = 0
+        for job in self.store.unfinished():
+            if self.store.claim(job["id"], self.lease_seconds):
+                self._pool.submit(self._run, job["id"])
+                resumed += 1
+        return resumed
+
+    def _run(self, job_id: str):
+        job = self.store.get(job_id)
+        if job is None:
+            return
+
+        def report(stage: str, **fields):
+            self.store.update(job_id, self.lease_seconds, status=RUNNING, stage=stage, **fields)
+
+        report("starting")
+        self._step(job_id, lambda: self.runner(job, report))
+
+    def _step(self, job_id: str, step):
+        try:
+            result = step()
+        except Exception as e:
+            print(f"Video job {job_id} failed: {e}")
+            self.store.update(job_id, status=FAILED, stage=FAILED, error=str(e), lease_until=0)
+            return
+        if isinstance(result, Future):
+            # Waiting holds no worker; the next step is queued once it resolves.
+            result.add_done_callback(
+                lambda f: self._pool.submit(self._step, job_id, lambda: f.result()())
+            )
+            return
+        self.store.update(job_id, status=SUCCEEDED, stage=SUCCEEDED, result=result, lease_until=0)
+
+
+class AsyncJobQueue:
+    """
+    `JobQueue` for asyncio: each job runs `await runner(job, report)` as a
+    task, at most `max_running` at a time; `report` is a coroutine here.
+    Store access happens on worker threads.
+    """
+
+    def __init__(self, store: JobStore, runner, max_running: int = 64, lease_seconds: float = 120):
+        self.store = store
+        self.runner = runner
+        self.lease_seconds = lease_seconds
+        self._slots = asyncio.Semaphore(max_running)
+        self._tasks = set()
+
+    async def submit(self, params: dict) -> str:
+        job_id = await asyncio.to_thread(self.store.create, params)
+        await asyncio.to_thread(self.store.claim, job_id, self.lease_seconds)
+        self._spawn(job_id)
+        return job_id
+
+    async def recover(self) -> int:
+        """Resume queued/running jobs abandoned by a previous worker."""
+        resumed = 0
+        for job in await asyncio.to_thread(self.store.unfinished):
+            if await asyncio.to_thread(self.store.claim, job["id"], self.lease_seconds):
+                self._spawn(job["id"])
+                resumed += 1
+        return resumed
+
+    def _spawn(self, job_id: str):
+        task = asyncio.create_task(self._run(job_id), name=f"video-job-{job_id}")
+        # The loop only keeps weak references to tasks.
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job_id: str):
+        async with self._slots:
+            job = await asyncio.to_thread(self.store.get, job_id)
+            if job is None:
+                return
+
+            async def report(stage: str, **fields):
+                await asyncio.to_thread(
+                    self.store.update, job_id, self.lease_seconds, status=RUNNING, stage=stage, **fields
+                )
+
+            await report("starting")
+            try:
+                result = await self.runner(job, report)
+            except Exception as e:
+                print(f"Video job {job_id} failed: {e}")
+                await asyncio.to_thread(
+                    self.store.update, job_id, status=FAILED, stage=FAILED, error=str(e), lease_until=0
+                )
+                return
+            await asyncio.to_thread(
+                self.store.update, job_id, status=SUCCEEDED, stage=SUCCEEDED, result=result, lease_until=0
+            )
+
+
+def then(future: Future, step) -> Future:
+    """A Future resolving to `step` once `future` succeeds (or with its exception)."""
+    out = Future()
+
+    def done(f):
+        error = f.exception()
+        if error is not None:
+            out.set_exception(error)
+        else:
+            out.set_result(step)
+
+    future.add_done_callback(done)
+    return out
+
+
+_lock = threading.Lock()
+
+
+def lazy_queue(factory):
+    """Build the queue on first use and recover abandoned jobs at that point.
+
+    Deferring construction keeps the Flask reloader's parent process (which
+    imports the app but never serves requests) from resuming jobs itself.
+    """
+    holder = {}
+
+    def get():
+        with _lock:
+            if "queue" not in holder:
+                queue = factory()
+                resumed = queue.recover()
+                if resumed:
+                    print(f"Resumed {resumed} unfinished video job(s)")
+                holder["queue"] = queue
+            return holder["queue"]
+
+    return get
+
+
+def lazy_async_queue(factory):
+    """`lazy_queue` for `AsyncJobQueue`: `await get()` builds it and recovers jobs once."""
+    holder = {}
+    lock = asyncio.Lock()
+
+    async def get():
+        async with lock:
+            if "queue" not in holder:
+                queue = factory()
+                resumed = await queue.recover()
+                if resumed:
+                    print(f"Resumed {resumed} unfinished video job(s)")
+                holder["queue"] = queue
+            return holder["queue"]
+
+    return get
@@ -0,0 +1,148 @@
+"""
+Local progression-video renderer: turns a case's timepoint images into a
+short MP4 without calling Veo.
+
+Keyframes are decoded once, resized to a common even-sized frame and kept
+as float32 arrays. Each keyframe gets an equal share of the duration: it
+is held still for part of its slot, then cross-fades to the next with
+smoothstep easing; the last keyframe is held to the end. Blends are
+computed for a small chunk of frames at a time with one broadcast
+expression, and each chunk is written straight into ffmpeg's stdin (raw
+RGB24), so memory stays at "keyframes + one chunk" whatever the length.
+
+Encoding needs an ffmpeg binary (FFMPEG_BIN, default: the one on PATH);
+without it `render` raises `EncoderUnavailable`.
+"""
+
+import io
+import os
+import shutil
+import subprocess
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+CONFIG = {
+    "max_edge": int(os.environ.get("VIDEO_RENDER_MAX_EDGE", "720")),
+    "default_fps": int(os.environ.get("VIDEO_RENDER_FPS", "24")),
+    "default_seconds": float(os.environ.get("VIDEO_RENDER_SECONDS", "6")),
+    "max_fps": 60,
+    "max_seconds": 60,
+    # Fraction of each keyframe's slot spent holding it still.
+    "hold": 0.35,
+    "chunk_frames": 8,
+    "crf": int(os.environ.get("VIDEO_RENDER_CRF", "23")),
+    "preset": os.environ.get("VIDEO_RENDER_PRESET", "veryfast"),
+}
+
+
+class EncoderUnavailable(RuntimeError):
+    pass
+
+
+@dataclass
+class RenderReport:
+    frames: int
+    fps: int
+    width: int
+    height: int
+    bytes_out: int
+    seconds: float
+
+
+def ffmpeg_bin():
+    return os.environ.get("FFMPEG_BIN") or shutil.which("ffmpeg")
+
+
+def load_keyframes(images, max_edge: int = None) -> np.ndarray:
+    """
+    Decode images (bytes or file paths) into a (K, H, W, 3) float32 stack,
+    all resized to the first image's aspect ratio with even H and W.
+    """
+    max_edge = max_edge or CONFIG["max_edge"]
+    decoded = []
+    for item in images:
+        im = Image.open(io.BytesIO(item) if isinstance(item, (bytes, bytearray)) else item)
+        decoded.append(im.convert("RGB"))
+    if not decoded:
+        raise ValueError("No keyframes")
+    w, h = decoded[0].size
+    scale = min(1.0, max_edge / max(w, h))
+    size = (max(2, int(w * scale) // 2 * 2), max(2, int(h * scale) // 2 * 2))
+    return np.stack([np.asarray(im.resize(size, Image.BILINEAR), dtype=np.float32) for im in decoded])
+
+
+def blend_weights(n_frames: int, n_keyframes: int, hold: float):
+    """
+    For each output frame, (index of the keyframe it starts from, blend
+    weight towards the next one). Vectorized over all frames.
+    """
+    if n_keyframes == 1:
+        return np.zeros(n_frames, dtype=int), np.zeros(n_frames, dtype=np.float32)
+    # Every keyframe gets an equal slot; the last one is held to the end.
+    pos = np.arange(n_frames, dtype=np.float64) * n_keyframes / n_frames
+    slot = pos.astype(int)
+    t = np.clip((pos - slot - hold) / max(1e-6, 1 - hold), 0, 1)
+    t = t * t * (3 - 2 * t)  # smoothstep
+    last = slot >= n_keyframes - 1
+    seg = np.where(last, n_keyframes - 2, slot)
+    t = np.where(last, 1.0, t)
+    return seg, t.astype(np.float32)
+
+
+def iter_frames(keyframes: np.ndarray, n_frames: int, hold: float, chunk: int):
+    """Yield uint8 (n, H, W, 3) chunks of the rendered sequence."""
+    seg, weight = blend_weights(n_frames, len(keyframes), hold)
+    deltas = keyframes[1:] - keyframes[:-1] if len(keyframes) > 1 else None
+    for start in range(0, n_frames, chunk):
+        s = seg[start:start + chunk]
+        w = weight[start:start + chunk, None, None, None]
+        frames = keyframes[s] if deltas is None else keyframes[s] + deltas[s] * w
+        yield np.clip(frames + 0.5, 0, 255).astype(np.uint8)
+
+
+def render(keyframes: np.ndarray, out_path, fps: int = None, seconds: float = None, config: dict = None) -> RenderReport:
+    """Encode the progression to an H.264 MP4 at out_path."""
+    cfg = dict(CONFIG, **(config or {}))
+    binary = ffmpeg_bin()
+    if not binary:
+        raise EncoderUnavailable("ffmpeg not found; set FFMPEG_BIN or install ffmpeg")
+    fps = int(min(cfg["max_fps"], max(1, fps or cfg["default_fps"])))
+    seconds = float(min(cfg["max_seconds"], max(1, seconds or cfg["default_seconds"])))
+    n_frames = int(round(fps * seconds))
+    _, height, width, _ = keyframes.shape
+
+    started = time.perf_counter()
+    tmp_path = f"{out_path}.part"
+    proc = subprocess.Popen(
+        [
+            binary, "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+            "-c:v", "libx264", "-preset", cfg["preset"], "-crf", str(cfg["crf"]),
+            "-pix_fmt", "yuv420p", "-movflags", "+faststart", "-f", "mp4", tmp_path,
+        ],
+        stdin=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    try:
+        for frames in iter_frames(keyframes, n_frames, cfg["hold"], cfg["chunk_frames"]):
+            proc.stdin.write(frames.tobytes())
+        proc.stdin.close()
+    except BrokenPipeError:
+        pass  # ffmpeg died; its stderr says why
+    stderr = proc.stderr.read().decode("utf-8", "replace")
+    if proc.wait() != 0:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise RuntimeError(f"ffmpeg failed: {stderr.strip()[-500:]}")
+    os.replace(tmp_path, out_path)
+    return RenderReport(
+        frames=n_frames,
+        fps=fps,
+        width=width,
+        height=height,
+        bytes_out=os.path.getsize(out_path),
+        seconds=time.perf_counter() - started,
+    )
@@ -1,8 +1,8 @@
 "use client";
 
 import { createClient } from "@/lib/supabase/client";
-import { CaseData, ImageResult, PatientInfo, Timepoint } from "./types";
-import { requestGeneratedImages } from "./generator";
+import { CaseData, ImageMirrors, ImageResult, PatientInfo, Timepoint } from "./types";
+import { streamGeneratedImages } from "./generator";
 
 export type CaseRow = {
   id: string;
@@ -104,6 +104,8 @@ export async function generateImagesSupabase(params: {
   caseId: string;
   additionalPrompt?: string;
   timepoints?: Timepoint[];
+  // Called with each image as soon as the backend streams it.
+  onImage?: (image: ImageResult) => void;
 }): Promise<CaseData> {
   const supabase = createClient();
   const current = await getCaseSupabase(params.caseId);
@@ -117,18 +119,34 @@ export async function generateImagesSupabase(params: {
     : chosenBase;
 
   try {
-    // Call the Flask backend to generate actual images
-    const imageUrls = await requestGeneratedImages({
-      prompt: fullPrompt,
-      timepoints: tps,
-    });
+    // Call the Flask backend to generate actual images. Timepoints whose
+    // prompt did not change keep their current image (no new BFL job).
+    const promptsUsed: Partial<Record<Timepoint, string>> = {};
+    const mirrors: Partial<Record<Timepoint, ImageMirrors>> = {};
+    const imageUrls = await streamGeneratedImages(
+      { prompt: fullPrompt, timepoints: tps, previous: current.images },
+      (e) => {
+        if (e.event === "image") {
+          const promptUsed = e.data.prompt_used ?? fullPrompt;
+          promptsUsed[e.data.timepoint] = promptUsed;
+          mirrors[e.data.timepoint] = e.data.mirrors ?? undefined;
+          params.onImage?.({
+            url: e.data.url,
+            timepoint: e.data.timepoint,
+            promptUsed,
+            mirrors: e.data.mirrors ?? undefined,
+          });
+        }
+      }
+    );
 
     // Update the images object with the generated URLs
     for (const tp of tps) {
       nextImages[tp] = {
         url: imageUrls[tp] || placeholder(current.id, tp), // fallback to placeholder if generation fails
         timepoint: tp,
-        promptUsed: fullPrompt,
+        promptUsed: promptsUsed[tp] ?? fullPrompt,
+        mirrors: imageUrls[tp] ? mirrors[tp] : undefined,
       };
     }
   } catch (error) {
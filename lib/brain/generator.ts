@@ -1,19 +1,27 @@
 "use client";
 
-import { Timepoint } from "./types";
+import { ImageMirrors, ImageResult, Timepoint } from "./types";
 
 const BACKEND_URL = "http://127.0.0.1:5000"
 
 export async function requestGeneratedImages(input: {
-  prompt: string;
+  prompt: string | Partial<Record<Timepoint, string>>;
   timepoints?: Timepoint[];
-}): Promise<Partial<Record<Timepoint, string>>> {
+  // Repeats with the same key get the first response instead of new BFL jobs
+  idempotencyKey?: string;
+}): Promise<{
+  images: Partial<Record<Timepoint, string>>;
+  mirrors: Partial<Record<Timepoint, ImageMirrors>>;
+}> {
   if (!BACKEND_URL) {
     throw new Error("NEXT_PUBLIC_BACKEND_URL is not set");
   }
   const res = await fetch(`${BACKEND_URL}/model/generate_images`, {
     method: "POST",
-    headers: { "Content-Type": "application/json" },
+    headers: {
+      "Content-Type": "application/json",
+      ...(input.idempotencyKey ? { "Idempotency-Key": input.idempotencyKey } : {}),
+    },
     body: JSON.stringify({
       prompt: input.prompt,
       timepoints: input.timepoints ?? ["now", "3m", "6m", "12m"],
@@ -22,8 +30,74 @@ export async function requestGeneratedImages(input: {
   if (!res.ok) {
     throw new Error(`Backend error: ${res.status} ${res.statusText}`);
   }
-  const data = (await res.json()) as { images?: Partial<Record<Timepoint, string>> };
-  return data.images ?? {};
+  const data = (await res.json()) as {
+    images?: Partial<Record<Timepoint, string>>;
+    mirrors?: Partial<Record<Timepoint, ImageMirrors>>;
+  };
+  return { images: data.images ?? {}, mirrors: data.mirrors ?? {} };
 }
 
 
+export type ImageStreamEvent =
+  | { event: "progress"; data: { timepoint: Timepoint; polls: number; elapsed: number; status: string } }
+  | {
+      event: "image";
+      data: { timepoint: Timepoint; url: string; prompt_used?: string; reused?: boolean; mirrors?: ImageMirrors | null };
+    }
+  | { event: "error"; data: { timepoint: Timepoint; error: string } }
+  | {
+      event: "done";
+      data: {
+        images: Partial<Record<Timepoint, string | null>>;
+        prompts_used?: Partial<Record<Timepoint, string>>;
+        reused?: Timepoint[];
+        mirrors?: Partial<Record<Timepoint, ImageMirrors>>;
+        elapsed: number;
+      };
+    };
+
+// Same request as requestGeneratedImages, but each timepoint is reported
+// through onEvent as soon as the backend has it. Timepoints in `previous`
+// whose promptUsed matches the backend's composed prompt are reused as is.
+export async function streamGeneratedImages(
+  input: { prompt: string; timepoints?: Timepoint[]; previous?: Partial<Record<Timepoint, ImageResult>> },
+  onEvent: (e: ImageStreamEvent) => void
+): Promise<Partial<Record<Timepoint, string>>> {
+  const res = await fetch(`${BACKEND_URL}/model/generate_images/stream`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json", Accept: "text/event-stream" },
+    body: JSON.stringify({
+      prompt: input.prompt,
+      timepoints: input.timepoints ?? ["now", "3m", "6m", "12m"],
+      previous: input.previous,
+    }),
+  });
+  if (!res.ok || !res.body) {
+    throw new Error(`Backend error: ${res.status} ${res.statusText}`);
+  }
+
+  const images: Partial<Record<Timepoint, string>> = {};
+  const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += value;
+    let sep: number;
+    while ((sep = buffer.indexOf("\n\n")) !== -1) {
+      const block = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      let event = "message";
+      const dataLines: string[] = [];
+      for (const line of block.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) dataLines.push(line.slice(5).trim());
+      }
+      if (!dataLines.length) continue; // keepalive comment
+      const parsed = { event, data: JSON.parse(dataLines.join("\n")) } as ImageStreamEvent;
+      if (parsed.event === "image") images[parsed.data.timepoint] = parsed.data.url;
+      onEvent(parsed);
+    }
+  }
+  return images;
+}
@@ -1,15 +1,23 @@
 "use client";
 
-import { PatientInfo } from "./types";
+import { PatientInfo, Timepoint } from "./types";
 
 const BACKEND_URL = "http://127.0.0.1:5000"
 
+// One Gemini call returns the overall prompt and one prompt per timepoint.
+export type ModelPrompt = {
+  generatedPrompt: string;
+  prompts: Partial<Record<Timepoint, string>>;
+};
+
 export async function requestModelPrompt(input: {
   patient: PatientInfo;
   basePrompt: string;
   ehrFiles: File[];
   ctScans: File[];
-}): Promise<string | null> {
+  // Repeats with the same key get the first response instead of a new Gemini call
+  idempotencyKey?: string;
+}): Promise<ModelPrompt | null> {
   if (!BACKEND_URL) {
     return null;
   }
@@ -21,13 +29,20 @@ export async function requestModelPrompt(input: {
 
   const res = await fetch(`${BACKEND_URL}/model/prompt`, {
     method: "POST",
+    headers: input.idempotencyKey ? { "Idempotency-Key": input.idempotencyKey } : undefined,
     body: form,
   });
   if (!res.ok) {
     throw new Error(`Backend error: ${res.status} ${res.statusText}`);
   }
-  const data = (await res.json()) as { generated_prompt?: string };
-  return data.generated_prompt ?? null;
+  const data = (await res.json()) as {
+    generated_prompt?: string;
+    prompts?: Partial<Record<Timepoint, string>>;
+  };
+  if (!data.generated_prompt) {
+    return null;
+  }
+  return { generatedPrompt: data.generated_prompt, prompts: data.prompts ?? {} };
 }
 
 
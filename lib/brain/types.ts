@@ -14,10 +14,15 @@ export interface PatientInfo {
   notes?: string;
 }
 
+// Locally mirrored WebP copies of a generated image (see backend/image_mirror.py)
+export type ImageVariant = "thumb" | "preview" | "full";
+export type ImageMirrors = Partial<Record<ImageVariant, string>>;
+
 export interface ImageResult {
   url: string;
   timepoint: Timepoint;
   promptUsed: string;
+  mirrors?: ImageMirrors;
 }
 
 export interface CaseData {
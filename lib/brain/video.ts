@@ -1,6 +1,16 @@
 "use client";
 
 const BACKEND_URL = "http://127.0.0.1:5000"
+const VIDEO_POLL_MS = 5000;
+
+type VideoJob = {
+  job_id: string;
+  status: "queued" | "running" | "succeeded" | "failed";
+  stage?: string;
+  status_url: string;
+  video_url?: string;
+  error?: string;
+};
 
 export async function requestVeoVideo(input: {
   imageUrl: string;
@@ -22,11 +32,21 @@ export async function requestVeoVideo(input: {
   if (!res.ok) {
     throw new Error(`Backend error: ${res.status} ${res.statusText}`);
   }
-  const data = (await res.json()) as { video_url?: string };
-  if (!data.video_url) {
+  // The backend queues the Veo job and returns immediately; poll until done.
+  let job = (await res.json()) as VideoJob;
+  while (job.status === "queued" || job.status === "running") {
+    await new Promise((resolve) => setTimeout(resolve, VIDEO_POLL_MS));
+    const poll = await fetch(`${BACKEND_URL}${job.status_url}`);
+    if (!poll.ok) {
+      throw new Error(`Backend error: ${poll.status} ${poll.statusText}`);
+    }
+    job = (await poll.json()) as VideoJob;
+  }
+  if (job.status === "failed") {
+    throw new Error(`Video generation failed: ${job.error ?? "unknown error"}`);
+  }
+  if (!job.video_url) {
     throw new Error("No video_url in response");
   }
-  return data.video_url;
+  return job.video_url;
 }
-
-